@@ -7,7 +7,7 @@ from apps.common.mailer import send_transactional_email
 from apps.common.exceptions import ForbiddenValue, OverLimitException
 from apps.common.serializers import setup_eager_loading
 from apps.common.views import get_default_response, DefaultResultsSetPagination, LargeResultsSetPagination, \
-    MediumResultsSetPagination, remove_pks_from_payload, query_dict_to_dict
+    MediumResultsSetPagination, remove_pks_from_payload, query_dict_to_dict, VaryOnAcceptMixin
 from apps.communication.models import PushNotificationRecord
 from apps.communication.tasks import send_push_notification, update_device
 from apps.photo import models as photo_models
@@ -489,11 +489,13 @@ class MeViewSet(generics.GenericAPIView):
             # Save original photo to media
             try:
                 photo = Photo(payload['avatar'])
-                photo.save('AVATAR_NEW_USER_{}_{}'.format(common_models.get_date_stamp_str(), photo.name),
-                           custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
+                original = photo.save_original_async(
+                    'AVATAR_NEW_USER_{}_{}'.format(common_models.get_date_stamp_str(), photo.name),
+                    custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
 
-                # Process image to save
+                # Process image to save while the original uploads
                 payload['avatar'] = photo.compress()
+                original.result()
             except TypeError:
                 raise ValidationError('Avatar image is not of type image')
 
@@ -698,12 +700,13 @@ class MeProfileViewSet(generics.GenericAPIView):
             # Save original photo to media
             try:
                 photo = Photo(payload['cover_image'])
-                photo.save('COVER_u{}_{}_{}'
-                           .format(authenticated_user.id, common_models.get_date_stamp_str(), photo.name),
-                           custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
+                original = photo.save_original_async(
+                    'COVER_u{}_{}_{}'.format(authenticated_user.id, common_models.get_date_stamp_str(), photo.name),
+                    custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
 
-                # Process image to save
+                # Process image to save while the original uploads
                 payload['cover_image'] = photo.compress()
+                original.result()
             except TypeError:
                 raise ValidationError('Cover image is not of type image')
 
@@ -751,12 +754,14 @@ class MeProfileViewSet(generics.GenericAPIView):
                     # Save original photo to media
                     try:
                         photo = Photo(payload['cover_image'])
-                        photo.save('COVER_u{}_{}_{}'
-                                   .format(authenticated_user.id, common_models.get_date_stamp_str(), photo.name),
-                                   custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
+                        original = photo.save_original_async(
+                            'COVER_u{}_{}_{}'.format(authenticated_user.id, common_models.get_date_stamp_str(),
+                                                     photo.name),
+                            custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
 
-                        # Process image to save
+                        # Process image to save while the original uploads
                         payload['cover_image'] = photo.compress()
+                        original.result()
                     except TypeError:
                         raise ValidationError('Cover image is not of type image')
 
@@ -1059,7 +1064,7 @@ class UserLocationViewSet(generics.ListCreateAPIView):
         return response
 
 
-class UserPhotosViewSet(generics.ListAPIView):
+class UserPhotosViewSet(VaryOnAcceptMixin, generics.ListAPIView):
     """
     /api/users/{}/photos
     """
@@ -1098,10 +1103,7 @@ class UserPhotosViewSet(generics.ListAPIView):
         photos = photo_models.Photo.objects.filter(user=user, public=True).order_by('-id')
         paginated_photos = self.paginate_queryset(photos)
 
-        serialized_items = list()
-
-        for photo in paginated_photos:
-            serialized_items.append(self.serializer_class(photo, context={"request": request}).data)
+        serialized_items = self.serializer_class(paginated_photos, many=True, context={"request": request}).data
 
         response = self.get_paginated_response(serialized_items)
 
@@ -1379,7 +1381,7 @@ class UserSingleStarsViewSet(generics.CreateAPIView, generics.RetrieveDestroyAPI
         return response
 
 
-class UserStarredPhotosViewSet(generics.ListAPIView):
+class UserStarredPhotosViewSet(VaryOnAcceptMixin, generics.ListAPIView):
     """
         API view to retrieve the photos starred by the accessing user
 
@@ -1430,11 +1432,13 @@ class UserViewSet(generics.CreateAPIView):
             # Save original photo to media
             try:
                 photo = Photo(payload['avatar'])
-                photo.save('AVATAR_NEW_USER_{}_{}'.format(common_models.get_date_stamp_str(), photo.name),
-                           custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
+                original = photo.save_original_async(
+                    'AVATAR_NEW_USER_{}_{}'.format(common_models.get_date_stamp_str(), photo.name),
+                    custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
 
-                # Process image to save
+                # Process image to save while the original uploads
                 payload['avatar'] = photo.compress()
+                original.result()
             except TypeError:
                 raise ValidationError('Avatar image is not of type image')
 
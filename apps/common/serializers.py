@@ -1,3 +1,4 @@
+from apps.photo.photo import get_render_width
 from django.utils import timezone
 from rest_framework import serializers
 
@@ -11,43 +12,19 @@ def setup_eager_loading(get_queryset):
 
 
 def determine_render(context):
-    width = int(context["request"].query_params.get("width"))
-    height = int(context["request"].query_params.get("height"))
-
-    if 246 <= width < 272:
-        render_string = "image_tiny_246"
-    elif 272 <= width < 640:
-        render_string = "image_tiny_272"
-    elif 640 <= width < 750:
-        render_string = "image_small"
-    elif 750 <= width < 1242:
-        render_string = "image_small_2"
-    elif 1242 <= width < 2048:
-        render_string = "image_medium"
-    else:
-        render_string = "image"
-
-    if width > 0:
-        ratio = height / width
-    else:
-        ratio = 1.0
-
-    render_width, render_height = size_for(width, height, ratio)
-    render_dimensions = {
-        "width": render_width,
-        "height": render_height
-    }
-
-    if fits(width, height, render_dimensions):
-        return render_string
-
-
-def size_for(width, height, ratio):
-    return width, width * ratio
+    """
+    Return the render width for the width in the request's query parameters. Renders keep the aspect ratio of the
+    photo, so the height is not needed.
 
+    :param context: serializer context holding the request
+    :return: one of PHOTO_RENDER_WIDTHS
+    """
+    try:
+        width = int(context["request"].query_params.get("width"))
+    except (TypeError, ValueError):
+        raise serializers.ValidationError('Expecting a number for width')
 
-def fits(width, height, render_dimensions):
-    return width <= render_dimensions["width"] and height <= render_dimensions["height"]
+    return get_render_width(width)
 
 
 class DateTimeFieldWithTZ(serializers.DateTimeField):
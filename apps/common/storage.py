@@ -0,0 +1,153 @@
+from boto3.s3.transfer import TransferConfig
+from boto3.session import Session
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from storages.backends.s3boto3 import S3Boto3Storage
+import os
+import threading
+
+# Independent uploads of a request (e.g. an original and its compressed copy) run here side by side
+UPLOADS = ThreadPoolExecutor(max_workers=settings.STORAGE_UPLOAD_THREADS)
+
+_storages = dict()
+_storages_lock = threading.Lock()
+
+
+class TunedObject(object):
+    """
+    Wrap a boto3 S3 Object so that uploads made through it use the given transfer configuration
+    """
+    def __init__(self, obj, transfer_config):
+        self.obj = obj
+        self.transfer_config = transfer_config
+
+    def __getattr__(self, name):
+        return getattr(self.obj, name)
+
+    def upload_fileobj(self, fileobj, **kwargs):
+        kwargs.setdefault('Config', self.transfer_config)
+
+        return self.obj.upload_fileobj(fileobj, **kwargs)
+
+
+class PooledS3Storage(S3Boto3Storage):
+    """
+    S3 storage that is created once per bucket and kept for the life of the process, so its boto3 session and
+    connection pool are reused across requests. Multipart thresholds are taken from settings. Files can be given a
+    Cache-Control header.
+
+    Each storage connects through a boto3 session of its own instead of boto3's default session, which is not thread
+    safe.
+    """
+    def __init__(self, *args, **kwargs):
+        self.cache_control = kwargs.pop('cache_control', None)
+        super(PooledS3Storage, self).__init__(*args, **kwargs)
+        self.connection_class = Session().resource
+        self.transfer_config = TransferConfig(
+            multipart_threshold=settings.AWS_S3_MULTIPART_THRESHOLD,
+            multipart_chunksize=settings.AWS_S3_MULTIPART_CHUNKSIZE,
+            max_concurrency=settings.AWS_S3_MAX_CONCURRENCY)
+
+    def _save_content(self, obj, content, parameters):
+        if self.cache_control:
+            parameters = dict(parameters, CacheControl=self.cache_control)
+
+        return super(PooledS3Storage, self)._save_content(TunedObject(obj, self.transfer_config), content, parameters)
+
+
+def get_storage(bucket=None, cache_control=None):
+    """
+    Return the long-lived storage for a bucket
+
+    :param bucket: name of the bucket, or None for the default bucket in settings.py
+    :param cache_control: Cache-Control header to store files with
+    :return: PooledS3Storage
+    """
+    key = (bucket, cache_control)
+    storage = _storages.get(key)
+
+    if storage is None:
+        with _storages_lock:
+            storage = _storages.get(key)
+
+            if storage is None:
+                kwargs = {'cache_control': cache_control}
+
+                if bucket:
+                    kwargs['bucket'] = bucket
+
+                storage = PooledS3Storage(**kwargs)
+
+                # The storage is shared by the upload threads, so its connection and bucket are created before any
+                # of them can use it
+                storage.bucket
+                _storages[key] = storage
+
+    return storage
+
+
+def upload_async(function, *args, **kwargs):
+    """
+    Run an upload in the shared upload pool
+
+    :param function: function performing the upload
+    :param args: positional arguments for the function
+    :param kwargs: keyword arguments for the function
+    :return: Future resolving to whatever the function returns
+    """
+    return UPLOADS.submit(function, *args, **kwargs)
+
+
+def get_presigned_post(bucket, name, max_size, expires):
+    """
+    Return the URL and form fields a client can use to POST a file straight to a bucket
+
+    :param bucket: name of the bucket
+    :param name: name the file will be stored under
+    :param max_size: largest file accepted, in bytes
+    :param expires: number of seconds the POST stays valid
+    :return: dict with "url" and "fields"
+    """
+    storage = get_storage(bucket)
+
+    return storage.bucket.meta.client.generate_presigned_post(
+        Bucket=storage.bucket_name, Key=name, Conditions=[['content-length-range', 1, max_size]], ExpiresIn=expires)
+
+
+def download(bucket, name, file):
+    """
+    Download a file from a bucket into a file object
+
+    :param bucket: name of the bucket
+    :param name: name of the stored file
+    :param file: writable binary file object
+    :return: None
+    """
+    storage = get_storage(bucket)
+    storage.bucket.download_fileobj(name, file, Config=storage.transfer_config)
+
+
+def list_files(storage, prefix):
+    """
+    List every file below a directory of a storage, with one request per 1000 files on S3
+
+    :param storage: Django storage instance
+    :param prefix: directory to list, e.g. "renditions"
+    :return: generator of (name, last modified datetime) tuples
+    """
+    if isinstance(storage, S3Boto3Storage):
+        location = storage.location.strip('/') + '/' if storage.location else ''
+
+        for obj in storage.bucket.objects.filter(Prefix=storage._normalize_name(prefix) + '/'):
+            yield obj.key[len(location):], obj.last_modified
+    else:
+        if not storage.exists(prefix):
+            return
+
+        directories, files = storage.listdir(prefix)
+
+        for name in files:
+            yield os.path.join(prefix, name), storage.get_modified_time(os.path.join(prefix, name))
+
+        for directory in directories:
+            yield from list_files(storage, os.path.join(prefix, directory))
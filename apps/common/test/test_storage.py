@@ -0,0 +1,71 @@
+from apps.common import storage as common_storage
+from apps.photo.photo import Photo
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.test import override_settings, TestCase
+from moto import mock_s3
+from unittest import mock
+import boto3
+import os
+
+
+@mock_s3
+@mock.patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing'})
+class TestStorage(TestCase):
+    """
+    Test the long-lived per-bucket storages against a mocked S3
+    """
+    def setUp(self):
+        """
+            Create the buckets
+
+        :return: None
+        """
+        self.client = boto3.client('s3', region_name='us-east-1')
+        self.client.create_bucket(Bucket='aov-test-originals')
+        self.client.create_bucket(Bucket='aov-test-audio')
+
+    def test_get_storage_reused_per_bucket(self):
+        """
+        Test that each bucket gets one storage which is reused
+
+        :return: None
+        """
+        storage = common_storage.get_storage('aov-test-originals')
+
+        self.assertIs(common_storage.get_storage('aov-test-originals'), storage)
+        self.assertIsNot(common_storage.get_storage('aov-test-audio'), storage)
+        self.assertEquals(storage.transfer_config.multipart_threshold, settings.AWS_S3_MULTIPART_THRESHOLD)
+
+    def test_get_storage_save(self):
+        """
+        Test that files are uploaded through the pooled storage
+
+        :return: None
+        """
+        common_storage.get_storage('aov-test-audio').save('sample.mp3', ContentFile(b'audio'))
+
+        body = self.client.get_object(Bucket='aov-test-audio', Key='sample.mp3')['Body'].read()
+
+        self.assertEquals(body, b'audio')
+
+    @override_settings(REMOTE_IMAGE_STORAGE=True)
+    def test_photo_save_original_concurrent(self):
+        """
+        Test that the original is uploaded byte-for-byte while the compressed copy is encoded and uploaded
+
+        :return: None
+        """
+        file = 'apps/common/test/data/photos/cover.jpg'
+
+        photo = Photo(open(file, 'rb'))
+        original = photo.save_original_async('original.jpg', custom_bucket='aov-test-originals')
+        compressed = common_storage.upload_async(common_storage.get_storage('aov-test-audio').save,
+                                                 'compressed.jpg', photo.compress())
+
+        self.assertEquals(original.result(), 'original.jpg')
+        self.assertEquals(compressed.result(), 'compressed.jpg')
+
+        with open(file, 'rb') as f:
+            self.assertEquals(self.client.get_object(Bucket='aov-test-originals', Key='original.jpg')['Body'].read(),
+                              f.read())
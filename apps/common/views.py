@@ -1,4 +1,5 @@
 from django.http import QueryDict
+from django.utils.cache import patch_vary_headers
 from rest_framework import status
 from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
@@ -144,3 +145,15 @@ class MediumResultsSetPagination(PageNumberPagination):
     page_size = 100
     page_size_query_param = 'page_size'
     max_page_size = 500
+
+
+class VaryOnAcceptMixin(object):
+    """
+    Adds Accept to the Vary header of the view's responses. Views that serialize photos use it because the rendition
+    URLs they return depend on the image formats the client accepts.
+    """
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(VaryOnAcceptMixin, self).finalize_response(request, response, *args, **kwargs)
+        patch_vary_headers(response, ['Accept'])
+
+        return response
@@ -1,5 +1,5 @@
 from apps.account.models import User, Blocked
-from apps.common.views import get_default_response, LargeResultsSetPagination
+from apps.common.views import get_default_response, LargeResultsSetPagination, VaryOnAcceptMixin
 from apps.communication.models import PushNotificationRecord, DirectMessage, Conversation
 from apps.communication.serializers import (
     AOVFCMDeviceSerializer, PushNotificationRecordSerializer, DirectMessageSerializer, ConversationSerializer
@@ -339,7 +339,7 @@ class DirectMessageMarkReadViewSet(generics.CreateAPIView):
         return response
 
 
-class UserNotificationRecordViewSet(generics.ListCreateAPIView):
+class UserNotificationRecordViewSet(VaryOnAcceptMixin, generics.ListCreateAPIView):
     """
         /api/users/me/notifications
 
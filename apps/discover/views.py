@@ -1,5 +1,5 @@
 from apps.common.exceptions import MissingRequiredFieldException
-from apps.common.views import get_default_response, DefaultResultsSetPagination
+from apps.common.views import get_default_response, DefaultResultsSetPagination, VaryOnAcceptMixin
 from apps.discover import models as discover_models
 from apps.discover import serializers as discover_serializers
 from apps.photo.serializers import PhotoRenderSerializer, PhotoCustomRenderSerializer
@@ -117,7 +117,7 @@ class StateSponsorView(generics.ListAPIView):
             return discover_models.StateSponsor.objects.none()
 
 
-class StatePhotoView(generics.ListAPIView):
+class StatePhotoView(VaryOnAcceptMixin, generics.ListAPIView):
     """
     Endpoint to retrieve StateSponsors
 
@@ -2,7 +2,6 @@ from apps.account import models as account_models
 from apps.photo import forms as photo_forms
 from apps.photo import models as photo_models
 from apps.photo.photo import Photo
-from apps.utils.models import UserAction
 from django import urls
 from django.conf import settings
 from django.contrib import admin
@@ -24,7 +23,7 @@ class FlaggedPhoto(photo_models.Photo):
 class FlaggedPhotoAdmin(admin.ModelAdmin):
     filter_horizontal = ('category', 'tag', 'photo_feed')
 
-    list_display = ('photo_tag', 'user_info', 'public', 'location', 'photo_clicks', 'id',)
+    list_display = ('photo_tag', 'user_info', 'public', 'location', 'photo_clicks', 'similar_photos', 'id',)
     ordering = ('-id',)
     readonly_fields = ('coordinates', 'created_at', 'location', 'original_image_url', 'photo_clicks', 'user',)
     search_fields = ('id', 'image', 'user__email', 'user__social_name', 'user__username',)
@@ -32,9 +31,7 @@ class FlaggedPhotoAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         queryset = super(FlaggedPhotoAdmin, self).get_queryset(request)
 
-        flag_actions = UserAction.objects.filter(action='photo_flag')
-
-        return queryset.filter(id__in=[f.object_id for f in flag_actions])
+        return queryset.filter(flag_count__gt=0)
 
     def has_add_permission(self, request):
         if settings.DEBUG:
@@ -55,13 +52,27 @@ class FlaggedPhotoAdmin(admin.ModelAdmin):
         :param obj: instance of Photo
         :return: String w/ photo view count
         """
-        view_count = obj.user_action.filter(action='photo_click')
-
-        return '{}'.format(len(view_count))
+        return '{}'.format(obj.click_count)
 
+    photo_clicks.admin_order_field = 'click_count'
     photo_clicks.allow_tags = True
     photo_clicks.short_description = 'Clicks'
 
+    def similar_photos(self, obj):
+        """
+        Link to the photos that look like this one
+
+        :param obj: instance of Photo
+        :return: String w/ HTML
+        """
+        if obj.perceptual_hash is None:
+            return '--empty--'
+
+        return format_html('<a href="/admin/photos/{}/similar/">Similar</a>', obj.id)
+
+    similar_photos.allow_tags = True
+    similar_photos.short_description = 'Similar'
+
     def user_info(self, obj):
         if obj.user:
             link = urls.reverse("admin:account_user_change", args=[obj.user.id])
@@ -272,10 +283,9 @@ class PhotoAdmin(GuardedModelAdmin):
         :param obj: instance of Photo
         :return: String w/ photo view count
         """
-        view_count = obj.user_action.filter(action='photo_click')
-
-        return '{}'.format(len(view_count))
+        return '{}'.format(obj.click_count)
 
+    photo_clicks.admin_order_field = 'click_count'
     photo_clicks.allow_tags = True
     photo_clicks.short_description = 'Clicks'
 
@@ -388,10 +398,9 @@ class PhotoFeedPhotoAdmin(admin.ModelAdmin):
         :param obj: instance of Photo
         :return: String w/ photo view count
         """
-        view_count = obj.user_action.filter(action='photo_click')
-
-        return '{}'.format(len(view_count))
+        return '{}'.format(obj.click_count)
 
+    photo_clicks.admin_order_field = 'click_count'
     photo_clicks.allow_tags = True
     photo_clicks.short_description = 'Clicks'
 
@@ -458,10 +467,9 @@ class StarredPhotoAdmin(admin.ModelAdmin):
         :param obj: instance of Photo
         :return: String w/ photo view count
         """
-        view_count = obj.user_action.filter(action='photo_click')
-
-        return '{}'.format(len(view_count))
+        return '{}'.format(obj.click_count)
 
+    photo_clicks.admin_order_field = 'click_count'
     photo_clicks.allow_tags = True
     photo_clicks.short_description = 'Clicks'
 
@@ -0,0 +1,107 @@
+import multiprocessing
+import resource
+import time
+
+
+def measure(function, *args):
+    """
+    Time a call and record how far it pushed the peak resident memory of the process
+
+    :param function: function to call
+    :param args: arguments for the function
+    :return: tuple of (function result, seconds, peak memory growth in KB)
+    """
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - start
+
+    return result, elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start_rss
+
+
+def measure_isolated(function, *args):
+    """
+    Run measure() in a fresh child process so memory peaks of earlier runs do not hide those of later ones
+
+    :param function: module level function to call
+    :param args: arguments for the function
+    :return: tuple of (function result, seconds, peak memory growth in KB)
+    """
+    with multiprocessing.get_context('fork').Pool(processes=1, maxtasksperchild=1) as pool:
+        return pool.apply(measure, (function,) + args)
+
+
+def percentile(values, fraction):
+    """
+    Return a percentile of a list of values, interpolating between the closest ranks
+
+    :param values: list of numbers
+    :param fraction: percentile as a fraction, e.g. 0.95
+    :return: number
+    """
+    values = sorted(values)
+    rank = (len(values) - 1) * fraction
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
+
+
+def summarize(runs, parallel_seconds=None, workers=1):
+    """
+    Reduce the runs of one stage on one image to latency percentiles, throughput and memory
+
+    :param runs: list of (result, seconds, peak memory growth in KB) tuples from measure()
+    :param parallel_seconds: wall time of running the stage len(runs) times on each of the workers at once
+    :param workers: number of processes the parallel run used
+    :return: dict
+    """
+    seconds = [run[1] for run in runs]
+    mean = sum(seconds) / len(seconds)
+
+    # Without a parallel run, one core handles one image per mean latency
+    if parallel_seconds:
+        per_core = len(runs) / parallel_seconds
+    else:
+        per_core = 1 / mean if mean else 0
+
+    return {
+        'runs': len(runs),
+        'mean_ms': round(mean * 1000, 2),
+        'p50_ms': round(percentile(seconds, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(seconds, 0.95) * 1000, 2),
+        'p99_ms': round(percentile(seconds, 0.99) * 1000, 2),
+        'throughput_per_core': round(per_core, 2),
+        'workers': workers,
+        'peak_rss_kb': max(run[2] for run in runs),
+    }
+
+
+def measure_parallel(workers, count, function, *args):
+    """
+    Run a function count times in each of several processes at once, to see how a stage scales across cores
+
+    :param workers: number of processes
+    :param count: number of calls per process
+    :param function: module level function to call
+    :param args: arguments for the function
+    :return: wall time in seconds
+    """
+    with multiprocessing.get_context('fork').Pool(processes=workers) as pool:
+        start = time.perf_counter()
+        pool.starmap(call_repeatedly, [(count, function) + args] * workers)
+
+        return time.perf_counter() - start
+
+
+def call_repeatedly(count, function, *args):
+    """
+    Call a function several times in a row
+
+    :param count: number of calls
+    :param function: function to call
+    :param args: arguments for the function
+    :return: None
+    """
+    for _ in range(count):
+        function(*args)
@@ -0,0 +1,64 @@
+from apps.photo import models as photo_models
+from apps.photo.photo import read_stored_image_header
+from apps.utils.commands import read_checkpoint, TermColor, write_checkpoint
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Store width, height, byte size and format for photos uploaded before they were recorded'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b',
+                            action='store',
+                            dest='batch_size',
+                            default=500,
+                            type=int,
+                            help='Number of photos to load per query, default 500')
+        parser.add_argument('-c',
+                            action='store',
+                            dest='checkpoint',
+                            default='photo_dimensions_checkpoint.txt',
+                            help='File used to resume from the last processed photo')
+        parser.add_argument('--restart',
+                            action='store_true',
+                            dest='restart',
+                            default=False,
+                            help='Ignore the checkpoint and start from the first photo')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checkpoint = options['checkpoint']
+        last_id = 0 if options['restart'] else read_checkpoint(checkpoint)
+        processed = 0
+        failed = 0
+
+        while True:
+            # Keyset pagination keeps every batch query cheap no matter how far along we are
+            photos = list(photo_models.Photo.objects.filter(id__gt=last_id, image_width__isnull=True)
+                          .order_by('id').only('id', 'image')[:batch_size])
+
+            if not photos:
+                break
+
+            for photo in photos:
+                last_id = photo.id
+
+                try:
+                    metadata = read_stored_image_header(photo.image.storage, photo.image.name)
+                except Exception as e:
+                    metadata = None
+                    print(TermColor.FAIL + 'Photo {}: {}'.format(photo.id, e) + TermColor.ENDC)
+
+                if metadata:
+                    width, height, image_format, size = metadata
+                    photo_models.Photo.objects.filter(id=photo.id).update(
+                        image_format=image_format, image_height=height, image_size=size, image_width=width)
+                    processed += 1
+                else:
+                    failed += 1
+
+            write_checkpoint(checkpoint, last_id)
+            print(TermColor.OKBLUE + 'Processed up to photo {} ({} updated, {} failed)'.format(
+                last_id, processed, failed) + TermColor.ENDC)
+
+        print(TermColor.OKGREEN + 'Done: {} updated, {} failed'.format(processed, failed) + TermColor.ENDC)
@@ -0,0 +1,78 @@
+from apps.photo.benchmark import measure_isolated
+from apps.photo.photo import Photo
+from apps.utils.commands import TermColor
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.management import BaseCommand
+from io import BytesIO
+
+
+def compress_copying(path):
+    """
+    Compress the way Photo.compress() used to: copy the encoded bytes out of the encoder's buffer into a ContentFile
+    before wrapping it for upload
+
+    :param path: path to the image
+    :return: number of bytes handed to storage
+    """
+    photo = Photo(open(path, 'rb'))
+    photo.resize()
+
+    mem_img = BytesIO()
+    photo.pillow_image.save(fp=mem_img, format='JPEG', icc_profile=photo.pillow_image.info.get('icc_profile'),
+                            quality=80)
+    content = ContentFile(mem_img.getvalue())
+
+    return store(InMemoryUploadedFile(content, None, photo.name, 'image/jpeg', content.tell, None))
+
+
+def compress_handing_over(path):
+    """
+    Compress through Photo.compress(), which hands the encoder's buffer straight to storage
+
+    :param path: path to the image
+    :return: number of bytes handed to storage
+    """
+    return store(Photo(open(path, 'rb')).compress())
+
+
+def store(uploaded_file):
+    """
+    Read an uploaded file the way a storage backend does when saving it
+
+    :param uploaded_file: file to store
+    :return: number of bytes read
+    """
+    uploaded_file.seek(0)
+
+    return sum(len(chunk) for chunk in uploaded_file.chunks())
+
+
+class Command(BaseCommand):
+    help = 'Compare peak memory and time of compressing uploads with and without copying the encoded image'
+
+    def add_arguments(self, parser):
+        parser.add_argument('images',
+                            nargs='+',
+                            help='Paths of the images to compress')
+        parser.add_argument('-r',
+                            action='store',
+                            dest='repeat',
+                            default=3,
+                            type=int,
+                            help='Number of runs to keep the best time of, default 3')
+
+    def handle(self, *args, **options):
+        for path in options['images']:
+            results = dict()
+
+            for compress in (compress_copying, compress_handing_over):
+                runs = [measure_isolated(compress, path) for _ in range(options['repeat'])]
+                results[compress] = (runs[0][0], min(r[1] for r in runs), max(r[2] for r in runs))
+
+            copying, handing_over = results[compress_copying], results[compress_handing_over]
+
+            print(TermColor.OKBLUE + '{} ({} KB encoded)  copying {:7.1f} ms {:8} KB peak  '
+                                     'handing over {:7.1f} ms {:8} KB peak'.format(
+                                        path, copying[0] // 1024, copying[1] * 1000, copying[2],
+                                        handing_over[1] * 1000, handing_over[2]) + TermColor.ENDC)
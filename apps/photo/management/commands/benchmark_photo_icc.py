@@ -0,0 +1,74 @@
+from apps.photo.photo import convert_to_srgb, get_srgb_transform
+from apps.utils.commands import TermColor
+from django.core.management import BaseCommand
+from PIL import Image as PillowImage
+from PIL import ImageCms
+from PIL.ImageCms import PyCMSError
+import io
+import os
+import tempfile
+import time
+
+
+def convert_with_temp_file(image):
+    """
+    Colour conversion as it was done before transforms were cached: parse the profile, write it to a temporary file
+    and let profileToProfile build a new transform
+
+    :param image: PIL Image
+    :return: converted Image, or the original one if it needs no conversion
+    """
+    try:
+        profile = ImageCms.ImageCmsProfile(io.BytesIO(image.info.get('icc_profile')))
+        profile_name = ImageCms.getProfileName(profile)
+    except (OSError, PyCMSError, TypeError):
+        return image
+
+    if 'Adobe RGB' not in profile_name and 'Reference Output Medium' not in profile_name:
+        return image
+
+    icc = tempfile.mkstemp(suffix='.icc')[1]
+
+    with open(icc, 'wb') as f:
+        f.write(image.info.get('icc_profile'))
+
+    image = ImageCms.profileToProfile(image, icc, ImageCms.createProfile('sRGB'))
+    os.remove(icc)
+
+    return image
+
+
+class Command(BaseCommand):
+    help = 'Compare colour conversion latency of cached in-memory transforms against the temporary file path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('images',
+                            nargs='+',
+                            help='Paths of the images to convert, ideally Adobe RGB or ProPhoto RGB photos')
+        parser.add_argument('-n',
+                            action='store',
+                            dest='iterations',
+                            default=20,
+                            type=int,
+                            help='Number of conversions per image, default 20')
+
+    def handle(self, *args, **options):
+        for path in options['images']:
+            image = PillowImage.open(path)
+            image.load()
+            converted = get_srgb_transform(image.info.get('icc_profile'), image.mode) is not None
+            timings = dict()
+
+            for convert in (convert_with_temp_file, convert_to_srgb):
+                start = time.perf_counter()
+
+                for _ in range(options['iterations']):
+                    convert(image.copy())
+
+                timings[convert] = (time.perf_counter() - start) / options['iterations']
+
+            print((TermColor.OKGREEN if converted else TermColor.WARNING) +
+                  '{}: {}  temp file {:7.2f} ms  cached {:7.2f} ms  speedup {:4.1f}x'.format(
+                      path, 'converted' if converted else 'no conversion needed',
+                      timings[convert_with_temp_file] * 1000, timings[convert_to_srgb] * 1000,
+                      timings[convert_with_temp_file] / timings[convert_to_srgb]) + TermColor.ENDC)
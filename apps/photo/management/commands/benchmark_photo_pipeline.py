@@ -0,0 +1,379 @@
+from apps.photo.benchmark import measure, measure_isolated, measure_parallel, summarize
+from apps.photo.models import PHOTO_RENDITION_SPECS
+from apps.photo.photo import (BlurResize, generate_renditions, get_blurhash, get_perceptual_hash, Photo,
+                              read_image_header, RENDITION_FORMAT_OPTIONS, RENDITION_FORMATS, WidthResize)
+from apps.utils.commands import TermColor
+from django.core.management import BaseCommand, CommandError
+from PIL import Image as PillowImage
+from PIL import ImageCms
+from PIL.ImageCms import PyCMSError
+from types import SimpleNamespace
+import io
+import json
+import os
+import platform
+import PIL
+
+SEED_IMAGE = 'apps/common/test/data/photos/1mb.jpg'
+SYNTHETIC_MEGAPIXELS = (12, 24, 50)
+IMAGE_EXTENSIONS = ('.jpeg', '.jpg', '.png')
+
+
+def stage_header(path):
+    """
+    Read the dimensions and format from the start of the file, as uploads are checked before decoding
+
+    :param path: path to the image
+    :return: header tuple
+    """
+    with open(path, 'rb') as f:
+        return read_image_header(f)
+
+
+def stage_convert(path):
+    """
+    Decode an upload and convert it to sRGB, as Photo() does
+
+    :param path: path to the image
+    :return: None
+    """
+    with open(path, 'rb') as f:
+        Photo(f).pillow_image.load()
+
+
+def stage_resize(path):
+    """
+    Decode an upload and resize it to the stored width, as Photo.resize() does
+
+    :param path: path to the image
+    :return: None
+    """
+    with open(path, 'rb') as f:
+        Photo(f).resize()
+
+
+def stage_compress(path):
+    """
+    Decode, resize and encode an upload, the whole of Photo.compress()
+
+    :param path: path to the image
+    :return: number of encoded bytes
+    """
+    with open(path, 'rb') as f:
+        return Photo(f).compress().size
+
+
+def stage_width_resize(path):
+    """
+    Produce a 640px rendition with WidthResize
+
+    :param path: path to the image
+    :return: None
+    """
+    WidthResize(640).process(PillowImage.open(path))
+
+
+def stage_blur_resize(path):
+    """
+    Produce the blurred placeholder rendition with BlurResize
+
+    :param path: path to the image
+    :return: None
+    """
+    BlurResize().process(PillowImage.open(path))
+
+
+def stage_renditions(path):
+    """
+    Produce every rendition in every format from one decode, as Photo.generate_renditions() does
+
+    :param path: path to the image
+    :return: total encoded bytes
+    """
+    generators = {
+        '{}_{}'.format(name, image_format): SimpleNamespace(
+            autoconvert=True, format=image_format, processors=processors,
+            options=options if image_format == 'JPEG' else RENDITION_FORMAT_OPTIONS[image_format])
+        for name, (processors, options) in PHOTO_RENDITION_SPECS.items() for image_format in RENDITION_FORMATS
+    }
+
+    return sum(len(f.getvalue()) for f in generate_renditions(PillowImage.open(path), generators).values())
+
+
+def stage_blurhash(path):
+    """
+    Compute the BlurHash placeholder of an image that has not been decoded yet
+
+    :param path: path to the image
+    :return: BlurHash string
+    """
+    return get_blurhash(PillowImage.open(path))
+
+
+def stage_perceptual_hash(path):
+    """
+    Compute the perceptual hash of an image that has not been decoded yet
+
+    :param path: path to the image
+    :return: perceptual hash
+    """
+    return get_perceptual_hash(PillowImage.open(path))
+
+
+STAGES = {
+    'header': stage_header,
+    'convert': stage_convert,
+    'resize': stage_resize,
+    'compress': stage_compress,
+    'width_resize': stage_width_resize,
+    'blur_resize': stage_blur_resize,
+    'renditions': stage_renditions,
+    'blurhash': stage_blurhash,
+    'perceptual_hash': stage_perceptual_hash,
+}
+
+
+def describe_image(path):
+    """
+    Sort an image into one of the corpus classes the pipeline treats differently
+
+    :param path: path to the image
+    :return: tuple of (class name, megapixels)
+    """
+    image = PillowImage.open(path)
+    megapixels = round(image.size[0] * image.size[1] / 1000000.0, 1)
+
+    if image.format == 'PNG':
+        if image.mode == 'P':
+            return 'png_palette', megapixels
+
+        return 'png_alpha' if 'A' in image.mode or 'transparency' in image.info else 'png', megapixels
+
+    try:
+        profile_name = ImageCms.getProfileName(ImageCms.ImageCmsProfile(io.BytesIO(image.info['icc_profile'])))
+    except (KeyError, OSError, PyCMSError, TypeError):
+        profile_name = ''
+
+    if 'Adobe RGB' in profile_name:
+        return 'adobe_rgb', megapixels
+
+    if 'Reference Output Medium' in profile_name or 'ProPhoto' in profile_name:
+        return 'prophoto', megapixels
+
+    return 'srgb', megapixels
+
+
+def make_corpus(directory, seed=SEED_IMAGE, profiles=None):
+    """
+    Write a synthetic corpus made from a seed photo: sRGB JPEGs of 12 to 50 megapixels, palette and alpha PNGs, and
+    wide gamut JPEGs for any ICC profiles given
+
+    :param directory: directory to write the images to
+    :param seed: path to the photo the images are made from
+    :param profiles: dict of class name to ICC profile path, e.g. {'adobe_rgb': 'AdobeRGB1998.icc'}
+    :return: list of image paths
+    """
+    source = PillowImage.open(seed).convert('RGB')
+    ratio = source.size[0] / float(source.size[1])
+    paths = list()
+
+    def save(image, name, **options):
+        path = os.path.join(directory, name)
+        image.save(path, **options)
+        paths.append(path)
+
+    for megapixels in SYNTHETIC_MEGAPIXELS:
+        width = int((megapixels * 1000000 * ratio) ** 0.5)
+        save(source.resize((width, int(width / ratio)), PillowImage.BICUBIC), 'srgb_{}mp.jpg'.format(megapixels),
+             quality=90)
+
+    medium = source.resize((2048, int(2048 / ratio)), PillowImage.BICUBIC)
+    save(medium.quantize(256), 'palette.png')
+
+    gradient = PillowImage.new('L', (256, 1))
+    gradient.putdata(range(256))
+    alpha = medium.convert('RGBA')
+    alpha.putalpha(gradient.resize(medium.size))
+    save(alpha, 'alpha.png')
+
+    width = int((24 * 1000000 * ratio) ** 0.5)
+    large = source.resize((width, int(width / ratio)), PillowImage.BICUBIC)
+
+    for name, profile in sorted((profiles or {}).items()):
+        with open(profile, 'rb') as f:
+            save(large, '{}_24mp.jpg'.format(name), quality=90, icc_profile=f.read())
+
+    return paths
+
+
+def find_images(paths):
+    """
+    Expand directories into the images they contain
+
+    :param paths: paths of images or directories
+    :return: sorted list of image paths
+    """
+    images = list()
+
+    for path in paths:
+        if os.path.isdir(path):
+            images.extend(os.path.join(path, name) for name in os.listdir(path)
+                          if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            images.append(path)
+
+    return sorted(images)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Find stages that got slower than in a baseline run
+
+    :param results: result dicts of this run
+    :param baseline: result dicts of the baseline run
+    :param tolerance: fraction the median latency may grow by, e.g. 0.2
+    :return: list of (image, stage, baseline p50, p50) tuples
+    """
+    previous = {(r['image'], r['stage']): r for r in baseline}
+    regressions = list()
+
+    for result in results:
+        before = previous.get((result['image'], result['stage']))
+
+        if before and result['p50_ms'] > before['p50_ms'] * (1 + tolerance):
+            regressions.append((result['image'], result['stage'], before['p50_ms'], result['p50_ms']))
+
+    return regressions
+
+
+class Command(BaseCommand):
+    help = 'Measure latency percentiles, throughput per core and peak memory of each stage of the image pipeline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('images',
+                            nargs='*',
+                            help='Paths of images or directories of images to benchmark')
+        parser.add_argument('--corpus',
+                            action='store',
+                            dest='corpus',
+                            default=None,
+                            help='Write a synthetic corpus of 12-50 MP JPEGs and palette and alpha PNGs to this '
+                                 'directory and benchmark it')
+        parser.add_argument('--adobe-rgb-profile',
+                            action='store',
+                            dest='adobe_rgb',
+                            default=None,
+                            help='ICC profile to embed in an Adobe RGB image of the synthetic corpus')
+        parser.add_argument('--prophoto-profile',
+                            action='store',
+                            dest='prophoto',
+                            default=None,
+                            help='ICC profile to embed in a ProPhoto RGB image of the synthetic corpus')
+        parser.add_argument('-s',
+                            action='store',
+                            dest='stages',
+                            default=','.join(STAGES),
+                            help='Comma separated stages, default {}'.format(','.join(STAGES)))
+        parser.add_argument('-r',
+                            action='store',
+                            dest='repeat',
+                            default=5,
+                            type=int,
+                            help='Number of runs per stage and image, each in a fresh process, default 5')
+        parser.add_argument('-j',
+                            action='store',
+                            dest='workers',
+                            default=1,
+                            type=int,
+                            help='Also run each stage on this many processes at once to measure throughput per core')
+        parser.add_argument('-o',
+                            action='store',
+                            dest='output',
+                            default=None,
+                            help='Write the results as JSON to this file')
+        parser.add_argument('--baseline',
+                            action='store',
+                            dest='baseline',
+                            default=None,
+                            help='JSON results of an earlier run. Fails if a stage got slower than the tolerance.')
+        parser.add_argument('--tolerance',
+                            action='store',
+                            dest='tolerance',
+                            default=0.2,
+                            type=float,
+                            help='Fraction the median latency may grow by compared to the baseline, default 0.2')
+
+    def handle(self, *args, **options):
+        stages = options['stages'].split(',')
+        unknown = [stage for stage in stages if stage not in STAGES]
+
+        if unknown:
+            raise CommandError('Unknown stages: {}'.format(', '.join(unknown)))
+
+        images = find_images(options['images'])
+
+        if options['corpus']:
+            os.makedirs(options['corpus'], exist_ok=True)
+            profiles = {name: options[name] for name in ('adobe_rgb', 'prophoto') if options[name]}
+            images += make_corpus(options['corpus'], profiles=profiles)
+
+        if not images:
+            raise CommandError('Give images to benchmark or --corpus to generate them')
+
+        results = list()
+
+        for path in images:
+            image_class, megapixels = describe_image(path)
+            print(TermColor.HEADER + '{} ({}, {} MP)'.format(path, image_class, megapixels) + TermColor.ENDC)
+
+            for stage in stages:
+                function = STAGES[stage]
+
+                try:
+                    # Warm up caches such as compiled ICC transforms before the measured runs
+                    measure(function, path)
+                except Exception as e:
+                    print(TermColor.WARNING + '  {:>12}  skipped: {}'.format(stage, e) + TermColor.ENDC)
+                    continue
+
+                runs = [measure_isolated(function, path) for _ in range(options['repeat'])]
+                parallel_seconds = None
+
+                if options['workers'] > 1:
+                    parallel_seconds = measure_parallel(options['workers'], options['repeat'], function, path)
+
+                result = dict(summarize(runs, parallel_seconds, options['workers']), image=path, stage=stage,
+                              image_class=image_class, megapixels=megapixels)
+                results.append(result)
+
+                print('  {:>12}  p50 {:8.1f} ms  p95 {:8.1f} ms  p99 {:8.1f} ms  {:6.2f}/s per core  {:8} KB peak'
+                      .format(stage, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                              result['throughput_per_core'], result['peak_rss_kb']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({
+                    'environment': {
+                        'cpu_count': os.cpu_count(),
+                        'pillow': PIL.__version__,
+                        'python': platform.python_version(),
+                        'rendition_formats': list(RENDITION_FORMATS),
+                    },
+                    'results': results,
+                }, f, indent=2, sort_keys=True)
+
+            print(TermColor.OKGREEN + 'Results written to {}'.format(options['output']) + TermColor.ENDC)
+
+        if options['baseline']:
+            with open(options['baseline'], 'r') as f:
+                regressions = compare(results, json.load(f)['results'], options['tolerance'])
+
+            for image, stage, before, after in regressions:
+                print(TermColor.FAIL + '{} {}: p50 {:.1f} ms -> {:.1f} ms'.format(image, stage, before, after) +
+                      TermColor.ENDC)
+
+            if regressions:
+                raise CommandError('{} stages are more than {:.0%} slower than the baseline'.format(
+                    len(regressions), options['tolerance']))
+
+            print(TermColor.OKGREEN + 'No regressions against {}'.format(options['baseline']) + TermColor.ENDC)
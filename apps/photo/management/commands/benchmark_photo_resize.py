@@ -0,0 +1,77 @@
+from apps.photo.benchmark import measure_isolated
+from apps.photo.photo import WidthResize
+from apps.utils.commands import TermColor
+from django.core.management import BaseCommand
+from PIL import Image as PillowImage
+from PIL import ImageChops, ImageStat
+
+
+def resize_full(path, width):
+    """
+    Resize the way the image pipeline used to: decode at full resolution, then resize
+
+    :param path: path to the image
+    :param width: target width
+    :return: resized Image
+    """
+    image = PillowImage.open(path)
+    image.load()
+    ratio = image.size[0] / float(image.size[1])
+
+    return image.resize((width, int(width / ratio)), PillowImage.ANTIALIAS)
+
+
+def resize_reduced(path, width):
+    """
+    Resize through WidthResize, which decodes or reduces to a smaller scale before the final resize
+
+    :param path: path to the image
+    :param width: target width
+    :return: resized Image
+    """
+    return WidthResize(width).process(PillowImage.open(path))
+
+
+class Command(BaseCommand):
+    help = 'Compare decode and resize time and peak memory with and without reduced resolution decoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('images',
+                            nargs='+',
+                            help='Paths of the images to resize')
+        parser.add_argument('-w',
+                            action='store',
+                            dest='widths',
+                            default='246,272,640,750,1242',
+                            help='Comma separated target widths, default 246,272,640,750,1242')
+        parser.add_argument('-r',
+                            action='store',
+                            dest='repeat',
+                            default=3,
+                            type=int,
+                            help='Number of runs to keep the best time of, default 3')
+
+    def handle(self, *args, **options):
+        widths = [int(w) for w in options['widths'].split(',')]
+
+        for path in options['images']:
+            print(TermColor.HEADER + '{} ({}x{})'.format(path, *PillowImage.open(path).size) + TermColor.ENDC)
+
+            for width in widths:
+                results = dict()
+
+                for resize in (resize_full, resize_reduced):
+                    runs = list()
+
+                    for _ in range(options['repeat']):
+                        runs.append(measure_isolated(resize, path, width))
+
+                    results[resize] = (min(r[1] for r in runs), max(r[2] for r in runs), runs[0][0])
+
+                full, reduced = results[resize_full], results[resize_reduced]
+                difference = ImageStat.Stat(ImageChops.difference(full[2], reduced[2])).mean
+
+                print('  {:>5}px  full {:7.1f} ms {:8} KB  reduced {:7.1f} ms {:8} KB  '
+                      'speedup {:4.1f}x  mean pixel difference {:.2f}'.format(
+                        width, full[0] * 1000, full[1], reduced[0] * 1000, reduced[1], full[0] / reduced[0],
+                        sum(difference) / len(difference)))
@@ -0,0 +1,42 @@
+from apps.photo import models as photo_models
+from apps.photo.photo import RENDITION_FORMATS
+from apps.utils.commands import TermColor
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Record the rendition names of photos whose renditions were generated before manifests were kept'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b',
+                            action='store',
+                            dest='batch_size',
+                            default=500,
+                            type=int,
+                            help='Number of photos to load per query, default 500')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = 0
+        updated = 0
+
+        while True:
+            # Names are derived from the image name alone, so this never touches storage
+            photos = list(photo_models.Photo.objects.filter(id__gt=last_id, rendition_status='ready',
+                                                            rendition_manifest={})
+                          .order_by('id').only('id', 'image', 'rendition_formats')[:batch_size])
+
+            if not photos:
+                break
+
+            for photo in photos:
+                last_id = photo.id
+                formats = [image_format for image_format in photo.rendition_formats or ['JPEG']
+                           if image_format in RENDITION_FORMATS]
+                photo_models.Photo.objects.filter(id=photo.id, image=photo.image.name).update(
+                    rendition_manifest=photo.get_rendition_manifest(formats))
+                updated += 1
+
+            print(TermColor.OKBLUE + 'Processed up to photo {} ({} updated)'.format(last_id, updated) + TermColor.ENDC)
+
+        print(TermColor.OKGREEN + 'Done: {} updated'.format(updated) + TermColor.ENDC)
@@ -0,0 +1,32 @@
+from apps.photo import models as photo_models
+from apps.utils.commands import TermColor
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Compare stored photo ranks against ranks computed from scratch and rebuild them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check-only',
+                            action='store_true',
+                            dest='check_only',
+                            default=False,
+                            help='Report drift without rebuilding the ranks')
+
+    def handle(self, *args, **options):
+        drift = photo_models.PhotoRank.objects.check_drift()
+        drift_count = sum(len(keys) for keys in drift.values())
+
+        for drift_type, keys in drift.items():
+            for photo_id, classification_id in keys:
+                print(TermColor.WARNING + '{}: photo {} in {}'.format(
+                    drift_type, photo_id, classification_id or 'overall') + TermColor.ENDC)
+
+        if drift_count:
+            print(TermColor.FAIL + '{} drifted rank entries found'.format(drift_count) + TermColor.ENDC)
+        else:
+            print(TermColor.OKGREEN + 'No drift found' + TermColor.ENDC)
+
+        if not options['check_only']:
+            created = photo_models.PhotoRank.objects.rebuild()
+            print(TermColor.OKBLUE + 'Rebuilt {} rank entries'.format(created) + TermColor.ENDC)
@@ -0,0 +1,34 @@
+from apps.photo import tasks as photo_tasks
+from apps.utils.commands import TermColor
+from django.conf import settings
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Delete rendition files that are no longer in any photo\'s rendition manifest'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-g',
+                            action='store',
+                            dest='grace_hours',
+                            default=settings.PHOTO_RENDITION_GC_GRACE_HOURS,
+                            type=int,
+                            help='Only delete files older than this many hours, default {}'.format(
+                                settings.PHOTO_RENDITION_GC_GRACE_HOURS))
+        parser.add_argument('--dry-run',
+                            action='store_true',
+                            dest='dry_run',
+                            default=False,
+                            help='List the files that would be deleted without deleting them')
+
+    def handle(self, *args, **options):
+        deleted = photo_tasks.collect_photo_renditions(grace_hours=options['grace_hours'],
+                                                       dry_run=options['dry_run'])
+
+        for name in deleted:
+            print(TermColor.OKBLUE + name + TermColor.ENDC)
+
+        if options['dry_run']:
+            print(TermColor.WARNING + 'Dry run: {} files would be deleted'.format(len(deleted)) + TermColor.ENDC)
+        else:
+            print(TermColor.OKGREEN + 'Done: {} files deleted'.format(len(deleted)) + TermColor.ENDC)
@@ -0,0 +1,31 @@
+from apps.photo import models as photo_models
+from apps.utils.commands import TermColor
+from django.core.management import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Compare denormalized photo interaction counters against the tables they summarize and fix any drift'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check-only',
+                            action='store_true',
+                            dest='check_only',
+                            default=False,
+                            help='Report drift without correcting the counters')
+
+    def handle(self, *args, **options):
+        if options['check_only']:
+            drift = photo_models.Photo.objects.check_counters()
+        else:
+            drift = photo_models.Photo.objects.reconcile_counters()
+
+        for photo_id, counters in drift.items():
+            print(TermColor.WARNING + 'Photo {}: {}'.format(
+                photo_id, ', '.join('{}={}'.format(f, v) for f, v in sorted(counters.items()))) + TermColor.ENDC)
+
+        if not drift:
+            print(TermColor.OKGREEN + 'No drift found' + TermColor.ENDC)
+        elif options['check_only']:
+            print(TermColor.FAIL + '{} photos with drifted counters'.format(len(drift)) + TermColor.ENDC)
+        else:
+            print(TermColor.OKBLUE + 'Corrected counters on {} photos'.format(len(drift)) + TermColor.ENDC)
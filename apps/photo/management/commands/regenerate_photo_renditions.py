@@ -0,0 +1,127 @@
+from apps.photo import models as photo_models
+from apps.photo import tasks as photo_tasks
+from apps.utils.commands import read_checkpoint, TermColor, write_checkpoint
+from django.core.management import BaseCommand
+from django.db import connections
+from django.db.models import Q
+from multiprocessing import Pool
+import os
+import time
+
+
+def regenerate_photo(arguments):
+    """
+    Generate the renditions of one photo in a worker process
+
+    :param arguments: tuple of the Photo id and whether to regenerate existing renditions
+    :return: tuple of the Photo id and an error message, or None if it succeeded
+    """
+    photo_id, force = arguments
+
+    try:
+        photo_tasks.generate_photo_renditions(photo_id, force=force)
+    except Exception as e:
+        return photo_id, '{}: {}'.format(type(e).__name__, e)
+
+    return photo_id, None
+
+
+class Command(BaseCommand):
+    help = 'Generate missing renditions, placeholders and perceptual hashes for existing photos, or regenerate them ' \
+           'all with --force'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b',
+                            action='store',
+                            dest='batch_size',
+                            default=500,
+                            type=int,
+                            help='Number of photos to load per query, default 500')
+        parser.add_argument('-c',
+                            action='store',
+                            dest='checkpoint',
+                            default='photo_renditions_checkpoint.txt',
+                            help='File used to resume from the last processed batch')
+        parser.add_argument('-w',
+                            action='store',
+                            dest='workers',
+                            default=os.cpu_count() or 1,
+                            type=int,
+                            help='Number of worker processes, default one per CPU')
+        parser.add_argument('--celery',
+                            action='store_true',
+                            dest='celery',
+                            default=False,
+                            help='Queue a task per photo instead of generating renditions in this process')
+        parser.add_argument('--force',
+                            action='store_true',
+                            dest='force',
+                            default=False,
+                            help='Regenerate renditions that already exist, e.g. after a rendition spec changed')
+        parser.add_argument('--restart',
+                            action='store_true',
+                            dest='restart',
+                            default=False,
+                            help='Ignore the checkpoint and start from the first photo')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checkpoint = options['checkpoint']
+        force = options['force']
+        last_id = 0 if options['restart'] else read_checkpoint(checkpoint)
+        processed = 0
+        failed = 0
+        pool = None
+
+        photos = photo_models.Photo.objects.exclude(image='')
+
+        if not force:
+            # Only photos missing a rendition, for instance one that was just added to PHOTO_RENDITION_SPECS
+            photos = photos.filter(~Q(rendition_status='ready') | Q(blurhash='') | Q(perceptual_hash__isnull=True) |
+                                   ~Q(rendition_manifest__has_keys=photo_models.Photo.get_rendition_fields()))
+
+        if not options['celery'] and options['workers'] > 1:
+            # Forked workers must open their own database connections rather than share the parent's
+            connections.close_all()
+            pool = Pool(options['workers'])
+
+        started = time.time()
+
+        try:
+            while True:
+                # Keyset pagination keeps every batch query cheap no matter how far along we are
+                batch = list(photos.filter(id__gt=last_id).order_by('id').values_list('id', 'image')[:batch_size])
+
+                if not batch:
+                    break
+
+                if options['celery']:
+                    for photo_id, image_name in batch:
+                        photo_tasks.generate_photo_renditions.delay(photo_id, image_name, force)
+
+                    results = [(photo_id, None) for photo_id, image_name in batch]
+                elif pool:
+                    results = pool.imap_unordered(regenerate_photo, [(photo_id, force) for photo_id, _ in batch])
+                else:
+                    results = map(regenerate_photo, [(photo_id, force) for photo_id, _ in batch])
+
+                for photo_id, error in results:
+                    if error:
+                        failed += 1
+                        print(TermColor.FAIL + 'Photo {}: {}'.format(photo_id, error) + TermColor.ENDC)
+                    else:
+                        processed += 1
+
+                # Workers finish out of order, so only a completed batch moves the checkpoint
+                last_id = batch[-1][0]
+                write_checkpoint(checkpoint, last_id)
+                print(TermColor.OKBLUE + 'Processed up to photo {} ({} {}, {} failed, {:.1f} photos/s)'.format(
+                    last_id, processed, 'queued' if options['celery'] else 'updated', failed,
+                    (processed + failed) / max(time.time() - started, 0.001)) + TermColor.ENDC)
+        finally:
+            if pool:
+                pool.close()
+                pool.join()
+
+        print(TermColor.OKGREEN + 'Done: {} {}, {} failed in {:.0f}s'.format(
+            processed, 'queued' if options['celery'] else 'updated', failed, time.time() - started) + TermColor.ENDC)
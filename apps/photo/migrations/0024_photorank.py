@@ -0,0 +1,40 @@
+# Generated by Django 2.2.3 on 2019-07-15 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+POPULATE_PHOTO_RANKS = """
+    INSERT INTO photo_photorank (photo_id, classification_id, votes, rank)
+    SELECT p.id, NULL, p.votes, RANK() OVER (ORDER BY p.votes DESC)
+    FROM photo_photo p
+    UNION ALL
+    SELECT p.id, c.photoclassification_id, p.votes,
+           RANK() OVER (PARTITION BY c.photoclassification_id ORDER BY p.votes DESC)
+    FROM photo_photo p INNER JOIN photo_photo_category c ON c.photo_id = p.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0023_auto_20190626_1215'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoRank',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.IntegerField()),
+                ('votes', models.IntegerField()),
+                ('classification', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='photo_rank', to='photo.PhotoClassification')),
+                ('photo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photo_rank', to='photo.Photo')),
+            ],
+            options={
+                'unique_together': {('photo', 'classification')},
+                'index_together': {('classification', 'votes')},
+            },
+        ),
+        migrations.RunSQL(POPULATE_PHOTO_RANKS, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 2.2.3 on 2019-07-22 14:31
+
+from django.db import migrations, models
+
+
+PHOTO_CONTENT_TYPE = "(SELECT id FROM django_content_type WHERE app_label = 'photo' AND model = 'photo')"
+
+POPULATE_PHOTO_COUNTERS = """
+    UPDATE photo_photo p SET
+        comment_count = (SELECT COUNT(*) FROM photo_photocomment c WHERE c.photo_id = p.id),
+        click_count = (SELECT COUNT(*) FROM utils_useraction a
+                       WHERE a.object_id = p.id AND a.content_type_id = {content_type} AND a.action = 'photo_click'),
+        flag_count = (SELECT COUNT(*) FROM utils_useraction a
+                      WHERE a.object_id = p.id AND a.content_type_id = {content_type} AND a.action = 'photo_flag'),
+        impression_count = (SELECT COUNT(*) FROM utils_useraction a
+                            WHERE a.object_id = p.id AND a.content_type_id = {content_type} AND a.action = 'photo_imp'),
+        like_count = (SELECT COUNT(*) FROM account_userinterest i
+                      WHERE i.object_id = p.id AND i.content_type_id = {content_type} AND i.interest_type = 'like'),
+        star_count = (SELECT COUNT(*) FROM account_userinterest i
+                      WHERE i.object_id = p.id AND i.content_type_id = {content_type} AND i.interest_type = 'star')
+""".format(content_type=PHOTO_CONTENT_TYPE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0023_auto_20190502_1305'),
+        ('photo', '0025_photo_image_metadata'),
+        ('utils', '0004_feedback'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='click_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='comment_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='flag_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='impression_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='like_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='star_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunSQL(POPULATE_PHOTO_COUNTERS, reverse_sql=migrations.RunSQL.noop),
+    ]
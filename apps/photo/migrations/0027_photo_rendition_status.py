@@ -0,0 +1,20 @@
+# Generated by Django 2.2.3 on 2019-07-29 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0026_photo_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='rendition_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', max_length=16),
+        ),
+        # Renditions of existing photos were generated synchronously when they were uploaded
+        migrations.RunSQL("UPDATE photo_photo SET rendition_status = 'ready'", reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 2.2.3 on 2019-08-05 10:12
+
+from django.conf import settings
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('photo', '0027_photo_rendition_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhotoUpload',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('modified_at', models.DateTimeField(auto_now=True)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('metadata', django.contrib.postgres.fields.jsonb.JSONField(default=dict)),
+                ('original_name', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=16)),
+                ('photo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='photo_upload', to='photo.Photo')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='photo_upload', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
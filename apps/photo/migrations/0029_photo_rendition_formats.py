@@ -0,0 +1,22 @@
+# Generated by Django 2.2.3 on 2019-08-12 14:03
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0028_photoupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='rendition_formats',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.CharField(max_length=8), blank=True, default=list, size=None),
+        ),
+        # Only JPEG renditions exist for photos processed before other formats were added
+        migrations.RunSQL("UPDATE photo_photo SET rendition_formats = '{JPEG}' WHERE rendition_status = 'ready'",
+                          reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.2.3 on 2019-08-21 10:12
+
+import django.contrib.postgres.indexes
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0030_photo_rendition_manifest'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='photo',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['rendition_manifest'],
+                                                          name='photo_rendition_manifest_gin'),
+        ),
+    ]
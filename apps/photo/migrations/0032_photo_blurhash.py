@@ -0,0 +1,18 @@
+# Generated by Django 2.2.3 on 2019-08-23 14:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0031_photo_rendition_manifest_gin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='blurhash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
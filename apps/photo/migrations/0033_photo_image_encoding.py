@@ -0,0 +1,23 @@
+# Generated by Django 2.2.3 on 2019-08-27 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0032_photo_blurhash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='image_bytes_saved',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='photo',
+            name='image_quality',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.3 on 2019-08-29 09:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0033_photo_image_encoding'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='original_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+    ]
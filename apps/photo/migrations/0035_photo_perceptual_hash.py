@@ -0,0 +1,18 @@
+# Generated by Django 2.2.3 on 2019-08-29 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0034_photo_original_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photo',
+            name='perceptual_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
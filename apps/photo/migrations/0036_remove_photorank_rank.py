@@ -0,0 +1,17 @@
+# Generated by Django 2.2.3 on 2019-09-02 10:12
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0035_photo_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='photorank',
+            name='rank',
+        ),
+    ]
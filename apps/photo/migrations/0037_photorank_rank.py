@@ -0,0 +1,28 @@
+# Generated by Django 2.2.3 on 2019-09-05 10:12
+
+from django.db import migrations, models
+
+
+POPULATE_PHOTO_RANKS = """
+    UPDATE photo_photorank r SET rank = ranked.rank
+    FROM (SELECT id, RANK() OVER (PARTITION BY classification_id ORDER BY votes DESC) AS rank
+          FROM photo_photorank) ranked
+    WHERE r.id = ranked.id
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('photo', '0036_remove_photorank_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='photorank',
+            name='rank',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunSQL(POPULATE_PHOTO_RANKS, reverse_sql=migrations.RunSQL.noop),
+    ]
@@ -2,21 +2,31 @@ from apps.account import models as account_models
 from apps.common import models as common_models
 from apps.communication.models import PushNotificationRecord
 from apps.communication.tasks import send_push_notification, update_device
-from apps.photo.photo import BlurResize, WidthResize
+from apps.photo.photo import (BlurResize, DeferredRendition, generate_renditions, get_blurhash, get_perceptual_hash,
+                              get_render_width, get_rendition_name, get_rendition_storage, read_image_header,
+                              render_image, RENDITION_EXTENSIONS, RENDITION_FORMAT_OPTIONS, RENDITION_FORMATS,
+                              StoredRendition, WidthResize)
 from apps.utils import models as utils_models
 from django.conf import settings
 from django.contrib.contenttypes.fields import GenericRelation
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.db import models as geo_models
 from django.contrib.gis.geos import GEOSGeometry
-from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.contrib.postgres.indexes import GinIndex
+from django.core.cache import cache
+from django.core.files.base import ContentFile, File
 from django.core.validators import MaxValueValidator
-from django.db import models
+from django.db import connection, models, transaction
+from django.db.models import Count, F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 from fcm_django.models import FCMDevice
 from imagekit.models import ImageSpecField
+from PIL import Image as PillowImage
 from push_notifications.models import APNSDevice
+import os
 
 
 class GalleryManager(models.Manager):
@@ -167,7 +177,137 @@ class PhotoFeed(models.Model):
         verbose_name_plural = 'feeds'
 
 
+# Denormalized interaction counters on Photo, kept current by signals in apps/photo/signals.py
+PHOTO_COUNTER_FIELDS = ('click_count', 'comment_count', 'flag_count', 'impression_count', 'like_count', 'star_count')
+
+# Fields that describe the stored image of a photo rather than the photo itself. Photos uploaded from the same original
+# share them, see Photo.get_shared_image_fields().
+PHOTO_SHARED_IMAGE_FIELDS = ('blurhash', 'image_bytes_saved', 'image_format', 'image_height', 'image_quality',
+                             'image_size', 'image_width', 'perceptual_hash', 'rendition_formats', 'rendition_manifest',
+                             'rendition_status')
+
+# ImageKit renditions of Photo.image, generated in the background by apps.photo.tasks.generate_photo_renditions. Each
+# maps to the processors and encoder options of its JPEG version. Every rendition also gets a field for each other
+# format in RENDITION_FORMATS, e.g. image_small_webp.
+PHOTO_RENDITION_SPECS = {
+    'image_blurred': ([BlurResize()], {'quality': 80}),
+    'image_medium': ([WidthResize(1242)], None),
+    'image_small': ([WidthResize(640)], None),
+    'image_small_2': ([WidthResize(750)], None),
+    'image_tiny_246': ([WidthResize(246)], None),
+    'image_tiny_272': ([WidthResize(272)], None),
+}
+PHOTO_RENDITION_FIELDS = tuple(sorted(PHOTO_RENDITION_SPECS))
+
+
+def get_rendition_field_name(name, image_format):
+    """
+    Return the name of the field holding a rendition in a given format
+
+    :param name: name of the JPEG rendition field, e.g. image_small
+    :param image_format: one of RENDITION_FORMATS
+    :return: field name, e.g. image_small_webp
+    """
+    if image_format == 'JPEG':
+        return name
+
+    return '{}_{}'.format(name, image_format.lower())
+
+# Total number of user actions (clicks, flags and impressions) recorded against a photo
+ACTION_COUNT = F('click_count') + F('flag_count') + F('impression_count')
+
+
+class PhotoManager(geo_models.Manager):
+    """
+        Manager class for Photo objects
+    """
+
+    def get_duplicate(self, original_hash):
+        """
+        Return the earliest photo uploaded from an original with the given SHA-256
+
+        :param original_hash: hex SHA-256 of the original bytes
+        :return: Photo or None
+        """
+        return self.filter(original_hash=original_hash).exclude(image='').order_by('id').first()
+
+    def get_duplicates(self, original_hashes):
+        """
+        Look up get_duplicate() for many hashes in one query
+
+        :param original_hashes: hex SHA-256 digests of originals
+        :return: dict of hash to the earliest Photo uploaded from it, for the hashes that have one
+        """
+        # Later photos are overwritten by earlier ones
+        return {photo.original_hash: photo for photo in self.filter(original_hash__in=set(original_hashes))
+                .exclude(image='').order_by('-id')}
+
+    def get_counter_sources(self):
+        """
+        Return the expressions that compute each interaction counter from the tables it denormalizes
+
+        :return: dict of counter field name to expression
+        """
+        photo_type = ContentType.objects.get_for_model(Photo)
+
+        def count_of(queryset, field):
+            subquery = queryset.order_by().values(field).annotate(total=Count('id')).values('total')
+
+            return Coalesce(Subquery(subquery, output_field=models.IntegerField()), 0)
+
+        actions = utils_models.UserAction.objects.filter(content_type=photo_type, object_id=OuterRef('pk'))
+        interests = account_models.UserInterest.objects.filter(content_type=photo_type, object_id=OuterRef('pk'))
+
+        return {
+            'click_count': count_of(actions.filter(action='photo_click'), 'object_id'),
+            'comment_count': count_of(PhotoComment.objects.filter(photo=OuterRef('pk')), 'photo'),
+            'flag_count': count_of(actions.filter(action='photo_flag'), 'object_id'),
+            'impression_count': count_of(actions.filter(action='photo_imp'), 'object_id'),
+            'like_count': count_of(interests.filter(interest_type='like'), 'object_id'),
+            'star_count': count_of(interests.filter(interest_type='star'), 'object_id'),
+        }
+
+    def check_counters(self):
+        """
+        Compare the stored interaction counters against freshly computed ones
+
+        :return: dict of Photo id to dict of drifted counter names and their correct values
+        """
+        sources = self.get_counter_sources()
+        photos = self.get_queryset().annotate(**{'actual_{}'.format(f): e for f, e in sources.items()})
+        drift = dict()
+
+        for photo in photos.values('id', *PHOTO_COUNTER_FIELDS, *['actual_{}'.format(f) for f in sources]):
+            counters = {f: photo['actual_{}'.format(f)] for f in PHOTO_COUNTER_FIELDS
+                        if photo[f] != photo['actual_{}'.format(f)]}
+
+            if counters:
+                drift[photo['id']] = counters
+
+        return drift
+
+    def reconcile_counters(self):
+        """
+        Rewrite any interaction counters that have drifted from the tables they summarize
+
+        :return: dict of Photo id to dict of corrected counter names and values
+        """
+        drift = self.check_counters()
+
+        for photo_id, counters in drift.items():
+            self.get_queryset().filter(id=photo_id).update(**counters)
+
+        return drift
+
+
 class Photo(geo_models.Model):
+    RENDITION_STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    )
+
     category = models.ManyToManyField(PhotoClassification, related_name='category')
     gear = models.ManyToManyField(account_models.Gear, blank=True)
     photo_feed = models.ManyToManyField(PhotoFeed, blank=True)
@@ -182,12 +322,20 @@ class Photo(geo_models.Model):
     aov_feed_add_date = models.DateTimeField(null=True, blank=True)
 
     image = models.ImageField(upload_to=common_models.get_uploaded_file_path)
-    image_tiny_246 = ImageSpecField(source='image', processors=[WidthResize(246)], format='JPEG')
-    image_tiny_272 = ImageSpecField(source='image', processors=[WidthResize(272)], format='JPEG')
-    image_blurred = ImageSpecField(source='image', processors=[BlurResize()], format='JPEG', options={'quality': 80})
-    image_small = ImageSpecField(source='image', processors=[WidthResize(640)], format='JPEG')
-    image_small_2 = ImageSpecField(source='image', processors=[WidthResize(750)], format='JPEG')
-    image_medium = ImageSpecField(source='image', processors=[WidthResize(1242)], format='JPEG')
+    blurhash = models.CharField(max_length=64, blank=True, default='')
+    perceptual_hash = models.BigIntegerField(blank=True, null=True)
+    rendition_formats = ArrayField(base_field=models.CharField(max_length=8), blank=True, default=list)
+    rendition_manifest = JSONField(blank=True, default=dict)
+    rendition_status = models.CharField(max_length=16, choices=RENDITION_STATUS_CHOICES, default='pending')
+
+    # Stored at upload time so that reporting dimensions and encoder savings never has to read the image from storage
+    image_bytes_saved = models.IntegerField(blank=True, null=True)
+    image_format = models.CharField(max_length=16, blank=True, null=True)
+    image_height = models.PositiveIntegerField(blank=True, null=True)
+    image_quality = models.PositiveSmallIntegerField(blank=True, null=True)
+    image_size = models.PositiveIntegerField(blank=True, null=True)
+    image_width = models.PositiveIntegerField(blank=True, null=True)
+    original_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)
 
     location = models.CharField(max_length=255, blank=True, null=True)
     magazine_authorized = models.BooleanField(default=True)
@@ -195,6 +343,16 @@ class Photo(geo_models.Model):
     public = models.BooleanField(default=True)
     votes = models.IntegerField(default=0)
 
+    # Interaction counters, see PHOTO_COUNTER_FIELDS
+    click_count = models.IntegerField(default=0)
+    comment_count = models.IntegerField(default=0)
+    flag_count = models.IntegerField(default=0)
+    impression_count = models.IntegerField(default=0)
+    like_count = models.IntegerField(default=0)
+    star_count = models.IntegerField(default=0)
+
+    objects = PhotoManager()
+
     # Behind the Shot
     photo_data = models.TextField(blank=True, null=True)
     bts_lens = models.CharField(blank=True, null=True, max_length=256)
@@ -208,6 +366,195 @@ class Photo(geo_models.Model):
     bts_camera_model = models.CharField(blank=True, null=True, max_length=256)
     caption = models.TextField(blank=True, null=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(Photo, cls).from_db(db, field_names, values)
+
+        # Remember the stored image so save() can tell when the source of the renditions changes
+        if 'image' in field_names:
+            instance._loaded_image_name = values[field_names.index('image')]
+
+        return instance
+
+    def image_changed(self):
+        """
+        Return whether the image differs from the one last loaded from or saved to the database
+
+        :return: Boolean
+        """
+        if 'image' in self.get_deferred_fields():
+            return False
+
+        if self._state.adding or not self.image._committed:
+            return True
+
+        return self.image.name != getattr(self, '_loaded_image_name', self.image.name)
+
+    def generate_renditions(self, force=False):
+        """
+        Write the renditions missing from the rendition manifest, decoding the image only once. Files are named after
+        a hash of their content and the manifest is updated in memory; saving it is up to the caller.
+
+        The BlurHash placeholder and perceptual hash are computed from the same decode when they are missing.
+
+        :param force: regenerate renditions that are already in the manifest
+        :return: dict of the rendition field names that were written to their storage names
+        """
+        generators = {name: getattr(self, name).generator for name in self.get_rendition_fields()}
+
+        if not force:
+            generators = {name: g for name, g in generators.items() if name not in self.rendition_manifest}
+
+        if not generators and self.blurhash and self.perceptual_hash is not None and not force:
+            return {}
+
+        self.image.open('rb')
+
+        try:
+            image = PillowImage.open(self.image)
+            renditions = generate_renditions(image, generators) if generators else {}
+
+            if force or not self.blurhash:
+                self.blurhash = get_blurhash(image)
+
+            # After the BlurHash, which needs the colours a grayscale draft would leave out
+            if force or self.perceptual_hash is None:
+                self.perceptual_hash = get_perceptual_hash(image)
+        finally:
+            self.image.close()
+
+        storage = get_rendition_storage()
+        written = dict()
+
+        for name, content in renditions.items():
+            content = content.getvalue()
+            file_name = get_rendition_name(name, content, generators[name].format)
+
+            # The same content always gets the same name, so existing files are already right
+            if not storage.exists(file_name):
+                file_name = storage.save(file_name, ContentFile(content))
+
+            written[name] = file_name
+
+        self.rendition_manifest = dict(self.rendition_manifest, **written)
+
+        return written
+
+    @staticmethod
+    def get_rendition_fields(formats=RENDITION_FORMATS):
+        """
+        Return the names of the rendition fields in the given formats
+
+        :param formats: rendition formats to include
+        :return: list of field names, e.g. image_small and image_small_webp
+        """
+        return [get_rendition_field_name(name, image_format)
+                for name in PHOTO_RENDITION_FIELDS for image_format in formats]
+
+    def get_shared_image_fields(self):
+        """
+        Return the stored image of this photo along with its dimensions and renditions, so that a photo uploaded from
+        the same original can be saved with them instead of compressing and rendering it again
+
+        :return: dict of field name to value
+        """
+        fields = {field: getattr(self, field) for field in PHOTO_SHARED_IMAGE_FIELDS}
+        fields['image'] = self.image.name
+
+        return fields
+
+    def get_rendition_manifest(self, formats=RENDITION_FORMATS):
+        """
+        Map each rendition field to the name ImageKit stores its file under, for photos whose renditions were generated
+        before they were named by content. Names come from the image name and the rendition specs, storage is not
+        accessed.
+
+        :param formats: rendition formats to include
+        :return: dict of rendition field name to storage name
+        """
+        return {name: getattr(self, name).name for name in self.get_rendition_fields(formats)}
+
+    def get_render_name(self, width, image_format):
+        """
+        Return the storage name of a render. Renders are named after the image, so a new image gets new renders.
+
+        :param width: one of PHOTO_RENDER_WIDTHS
+        :param image_format: one of RENDITION_FORMATS
+        :return: name of the render in the image storage
+        """
+        return 'renders/{}/{}.{}'.format(os.path.splitext(self.image.name)[0], width,
+                                         RENDITION_EXTENSIONS[image_format])
+
+    def has_render(self, width, image_format='JPEG'):
+        """
+        Return whether the render for a requested width has already been made
+
+        :param width: width in pixels the client displays the image at
+        :param image_format: one of RENDITION_FORMATS
+        :return: Boolean
+        """
+        name = self.get_render_name(get_render_width(width), image_format)
+        cache_key = 'photo_render:{}'.format(name)
+
+        # Remember renders known to exist so that only the first request for one checks storage
+        if cache.get(cache_key):
+            return True
+
+        if self.image.storage.exists(name):
+            cache.set(cache_key, True, None)
+
+            return True
+
+        return False
+
+    def render(self, width, image_format='JPEG'):
+        """
+        Return the URL of the image resized to the render width for a requested width. Renders are made on first use
+        and kept in storage. The URL is not signed, so it stays valid for as long as the render is cached.
+
+        :param width: width in pixels the client displays the image at
+        :param image_format: one of RENDITION_FORMATS
+        :return: URL of the render
+        """
+        width = get_render_width(width)
+        name = self.get_render_name(width, image_format)
+
+        if not self.has_render(width, image_format):
+            self.image.open('rb')
+
+            try:
+                content = render_image(PillowImage.open(self.image), width, image_format)
+            finally:
+                self.image.close()
+
+            self.image.storage.save(name, File(content))
+            cache.set('photo_render:{}'.format(name), True, None)
+
+        return '{}{}'.format(settings.MEDIA_URL, name)
+
+    def get_rendition(self, name, image_format='JPEG'):
+        """
+        Return one of the image renditions, or the original image until the renditions have been generated. Formats
+        that have not been generated for this photo fall back to JPEG. Renditions recorded in the manifest are
+        returned without going through ImageKit.
+
+        :param name: name of the JPEG rendition field, e.g. image_medium
+        :param image_format: preferred format, one of RENDITION_FORMATS
+        :return: ImageCacheFile or ImageFieldFile
+        """
+        if self.rendition_status != 'ready':
+            return self.image
+
+        if image_format not in self.rendition_formats:
+            image_format = 'JPEG'
+
+        field_name = get_rendition_field_name(name, image_format)
+
+        if field_name in self.rendition_manifest:
+            return StoredRendition(get_rendition_storage(), self.rendition_manifest[field_name])
+
+        return getattr(self, field_name)
+
     def save(self, *args, **kwargs):
         new_notification_sent = False
         if hasattr(self.user, "id"):
@@ -270,7 +617,61 @@ class Photo(geo_models.Model):
         if new_notification_sent and fcm_device.exists():
             PushNotificationRecord.objects.create(message=message, fcm_receiver=fcm_device.first(), action="A",
                                                   content_object=self)
+
+        # Record image metadata for new uploads while the file is still local
+        if self.image and not self.image._committed:
+            if self.image_width is None:
+                header = read_image_header(self.image.file)
+
+                if header:
+                    self.image_width, self.image_height, self.image_format = header
+                    self.image_size = self.image.size
+
+            # Set by Photo.compress() on the files it encodes
+            compress_stats = getattr(self.image.file, 'compress_stats', None)
+
+            if compress_stats:
+                self.image_bytes_saved = compress_stats['bytes_saved']
+                self.image_quality = compress_stats['quality']
+
+        # Renditions are regenerated only for a new source image, not for vote updates or admin edits. New photos saved
+        # with the stored image and renditions of a duplicate keep them.
+        self._image_changed = self.image_changed()
+
+        if self._image_changed and self._state.adding and self.image._committed and self.rendition_status == 'ready':
+            self._image_changed = False
+
+        if self._image_changed:
+            self.blurhash = ''
+            self.perceptual_hash = None
+            self.rendition_formats = []
+            self.rendition_manifest = {}
+            self.rendition_status = 'pending'
+
+        # Counters are only ever changed in the database with F() expressions. Leave them out of full saves so an
+        # instance loaded before a comment, star or action was recorded does not write back a stale count. The
+        # rendition fields belong to the rendition task unless this save replaces the image.
+        if not self._state.adding and not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            skipped = set(PHOTO_COUNTER_FIELDS) | self.get_deferred_fields()
+
+            if not self._image_changed:
+                skipped.update(('blurhash', 'perceptual_hash', 'rendition_formats', 'rendition_manifest',
+                                'rendition_status'))
+
+            kwargs['update_fields'] = [f.attname for f in self._meta.concrete_fields
+                                       if not f.primary_key and f.attname not in skipped]
+
         super(Photo, self).save(*args, **kwargs)
+        self._loaded_image_name = self.image.name
+
+    def get_dimensions(self):
+        """
+        Return the stored image dimensions. Both are None for rows that backfill_photo_dimensions has not reached yet.
+
+        :return: dict containing image dimensions
+        """
+        return {'width': self.image_width, 'height': self.image_height}
 
     @property
     def geo_location(self):
@@ -312,7 +713,7 @@ class Photo(geo_models.Model):
 
         :return: Remote URL
         """
-        return '{}{}'.format(settings.MEDIA_URL, self.image_small)
+        return '{}{}'.format(settings.MEDIA_URL, self.get_rendition('image_small'))
 
     def __str__(self):
         return '{}:\t{},\tID: {}'\
@@ -320,6 +721,17 @@ class Photo(geo_models.Model):
 
     class Meta:
         default_permissions = ('add', 'change', 'delete', 'view')
+        indexes = [
+            GinIndex(fields=['rendition_manifest'], name='photo_rendition_manifest_gin'),
+        ]
+
+
+for rendition_name, (rendition_processors, rendition_options) in PHOTO_RENDITION_SPECS.items():
+    for rendition_format in RENDITION_FORMATS:
+        Photo.add_to_class(get_rendition_field_name(rendition_name, rendition_format), ImageSpecField(
+            source='image', processors=rendition_processors, format=rendition_format,
+            options=rendition_options if rendition_format == 'JPEG' else RENDITION_FORMAT_OPTIONS[rendition_format],
+            cachefile_strategy=DeferredRendition))
 
 
 class PhotoCommentManager(geo_models.Manager):
@@ -411,3 +823,199 @@ class PhotoVote(common_models.EditMixin):
 
     class Meta:
         verbose_name_plural = "Photo Vote Records"
+
+
+class PhotoRankManager(models.Manager):
+    """
+        Manager to keep the PhotoRank table in step with Photo.votes and category membership. A vote only writes the
+        entries of its own photo. The ranks of every photo are recomputed together by refresh_ranks(), which runs a
+        short while after votes change, so reading a rank is a lookup of a stored value.
+
+    """
+
+    def get_scope(self, classification_id):
+        """
+            Return the QuerySet of entries that a photo is ranked against
+
+        :param classification_id: id of the category or None for the overall ranking
+        :return: QuerySet of PhotoRank
+        """
+        if classification_id is None:
+            return self.filter(classification__isnull=True)
+
+        return self.filter(classification_id=classification_id)
+
+    def add_photo(self, photo_id, classification_id, votes):
+        """
+            Add a photo to a ranking, or update its votes if it is already in it. A new entry is ranked on its own
+            straight away; the entries below it move down at the next refresh.
+
+        :param photo_id: id of the Photo
+        :param classification_id: id of the category or None for the overall ranking
+        :param votes: current number of votes of the photo
+        :return: PhotoRank instance
+        """
+        photo_rank, created = self.get_or_create(photo_id=photo_id, classification_id=classification_id, defaults={
+            'votes': votes, 'rank': self.get_scope(classification_id).filter(votes__gt=votes).count() + 1})
+
+        if not created and photo_rank.votes != votes:
+            self.filter(id=photo_rank.id).update(votes=votes)
+            photo_rank.votes = votes
+
+        return photo_rank
+
+    def update_photo(self, photo_id, votes):
+        """
+            Bring every ranking of a photo up to date with its number of votes. Adds the overall ranking if missing.
+
+        :param photo_id: id of the Photo
+        :param votes: current number of votes of the photo
+        :return: True if any of the photo's entries changed, so its rankings need to be refreshed
+        """
+        changed = self.filter(photo_id=photo_id).exclude(votes=votes).update(votes=votes)
+
+        if not self.filter(photo_id=photo_id, classification__isnull=True).exists():
+            self.add_photo(photo_id, None, votes)
+            changed += 1
+
+        return bool(changed)
+
+    def refresh_ranks(self):
+        """
+            Recompute the rank of every entry from the stored votes with a window function, in a single statement.
+            Ranks are competition ranks: photos with the same number of votes share a rank, e.g. 1, 1, 3. Only the
+            entries whose rank changed are written.
+
+        :return: number of entries whose rank changed
+        """
+        sql = """
+            UPDATE {rank} r SET rank = ranked.rank
+            FROM (SELECT id, RANK() OVER (PARTITION BY classification_id ORDER BY votes DESC) AS rank FROM {rank}) ranked
+            WHERE r.id = ranked.id AND r.rank IS DISTINCT FROM ranked.rank
+        """.format(rank=self.model._meta.db_table)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+
+            return cursor.rowcount
+
+    def get_max_votes(self, classification_ids):
+        """
+            Return the highest number of votes in each of the given categories, read from the end of the votes index
+
+        :param classification_ids: iterable of PhotoClassification ids
+        :return: dict of the form - { classification_id: max votes }
+        """
+        return dict(self.filter(classification_id__in=classification_ids).order_by()
+                    .values("classification_id").annotate(max_votes=Max("votes"))
+                    .values_list("classification_id", "max_votes"))
+
+    def compute_ranks(self):
+        """
+            Compute every rank from scratch from the Photo tables with window functions
+
+        :return: dict of the form - { (photo_id, classification_id): (votes, rank) }
+        """
+        sql = """
+            SELECT p.id, NULL, p.votes, RANK() OVER (ORDER BY p.votes DESC)
+            FROM {photo} p
+            UNION ALL
+            SELECT p.id, c.photoclassification_id, p.votes,
+                   RANK() OVER (PARTITION BY c.photoclassification_id ORDER BY p.votes DESC)
+            FROM {photo} p INNER JOIN {category} c ON c.photo_id = p.id
+        """.format(photo=Photo._meta.db_table, category=Photo.category.through._meta.db_table)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+
+            return {(row[0], row[1]): (row[2], row[3]) for row in cursor.fetchall()}
+
+    def check_drift(self):
+        """
+            Compare the stored votes and ranks with ranks computed from scratch
+
+        :return: dict with lists of "missing", "stale" and "extra" (photo_id, classification_id) keys
+        """
+        expected = self.compute_ranks()
+        stored = {(photo_id, classification_id): (votes, rank) for photo_id, classification_id, votes, rank in
+                  self.values_list("photo_id", "classification_id", "votes", "rank")}
+
+        return {
+            "missing": [key for key in expected if key not in stored],
+            "stale": [key for key in expected if key in stored and stored[key] != expected[key]],
+            "extra": [key for key in stored if key not in expected]
+        }
+
+    def rebuild(self):
+        """
+            Replace every stored entry with ranks computed from scratch
+
+        :return: number of PhotoRank entries created
+        """
+        expected = self.compute_ranks()
+
+        with transaction.atomic():
+            self.all().delete()
+            self.bulk_create([
+                PhotoRank(photo_id=photo_id, classification_id=classification_id, votes=votes, rank=rank)
+                for (photo_id, classification_id), (votes, rank) in expected.items()
+            ], batch_size=1000)
+
+        return len(expected)
+
+
+class PhotoRank(models.Model):
+    """
+        Rank and votes of a photo in each ranking it belongs to, overall (no classification) and within each of its
+        categories. Ranks lag votes by up to PHOTO_RANK_REFRESH_SECONDS.
+
+    """
+
+    classification = models.ForeignKey(PhotoClassification, blank=True, null=True, related_name="photo_rank",
+                                       on_delete=models.CASCADE)
+    photo = models.ForeignKey(Photo, related_name="photo_rank", on_delete=models.CASCADE)
+    rank = models.IntegerField()
+    votes = models.IntegerField()
+
+    objects = PhotoRankManager()
+
+    def __str__(self):
+        return '{}: #{} with {} votes in {}'.format(self.photo_id, self.rank, self.votes,
+                                                     self.classification_id or 'overall')
+
+    class Meta:
+        index_together = ("classification", "votes")
+        unique_together = ("photo", "classification")
+
+
+class PhotoUpload(common_models.EditMixin):
+    """
+        Direct upload of an original to storage. The client POSTs the original straight to the originals bucket, then
+        finalizes the upload and a background job creates the Photo from it.
+
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    error = models.CharField(max_length=255, blank=True, default='')
+    metadata = JSONField(default=dict)
+    original_name = models.CharField(max_length=255)
+    photo = models.ForeignKey(Photo, blank=True, null=True, related_name="photo_upload", on_delete=models.SET_NULL)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default='pending')
+    user = models.ForeignKey(account_models.User, related_name="photo_upload", on_delete=models.CASCADE)
+
+    @property
+    def original_image_url(self):
+        """
+        URL the original is served from once uploaded
+
+        :return: Remote URL
+        """
+        return '{}{}'.format(settings.ORIGINAL_MEDIA_URL, self.original_name)
+
+    def __str__(self):
+        return '{}: {} ({})'.format(self.user_id, self.original_name, self.status)
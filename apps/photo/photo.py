@@ -1,5 +1,7 @@
+from apps.common.storage import get_storage, upload_async
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.core.files.base import File
+from django.core.files.storage import default_storage
 from django.core.files.images import ImageFile
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
 from django.db.models.fields.files import ImageFieldFile
@@ -7,10 +9,261 @@ from io import BufferedReader, BytesIO
 from PIL import Image as PillowImage
 from PIL import ImageFilter, ImageCms
 from PIL.ImageCms import PyCMSError
+from imagekit.utils import img_to_fobj
 from storages.backends.s3boto3 import S3Boto3Storage
+from contextlib import contextmanager
+import hashlib
 import io
-import tempfile
+import logging
+import math
+import numpy
 import os
+import random
+import shutil
+import threading
+
+logger = logging.getLogger(__name__)
+
+HEADER_CHUNK_SIZE = 64 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Images are only reduced while they stay at least this many times wider than the target, which leaves the final
+# high quality resize enough pixels to give the same result it would give from the full size image
+REDUCING_GAP = 2
+
+# Formats renditions are produced in, from least to most efficient. WebP and AVIF are only produced where this build of
+# Pillow can encode them.
+PillowImage.init()
+RENDITION_FORMATS = tuple(image_format for image_format in ('JPEG', 'WEBP', 'AVIF') if image_format in PillowImage.SAVE)
+
+# Encoder settings for renditions and renders, chosen so the formats look about the same. The JPEG ImageKit renditions
+# keep the options of their specs.
+RENDITION_FORMAT_OPTIONS = {
+    'AVIF': {'quality': 60},
+    'JPEG': {'quality': 80},
+    'WEBP': {'quality': 80, 'method': 4},
+}
+RENDITION_EXTENSIONS = {'AVIF': 'avif', 'JPEG': 'jpg', 'WEBP': 'webp'}
+
+# Every JPEG the pipeline encodes is progressive with optimized Huffman tables, which makes it smaller at the same
+# quality. Only the ICC profile is carried over from the source, EXIF and other metadata are left out.
+JPEG_ENCODER_OPTIONS = {'optimize': True, 'progressive': True}
+
+# Formats that libjpeg can decode straight at 1/2, 1/4 or 1/8 scale
+DRAFT_FORMATS = ('JPEG', 'MPO')
+
+# Formats images can be uploaded in. MPO is how Pillow identifies JPEGs from some cameras.
+UPLOAD_FORMATS = ('JPEG', 'MPO', 'PNG')
+
+# Let ImageKit and anything else opening stored images refuse the same decompression bombs uploads are checked for
+PillowImage.MAX_IMAGE_PIXELS = settings.PHOTO_MAX_PIXELS
+
+
+class ImageTooLarge(TypeError):
+    """
+    Raised for images with more pixels than can be decoded within the limits in settings.py
+    """
+    pass
+
+
+class PixelBudget(object):
+    """
+    Limit how many pixels the threads of a process decode at the same time. Decodes wait until enough of the budget is
+    free, so the memory taken by concurrent uploads is bounded by the budget rather than by the number of requests.
+    """
+    def __init__(self, pixels):
+        self.available = pixels
+        self.condition = threading.Condition()
+        self.pixels = pixels
+
+    def acquire(self, pixels):
+        """
+        Take part of the budget, waiting until enough of it is free
+
+        :param pixels: number of pixels about to be decoded. Images larger than the whole budget wait for all of it.
+        :return: number of pixels taken, to be given back with release()
+        """
+        pixels = min(pixels, self.pixels)
+
+        with self.condition:
+            while self.available < pixels:
+                self.condition.wait()
+
+            self.available -= pixels
+
+        return pixels
+
+    def release(self, pixels):
+        """
+        Give back budget taken with acquire()
+
+        :param pixels: number of pixels acquire() returned
+        :return: None
+        """
+        with self.condition:
+            self.available += pixels
+            self.condition.notify_all()
+
+    @contextmanager
+    def reserve(self, pixels):
+        """
+        Hold part of the budget for the duration of a with block
+
+        :param pixels: number of pixels about to be decoded
+        :return: None
+        """
+        pixels = self.acquire(pixels)
+
+        try:
+            yield
+        finally:
+            self.release(pixels)
+
+
+DECODE_BUDGET = PixelBudget(settings.PHOTO_DECODE_PIXEL_BUDGET)
+
+
+def decoding(image):
+    """
+    Reserve decode budget for an image that is about to be decoded. Images that are already decoded take none.
+
+    :param image: PIL Image
+    :return: context manager
+    """
+    return DECODE_BUDGET.reserve(image.size[0] * image.size[1] if getattr(image, 'tile', None) else 0)
+
+
+def get_file_hash(file_object):
+    """
+    Return the SHA-256 of a file without decoding it, which identifies uploads of the same original
+
+    :param file_object: file or uploaded file, left at its start
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+    file_object.seek(0)
+
+    for chunk in iter(lambda: file_object.read(HASH_CHUNK_SIZE), b''):
+        digest.update(chunk)
+
+    file_object.seek(0)
+
+    return digest.hexdigest()
+
+
+def get_decode_scale(width, height, image_format):
+    """
+    Decide how an image can be decoded within PHOTO_DECODE_MAX_PIXELS. JPEGs larger than that are decoded at the
+    smallest reduction libjpeg offers that fits; any other image larger than that is refused, as is anything over
+    PHOTO_MAX_PIXELS.
+
+    :param width: width read from the image header
+    :param height: height read from the image header
+    :param image_format: Pillow format read from the image header
+    :return: factor to divide the dimensions by while decoding (1, 2, 4 or 8)
+    """
+    if width * height > settings.PHOTO_MAX_PIXELS:
+        raise ImageTooLarge('Images can have at most {} pixels, got {}x{}'
+                            .format(settings.PHOTO_MAX_PIXELS, width, height))
+
+    for scale in (1, 2, 4, 8):
+        if -(-width // scale) * -(-height // scale) <= settings.PHOTO_DECODE_MAX_PIXELS:
+            return scale
+
+        if image_format not in DRAFT_FORMATS:
+            break
+
+    raise ImageTooLarge('{} images can have at most {} pixels, got {}x{}'
+                        .format(image_format, settings.PHOTO_DECODE_MAX_PIXELS, width, height))
+
+
+def parse_image_header(read_chunk):
+    """
+    Read chunks of an image until Pillow can open it. Opening is lazy, so only the header (size and format) is parsed
+    and the pixel data is never decoded. Images in formats other than UPLOAD_FORMATS are refused as soon as their
+    format is known, before anything else touches the data.
+
+    :param read_chunk: callable returning the next chunk of bytes, or empty bytes once the file is exhausted
+    :return: tuple of (width, height, format) or None if the header could not be parsed or the format is not accepted
+    """
+    fetched_bytes = b''
+
+    while True:
+        chunk = read_chunk()
+
+        if not chunk:
+            return None
+
+        fetched_bytes += chunk
+
+        try:
+            image = PillowImage.open(BytesIO(fetched_bytes))
+        # Exception handling to capture headers that have not been fetched completely yet
+        except OSError:
+            continue
+
+        if image.format not in UPLOAD_FORMATS:
+            return None
+
+        return image.size[0], image.size[1], image.format
+
+
+def read_image_header(file_object, chunk_size=HEADER_CHUNK_SIZE):
+    """
+    Read the size and format of an image from a local or in-memory file
+
+    :param file_object: file-like object positioned anywhere
+    :param chunk_size: number of bytes to read at a time
+    :return: tuple of (width, height, format) or None if the header could not be parsed
+    """
+    file_object.seek(0)
+    header = parse_image_header(lambda: file_object.read(chunk_size))
+    file_object.seek(0)
+
+    return header
+
+
+def read_stored_image_header(storage, name, chunk_size=HEADER_CHUNK_SIZE):
+    """
+    Read the size, format and byte size of a stored image. On S3 only the leading byte ranges needed to parse the
+    header are fetched instead of the whole object.
+
+    :param storage: Django storage instance holding the image
+    :param name: name of the file in the storage
+    :param chunk_size: number of bytes to request at a time
+    :return: tuple of (width, height, format, byte size) or None if the header could not be parsed
+    """
+    if isinstance(storage, S3Boto3Storage):
+        client = storage.bucket.meta.client
+        key = storage._normalize_name(storage._clean_name(name))
+        state = {"offset": 0, "size": None}
+
+        def read_chunk():
+            if state["size"] is not None and state["offset"] >= state["size"]:
+                return b''
+
+            response = client.get_object(Bucket=storage.bucket_name, Key=key,
+                                         Range='bytes={}-{}'.format(state["offset"], state["offset"] + chunk_size - 1))
+
+            # Content-Range is of the form "bytes 0-65535/1234567"
+            state["size"] = int(response["ContentRange"].split('/')[-1])
+            chunk = response["Body"].read()
+            state["offset"] += len(chunk)
+
+            return chunk
+
+        header = parse_image_header(read_chunk)
+        size = state["size"]
+    else:
+        with storage.open(name, 'rb') as f:
+            header = read_image_header(f, chunk_size)
+
+        size = storage.size(name)
+
+    if header is None:
+        return None
+
+    return header + (size,)
 
 
 class Photo(ImageFile):
@@ -36,13 +289,60 @@ class Photo(ImageFile):
                 or isinstance(file_object, InMemoryUploadedFile)
                 or isinstance(file_object, TemporaryUploadedFile)
                 or isinstance(file_object, ImageFieldFile)):
+            # Only the header is read before deciding whether and how the image can be decoded
+            header = read_image_header(file_object)
+
+            if header is None:
+                raise TypeError('File is not a supported image')
+
             super(Photo, self).__init__(file_object)
+            self.decode_scale = get_decode_scale(*header)
+            self.reserved_pixels = 0
             self.obj = file_object
             self.pillow_image = self.convert()
         else:
             raise TypeError('File object not instance of BufferedReader, '
                             'InMemoryUploadedFile, ImageFieldFile or TemporaryUploadedFile')
 
+    def __del__(self):
+        # Photos that are never closed give their decode budget back once they are garbage collected
+        self.release_decode()
+
+    def reserve_decode(self, image):
+        """
+        Take decode budget for the image of this Photo before it is decoded. The budget is held for as long as the
+        decoded image is, until close(). Images that are already decoded take none.
+
+        :param image: PIL Image about to be decoded
+        :return: None
+        """
+        if getattr(image, 'tile', None) and not self.reserved_pixels:
+            self.reserved_pixels = DECODE_BUDGET.acquire(image.size[0] * image.size[1])
+
+    def release_decode(self):
+        """
+        Give back the decode budget held by this Photo
+
+        :return: None
+        """
+        if getattr(self, 'reserved_pixels', 0):
+            DECODE_BUDGET.release(self.reserved_pixels)
+            self.reserved_pixels = 0
+
+    def close(self):
+        """
+        Free the decoded image and its decode budget. The file the Photo was made from belongs to the caller and is
+        left open.
+
+        :return: None
+        """
+        pillow_image = getattr(self, 'pillow_image', None)
+
+        if pillow_image is not None:
+            pillow_image.close()
+
+        self.release_decode()
+
     @staticmethod
     def needs_converted(image):
         """
@@ -51,17 +351,7 @@ class Photo(ImageFile):
         :param image: Image instance
         :return: Boolean
         """
-        icc_profile = image.info.get("icc_profile")
-        icc_bytes = io.BytesIO(icc_profile)
-
-        try:
-            profile = ImageCms.ImageCmsProfile(icc_bytes)
-            profile_name = ImageCms.getProfileName(profile)
-            return 'Adobe RGB' in profile_name or 'Reference Output Medium' in profile_name
-
-        # Exception handling to capture the "cannot open profile from string" exception in the case of no icc_profile
-        except (OSError, PyCMSError):
-            return False
+        return get_srgb_transform(image.info.get("icc_profile"), image.mode) is not None
 
     def convert(self):
         """
@@ -74,48 +364,61 @@ class Photo(ImageFile):
         """
         image = PillowImage.open(self.obj)
 
-        if self.needs_converted(image):
-            # If the image uses the AdobeRGB (1998) or ProPhoto RGB color space, it will be converted to sRGB
-            icc = tempfile.mkstemp(suffix='.icc')[1]
-            with open(icc, 'wb') as f:
-                f.write(image.info.get('icc_profile'))
-                icc_filename = f.name
-            srgb = ImageCms.createProfile('sRGB')
-            image = ImageCms.profileToProfile(image, icc, srgb)
+        if self.decode_scale > 1:
+            image.draft(image.mode, (image.size[0] // self.decode_scale, image.size[1] // self.decode_scale))
 
-            try:
-                os.remove(icc_filename)
-            except OSError as e:
-                print(e)
-                pass
+        # If the image is neither of the above, then the original image is returned untouched without being decoded
+        if self.needs_converted(image):
+            self.reserve_decode(image)
+            convert_to_srgb(image)
 
-        # If the image is neither of the above, then just return the original image
         return image
 
+    def get_hash(self):
+        """
+        Return the SHA-256 of the file as it was received, which identifies uploads of the same original
+
+        :return: hex digest
+        """
+        return get_file_hash(self.obj)
+
     def compress(self, quality=80, max_width=2048):
         """
         Resize and save image to memory.
         Shortcut for resize() and save() except that it returns image as in-memory bytes
 
-        :param quality: image quality
+        :param quality: image quality, or the highest quality tried when PHOTO_JPEG_TARGET_SSIM is set
         :param max_width: max image width
-        :return: BytesIO
+        :return: InMemoryUploadedFile wrapping the encoded BytesIO. Its "compress_stats" attribute holds the quality
+        used and, for the PHOTO_JPEG_SAVINGS_SAMPLE_RATE share of uploads that are measured, the bytes saved compared to
+        encoding at the given quality with Pillow's default settings. Unmeasured uploads save None.
         """
         self.resize(max_width=max_width)
+        self.reserve_decode(self.pillow_image)
 
-        mem_img = BytesIO()
-        if self.pillow_image.mode == "P":
-            self.pillow_image.convert("RGB").save(fp=mem_img, format='JPEG',
-                                                  icc_profile=self.pillow_image.info.get('icc_profile'),
-                                                  quality=quality)
-        else:
+        image = self.pillow_image.convert("RGB") if self.pillow_image.mode == "P" else self.pillow_image
+        icc_profile = self.pillow_image.info.get('icc_profile')
+        mem_img, used_quality = encode_jpeg(image, quality, settings.PHOTO_JPEG_TARGET_SSIM, icc_profile=icc_profile)
+
+        # Hand the encoder's buffer over as it is rather than copying it into another file object
+        size = mem_img.seek(0, io.SEEK_END)
+        mem_img.seek(0)
+        bytes_saved = None
 
-            self.pillow_image.save(fp=mem_img, format='JPEG', icc_profile=self.pillow_image.info.get('icc_profile'),
-                                   quality=quality)
+        # What the upload would have taken at the fixed quality with Pillow's default encoder settings. It takes a
+        # second encode, so only a sample of uploads is measured.
+        if random.random() < settings.PHOTO_JPEG_SAVINGS_SAMPLE_RATE:
+            try:
+                baseline = img_to_fobj(image, 'JPEG', True, quality=quality, icc_profile=icc_profile)
+                bytes_saved = baseline.seek(0, io.SEEK_END) - size
+            # Exception handling so that the measurement, which is only for reporting, never fails the upload
+            except Exception:
+                logger.exception('Could not measure the bytes saved compressing %s', self.name)
 
-        content = ContentFile(mem_img.getvalue())
+        compressed = InMemoryUploadedFile(mem_img, None, self.name, 'image/jpeg', size, None)
+        compressed.compress_stats = {'bytes_saved': bytes_saved, 'quality': used_quality}
 
-        return InMemoryUploadedFile(content, None, self.name, 'image/jpeg', content.tell, None)
+        return compressed
 
     def resize(self, max_width=2048):
         """
@@ -126,10 +429,83 @@ class Photo(ImageFile):
         """
         # Resize if larger than max
         if self.pillow_image.size[0] > max_width:
-            self.pillow_image =  WidthResize(max_width).process(self.pillow_image)
+            self.reserve_decode(self.pillow_image)
+            self.pillow_image = WidthResize(max_width).process(self.pillow_image)
 
         return self.pillow_image
 
+    @staticmethod
+    def get_format(filename):
+        """
+        Determine the image format to save as from the file extension
+
+        :param filename: name to give to image file
+        :return: Pillow format name
+        """
+        ext = filename.split('.')[-1]
+        if ext in ["jpg", "jpeg"]:
+            return "JPEG"
+        elif ext == 'png':
+            return "PNG"
+        else:
+            raise TypeError("Files of extension type {} are not supported.".format(ext))
+
+    def save_original(self, filename, custom_bucket=False):
+        """
+        Save the uploaded file exactly as it was received, without decoding or re-encoding it. Saves locally to media
+        or remotely
+
+        :param filename: name to give to image file
+        :param custom_bucket: If using remote storage, storage will use this bucket instead of the one set in
+        settings.py
+        :return: name of the saved file
+        """
+        self.get_format(filename)
+        self.obj.seek(0)
+
+        if settings.REMOTE_IMAGE_STORAGE:
+            storage = get_storage(custom_bucket or None)
+
+            return storage.save(filename, File(self.obj))
+        else:
+            full_filename = '{}/{}'.format(settings.MEDIA_ROOT, filename)
+
+            with open(full_filename, 'wb') as f:
+                shutil.copyfileobj(self.obj, f)
+
+            return full_filename
+
+    @staticmethod
+    def delete_original(name, custom_bucket=False):
+        """
+        Delete an original stored by save_original(), for uploads whose photo was not saved
+
+        :param name: what save_original() returned
+        :param custom_bucket: bucket the original was saved to
+        :return: None
+        """
+        if settings.REMOTE_IMAGE_STORAGE:
+            get_storage(custom_bucket or None).delete(name)
+        elif os.path.exists(name):
+            os.remove(name)
+
+    def save_original_async(self, filename, custom_bucket=False):
+        """
+        Start save_original() in the background so the original is uploaded while the compressed copy is encoded
+
+        :param filename: name to give to image file
+        :param custom_bucket: If using remote storage, storage will use this bucket instead of the one set in
+        settings.py
+        :return: Future resolving to the name of the saved file
+        """
+        self.get_format(filename)
+
+        # Finish decoding first. Pillow must not read from the upload while it is being streamed to storage.
+        self.reserve_decode(self.pillow_image)
+        self.pillow_image.load()
+
+        return upload_async(self.save_original, filename, custom_bucket)
+
     def save(self, filename, custom_bucket=False, quality=95):
         """
         Save an image. Saves locally to media or remotely
@@ -140,25 +516,18 @@ class Photo(ImageFile):
         :param quality: image quality
         :return: None
         """
-        # Determine filetype by extension
-        ext = filename.split('.')[-1]
-        if ext in ["jpg", "jpeg"]:
-            format = "JPEG"
-        elif ext == 'png':
-            format = "PNG"
-        else:
-            raise TypeError("Files of extension type {} are not supported.".format(ext))
+        format = self.get_format(filename)
+        self.reserve_decode(self.pillow_image)
+        self.pillow_image.load()
 
         if settings.REMOTE_IMAGE_STORAGE:
             mem_img = BytesIO()
             self.pillow_image.save(fp=mem_img, format=format, quality=quality,
                                    icc_profile=self.pillow_image.info.get('icc_profile'))
-            content = ContentFile(mem_img.getvalue())
+            mem_img.seek(0)
+            content = File(mem_img)
 
-            if custom_bucket:
-                storage = S3Boto3Storage(bucket=custom_bucket)
-            else:
-                storage = S3Boto3Storage()
+            storage = get_storage(custom_bucket or None)
 
             return storage.save(filename, content)
         else:
@@ -169,6 +538,455 @@ class Photo(ImageFile):
             return full_filename
 
 
+def get_ssim_sample(image):
+    """
+    Return the luma of an image at PHOTO_JPEG_SSIM_WIDTH, the copy encodings are compared on
+
+    :param image: PIL Image
+    :return: NumPy array of floats
+    """
+    width = min(image.size[0], settings.PHOTO_JPEG_SSIM_WIDTH)
+    sample = image.convert('L').resize((width, max(1, image.size[1] * width // image.size[0])), PillowImage.BILINEAR)
+
+    return numpy.asarray(sample, dtype=numpy.float64)
+
+
+def get_ssim(first, second, window=8):
+    """
+    Compute the mean structural similarity (SSIM) of two luma samples over square windows
+
+    :param first: NumPy array from get_ssim_sample()
+    :param second: NumPy array of the same shape
+    :param window: width of the windows in pixels
+    :return: float, 1 for identical samples
+    """
+    window = min(window, *first.shape)
+
+    def window_mean(values):
+        # Sums over every window from a summed-area table
+        table = numpy.pad(values.cumsum(0).cumsum(1), ((1, 0), (1, 0)), 'constant')
+
+        return (table[window:, window:] - table[:-window, window:] - table[window:, :-window] +
+                table[:-window, :-window]) / window ** 2
+
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mean_first, mean_second = window_mean(first), window_mean(second)
+    variance_first = window_mean(first * first) - mean_first ** 2
+    variance_second = window_mean(second * second) - mean_second ** 2
+    covariance = window_mean(first * second) - mean_first * mean_second
+    ssim = ((2 * mean_first * mean_second + c1) * (2 * covariance + c2)) / \
+           ((mean_first ** 2 + mean_second ** 2 + c1) * (variance_first + variance_second + c2))
+
+    return float(ssim.mean())
+
+
+def encode_jpeg(image, quality, target_ssim=None, autoconvert=True, **options):
+    """
+    Encode a progressive JPEG with optimized Huffman tables. With a target SSIM, the quality is lowered by binary search
+    to the lowest one, no lower than PHOTO_JPEG_MIN_QUALITY, whose result is still that similar to the image.
+
+    :param image: PIL Image
+    :param quality: encoder quality, the highest one tried when searching
+    :param target_ssim: similarity to keep, e.g. 0.98, or None to encode at the given quality
+    :param autoconvert: let ImageKit convert the image to a mode JPEG supports
+    :param options: other encoder options, e.g. icc_profile
+    :return: tuple of (BytesIO positioned at its start, quality used)
+    """
+    options = dict(options, **JPEG_ENCODER_OPTIONS)
+    encoded = img_to_fobj(image, 'JPEG', autoconvert, quality=quality, **options)
+
+    if not target_ssim:
+        return encoded, quality
+
+    reference = get_ssim_sample(image)
+    low, high = settings.PHOTO_JPEG_MIN_QUALITY, quality - 1
+
+    # Lower qualities give smaller files that are less similar, so the lowest acceptable one is found in a few encodes
+    while low <= high:
+        middle = (low + high) // 2
+        candidate = img_to_fobj(image, 'JPEG', autoconvert, quality=middle, **options)
+
+        if get_ssim(reference, get_ssim_sample(PillowImage.open(candidate))) >= target_ssim:
+            encoded, quality, high = candidate, middle, middle - 1
+        else:
+            low = middle + 1
+
+    encoded.seek(0)
+
+    return encoded, quality
+
+
+def reduce_for_width(image, width):
+    """
+    Cheaply shrink an image by the largest power of two that keeps it REDUCING_GAP times wider than the target width.
+    JPEGs that have not been decoded yet are decoded straight at that scale with draft(). Other images are reduced
+    with reduce() on versions of Pillow that provide it.
+
+    :param image: PIL Image
+    :param width: width the image will be resized to afterwards
+    :return: reduced Image, or the original one if it is not large enough to be worth reducing
+    """
+    factor = 1
+
+    while image.size[0] // (factor * 2) >= width * REDUCING_GAP:
+        factor *= 2
+
+    if factor == 1 or image.mode in ('1', 'P'):
+        return image
+
+    if image.format == 'JPEG' and image.tile:
+        # libjpeg can scale by 1/2, 1/4 or 1/8 while decoding
+        factor = min(factor, 8)
+        image.draft(image.mode, (image.size[0] // factor, image.size[1] // factor))
+
+        return image
+
+    if hasattr(image, 'reduce'):
+        return image.reduce(factor)
+
+    return image
+
+
+# Compiled transforms to sRGB keyed by (profile hash, image mode). None records a profile that needs no conversion.
+ICC_TRANSFORM_CACHE_SIZE = 32
+ICC_TRANSFORMS = dict()
+ICC_TRANSFORMS_LOCK = threading.Lock()
+SRGB_PROFILE = ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB'))
+
+
+def get_srgb_transform(icc_profile, mode):
+    """
+    Return a transform converting images with the given embedded profile to sRGB. Only ProPhoto RGB (ROMM) and
+    Adobe RGB (1998) images are converted. Profiles are parsed and transforms compiled once per distinct profile.
+
+    :param icc_profile: bytes of the embedded ICC profile
+    :param mode: mode of the image to convert
+    :return: ImageCmsTransform, or None if the image should be left as it is
+    """
+    if not icc_profile:
+        return None
+
+    key = (hashlib.sha1(icc_profile).hexdigest(), mode)
+
+    with ICC_TRANSFORMS_LOCK:
+        if key in ICC_TRANSFORMS:
+            return ICC_TRANSFORMS[key]
+
+    try:
+        profile = ImageCms.ImageCmsProfile(io.BytesIO(icc_profile))
+        profile_name = ImageCms.getProfileName(profile)
+    # Exception handling to capture the "cannot open profile from string" exception for unreadable profiles
+    except (OSError, PyCMSError):
+        profile_name = ''
+
+    if 'Adobe RGB' in profile_name or 'Reference Output Medium' in profile_name:
+        transform = ImageCms.buildTransform(profile, SRGB_PROFILE, mode, mode)
+    else:
+        transform = None
+
+    # Threads that compiled the same profile at once each store their own transform, the last one is kept
+    with ICC_TRANSFORMS_LOCK:
+        if key not in ICC_TRANSFORMS and len(ICC_TRANSFORMS) >= ICC_TRANSFORM_CACHE_SIZE:
+            ICC_TRANSFORMS.pop(next(iter(ICC_TRANSFORMS)))
+
+        ICC_TRANSFORMS[key] = transform
+
+    return transform
+
+
+def convert_to_srgb(image):
+    """
+    Convert a ProPhoto RGB (ROMM) or Adobe RGB (1998) image to sRGB in place. Other images are left untouched.
+
+    :param image: PIL Image
+    :return: the same Image
+    """
+    transform = get_srgb_transform(image.info.get('icc_profile'), image.mode)
+
+    if transform:
+        ImageCms.applyTransform(image, transform, inPlace=True)
+        image.info['icc_profile'] = SRGB_PROFILE.tobytes()
+
+    return image
+
+
+def rendition_width(generator):
+    """
+    Return the width an ImageKit spec resizes to, used to order renditions from largest to smallest
+
+    :param generator: ImageSpec instance
+    :return: target width or 0 if the spec does not resize by width
+    """
+    return max([getattr(processor, 'width', 0) for processor in generator.processors] or [0])
+
+
+def generate_renditions(image, generators):
+    """
+    Produce several ImageKit renditions from a single decode of the source image. Renditions are made from largest to
+    smallest, each one resized from the previous plain resize rather than from the full size original, and blurred
+    renditions are made from the smallest plain resize that is still larger than them. The WebP and AVIF versions of a
+    rendition reuse its resize. Every output is encoded with the options of its spec, and JPEGs are made progressive
+    with optimized Huffman tables by encode_jpeg().
+
+    :param image: PIL Image of the source
+    :param generators: dict of rendition name to ImageSpec instance
+    :return: dict of rendition name to file object holding the encoded rendition
+    """
+    original_format = image.format
+    image = reduce_for_width(image, max([rendition_width(g) for g in generators.values()] or [0]))
+    image.load()
+    intermediate = image
+    renditions = dict()
+
+    for name, generator in sorted(generators.items(), key=lambda item: rendition_width(item[1]), reverse=True):
+        rendition = intermediate
+
+        for processor in generator.processors:
+            rendition = processor.process(rendition)
+
+        # Only plain resizes are cascaded, a blurred image is no use as a source for sharper renditions
+        if all(type(processor) is WidthResize for processor in generator.processors):
+            intermediate = rendition
+
+        image_format = generator.format or original_format or 'JPEG'
+
+        # ImageKit only prepares image modes for the formats it knows, WebP and AVIF take RGB or RGBA
+        if image_format in ('AVIF', 'WEBP') and rendition.mode not in ('RGB', 'RGBA'):
+            rendition = rendition.convert('RGB')
+
+        if image_format == 'JPEG':
+            options = dict(generator.options or {})
+            renditions[name] = encode_jpeg(rendition, options.pop('quality', 75), settings.PHOTO_JPEG_TARGET_SSIM,
+                                           generator.autoconvert, **options)[0]
+        else:
+            renditions[name] = img_to_fobj(rendition, image_format, generator.autoconvert, **(generator.options or {}))
+
+    return renditions
+
+
+def get_render_width(width):
+    """
+    Round a requested width up to the nearest width in PHOTO_RENDER_WIDTHS, so renders can be shared between clients
+
+    :param width: width in pixels the client displays the image at
+    :return: render width
+    """
+    widths = settings.PHOTO_RENDER_WIDTHS
+
+    return next((render_width for render_width in widths if render_width >= width), widths[-1])
+
+
+def render_image(image, width, image_format):
+    """
+    Resize an image to a width, without upscaling, and encode it
+
+    :param image: PIL Image
+    :param width: width to resize to
+    :param image_format: one of RENDITION_FORMATS
+    :return: file object holding the encoded image
+    """
+    with decoding(image):
+        image = WidthResize(width).process(image)
+
+    # ImageKit prepares the mode of JPEGs, WebP and AVIF take RGB or RGBA
+    if image_format in ('AVIF', 'WEBP') and image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+
+    if image_format == 'JPEG':
+        return encode_jpeg(image, RENDITION_FORMAT_OPTIONS['JPEG']['quality'], settings.PHOTO_JPEG_TARGET_SSIM)[0]
+
+    return img_to_fobj(image, image_format, **RENDITION_FORMAT_OPTIONS[image_format])
+
+
+BLURHASH_CHARACTERS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+# Placeholders are computed from a thumbnail no larger than this, which is plenty for a few cosine components
+BLURHASH_SAMPLE_SIZE = 32
+
+# Perceptual hashes compare the rows of a thumbnail this many pixels high, giving a hash of its square in bits
+PERCEPTUAL_HASH_SIZE = 8
+
+
+def encode_base83(value, length):
+    """
+    Encode an integer in the base 83 alphabet BlurHash uses
+
+    :param value: integer to encode
+    :param length: number of characters to encode it in
+    :return: string
+    """
+    return ''.join(BLURHASH_CHARACTERS[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def srgb_to_linear(value):
+    """
+    Convert an sRGB channel value to linear light
+
+    :param value: channel value from 0 to 255
+    :return: float from 0 to 1
+    """
+    value = value / 255
+
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def linear_to_srgb(value):
+    """
+    Convert a linear light value back to an sRGB channel value
+
+    :param value: float from 0 to 1, clamped
+    :return: channel value from 0 to 255
+    """
+    value = max(0.0, min(1.0, value))
+
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def get_blurhash(image, components=None):
+    """
+    Encode a BlurHash of an image, a string of a few dozen characters clients decode into a blurred placeholder while
+    the image itself loads. The longer side of the image gets the most components. The image is drafted and shrunk to
+    BLURHASH_SAMPLE_SIZE first, so this is cheap even for images that have not been decoded yet.
+
+    :param image: PIL Image
+    :param components: components along the longer side, defaults to PHOTO_BLURHASH_COMPONENTS
+    :return: BlurHash string
+    """
+    components = components or settings.PHOTO_BLURHASH_COMPONENTS
+    width, height = image.size
+    scale = max(width, height)
+    x_components = max(1, min(9, int(round(components * width / scale))))
+    y_components = max(1, min(9, int(round(components * height / scale))))
+    size = (max(1, BLURHASH_SAMPLE_SIZE * width // scale), max(1, BLURHASH_SAMPLE_SIZE * height // scale))
+
+    image.draft('RGB', size)
+
+    with decoding(image):
+        # Convert first so palette images are averaged by their colours rather than their palette indexes
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        sample = image.resize(size, PillowImage.BOX)
+
+    width, height = sample.size
+    pixels = [tuple(srgb_to_linear(channel) for channel in pixel) for pixel in sample.getdata()]
+    x_cosines = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    y_cosines = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+    factors = list()
+
+    for j in range(y_components):
+        for i in range(x_components):
+            normalisation = (1 if i == 0 and j == 0 else 2) / (width * height)
+            red = green = blue = 0.0
+
+            for y in range(height):
+                y_basis = normalisation * y_cosines[j][y]
+                row = pixels[y * width:(y + 1) * width]
+
+                for x in range(width):
+                    basis = y_basis * x_cosines[i][x]
+                    red += basis * row[x][0]
+                    green += basis * row[x][1]
+                    blue += basis * row[x][2]
+
+            factors.append((red, green, blue))
+
+    dc, ac = factors[0], factors[1:]
+    blurhash = encode_base83((x_components - 1) + (y_components - 1) * 9, 1)
+
+    if ac:
+        quantised_maximum = max(0, min(82, int(math.floor(max(abs(v) for factor in ac for v in factor) * 166 - 0.5))))
+        maximum = (quantised_maximum + 1) / 166
+        blurhash += encode_base83(quantised_maximum, 1)
+    else:
+        maximum = 1
+        blurhash += encode_base83(0, 1)
+
+    blurhash += encode_base83((linear_to_srgb(dc[0]) << 16) + (linear_to_srgb(dc[1]) << 8) + linear_to_srgb(dc[2]), 4)
+
+    for factor in ac:
+        red, green, blue = [max(0, min(18, int(math.floor(math.copysign(abs(v / maximum) ** 0.5, v) * 9 + 9.5))))
+                            for v in factor]
+        blurhash += encode_base83(red * 19 * 19 + green * 19 + blue, 2)
+
+    return blurhash
+
+
+def get_perceptual_hash(image):
+    """
+    Compute the difference hash (dHash) of an image: one bit per pair of neighbouring pixels of a 9x8 grayscale
+    thumbnail, set where brightness increases to the right. Resized, recompressed or slightly edited copies of a photo
+    have hashes a few bits apart. The image is drafted first, so this is cheap even if it has not been decoded yet.
+
+    :param image: PIL Image
+    :return: 64 bit hash as a signed integer, so that it fits a BigIntegerField
+    """
+    image.draft('L', (PERCEPTUAL_HASH_SIZE * 4, PERCEPTUAL_HASH_SIZE * 4))
+
+    with decoding(image):
+        sample = image.convert('L').resize((PERCEPTUAL_HASH_SIZE + 1, PERCEPTUAL_HASH_SIZE), PillowImage.BOX)
+
+    pixels = numpy.asarray(sample, dtype=numpy.int16)
+    value = int.from_bytes(numpy.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes(), 'big')
+
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def get_rendition_storage():
+    """
+    Return the storage renditions are written to. On S3 their files are marked immutable, since their names are derived
+    from their content.
+
+    :return: Django storage instance
+    """
+    if settings.REMOTE_IMAGE_STORAGE:
+        return get_storage(cache_control=settings.PHOTO_RENDITION_CACHE_CONTROL)
+
+    return default_storage
+
+
+def get_rendition_name(field_name, content, image_format):
+    """
+    Name a rendition file after a hash of its content, so a name always refers to the same bytes
+
+    :param field_name: name of the rendition field, e.g. image_small_webp
+    :param content: encoded rendition bytes
+    :param image_format: one of RENDITION_FORMATS
+    :return: storage name, e.g. renditions/image_small_webp/<sha256>.webp
+    """
+    return 'renditions/{}/{}.{}'.format(field_name, hashlib.sha256(content).hexdigest(),
+                                        RENDITION_EXTENSIONS[image_format])
+
+
+class StoredRendition(object):
+    """
+    A generated rendition known only by its name in storage. Stands in for an ImageKit cache file when serializing, so
+    URLs are built without ImageKit naming the file or checking storage.
+    """
+    def __init__(self, storage, name):
+        self.name = name
+        self.storage = storage
+
+    @property
+    def url(self):
+        return self.storage.url(self.name)
+
+    def __str__(self):
+        return self.name
+
+
+class DeferredRendition(object):
+    """
+    ImageKit cache file strategy that never generates a rendition while handling a request. Rendition URLs are built
+    without checking storage and the files are written by the generate_photo_renditions task.
+    """
+    def should_verify_existence(self, file):
+        return False
+
+
 class WidthResize(object):
     """
     Resize an image by setting the width and then calculating the height needed to maintain proportions
@@ -187,6 +1005,7 @@ class WidthResize(object):
         # Resize if larger than max
         if img.size[0] > self.width or self.upscale:
             img_ratio = img.size[0] / float(img.size[1])
+            img = reduce_for_width(img, self.width)
             new_height = int(self.width / img_ratio)
             img = img.resize((self.width, new_height), PillowImage.ANTIALIAS)
 
@@ -2,13 +2,259 @@ from apps.account import models as account_models
 from apps.account.serializers import UserBasicSerializer, UserPublicSerializer
 from apps.common.serializers import DateTimeFieldWithTZ, determine_render
 from apps.photo import models
+from apps.photo.photo import RENDITION_FORMATS
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
-from django.db.models import Max
+from django.db.models import Manager, Max, Prefetch
 from rest_framework import serializers
 from rest_framework.authentication import TokenAuthentication
 import re
 
 
+def get_viewing_user(request):
+    """
+        Authenticate the user accessing the API. The result is kept on the request so token authentication only runs
+        once per request, no matter how many photos get serialized.
+
+    :param request: HTTP Request object
+    :return: User or AnonymousUser
+    """
+    if not hasattr(request, "_viewing_user"):
+        authenticate = TokenAuthentication().authenticate(request)
+        request._viewing_user = authenticate[0] if authenticate else request.user
+
+    return request._viewing_user
+
+
+def get_rendition_format(request):
+    """
+        Pick the most efficient rendition format the client supports, named by the image_format query parameter or
+        advertised in the Accept header (e.g. "image/webp"). The choice is kept on the request.
+
+    :param request: HTTP Request object or None
+    :return: one of RENDITION_FORMATS
+    """
+    if request is None:
+        return "JPEG"
+
+    if not hasattr(request, "_rendition_format"):
+        requested = getattr(request, "query_params", request.GET).get("image_format", "").upper()
+        accept = request.META.get("HTTP_ACCEPT", "")
+
+        if requested in RENDITION_FORMATS:
+            request._rendition_format = requested
+        else:
+            request._rendition_format = next(
+                (image_format for image_format in reversed(RENDITION_FORMATS)
+                 if "image/{}".format(image_format.lower()) in accept), "JPEG")
+
+    return request._rendition_format
+
+
+def get_render_url(request, photo, width):
+    """
+        Build the URL of a render of a photo in the format the client asked for. The render endpoint redirects to the
+        stored render, so building the URL never touches storage.
+
+    :param request: HTTP Request object
+    :param photo: Photo object
+    :param width: width to render at
+    :return: absolute URL
+    """
+    return request.build_absolute_uri("/api/photos/{}/render?width={}&image_format={}".format(
+        photo.id, width, get_rendition_format(request).lower()))
+
+
+def get_render_srcset(request, photo):
+    """
+        Build a srcset listing the renders of a photo that are narrower than the image, plus one at the image's own
+        width. Every configured width is listed while the image width has not been backfilled.
+
+    :param request: HTTP Request object
+    :param photo: Photo object
+    :return: srcset string, e.g. "https://.../render?width=160&image_format=jpeg 160w, ..."
+    """
+    image_width = photo.get_dimensions()["width"]
+
+    if image_width is None:
+        widths = list(settings.PHOTO_RENDER_WIDTHS)
+    else:
+        widths = [width for width in settings.PHOTO_RENDER_WIDTHS if width < image_width] + [image_width]
+
+    return ", ".join("{} {}w".format(get_render_url(request, photo, width), width) for width in widths)
+
+
+def get_viewer_state(request):
+    """
+        Retrieve the PhotoViewerState for a request, creating it the first time it is needed
+
+    :param request: HTTP Request object
+    :return: PhotoViewerState instance
+    """
+    if not hasattr(request, "_photo_viewer_state"):
+        request._photo_viewer_state = PhotoViewerState(get_viewing_user(request))
+
+    return request._photo_viewer_state
+
+
+def get_category_max_votes(request):
+    """
+        Retrieve the CategoryMaxVotes map for a request, creating it the first time it is needed
+
+    :param request: HTTP Request object
+    :return: CategoryMaxVotes instance
+    """
+    if not hasattr(request, "_category_max_votes"):
+        request._category_max_votes = CategoryMaxVotes()
+
+    return request._category_max_votes
+
+
+class CategoryMaxVotes(object):
+    """
+        In-memory map of the highest number of votes in each category, used to compute votes_behind. Categories are
+        resolved in batches from the PhotoRank table, so a page of photos costs one query in total.
+
+    """
+
+    def __init__(self):
+        self.max_votes = dict()
+
+    def resolve(self, classification_ids):
+        """
+            Load the vote ceiling of any of the given categories that have not been loaded yet
+
+        :param classification_ids: iterable of PhotoClassification ids
+        :return: None
+        """
+        missing = set(classification_ids) - set(self.max_votes)
+
+        if not missing:
+            return
+
+        self.max_votes.update(models.PhotoRank.objects.get_max_votes(missing))
+        missing -= set(self.max_votes)
+
+        # Fall back to aggregating the photos for categories that have not been ranked yet
+        if missing:
+            self.max_votes.update(models.Photo.objects.filter(category__in=missing)
+                                  .values("category").annotate(max_votes=Max("votes"))
+                                  .values_list("category", "max_votes"))
+
+    def get_votes_behind(self, photo):
+        """
+            Returns the difference between the photo's votes and the top photo of each of its categories
+
+        :param photo: Photo object
+        :return: dict of the form - { "classification_name": number of votes behind top photo in category }
+        """
+        classifications = photo.category.all()
+        self.resolve([classification.id for classification in classifications])
+
+        return {
+            classification.name: self.max_votes.get(classification.id, photo.votes) - photo.votes
+            for classification in classifications
+        }
+
+
+class PhotoViewerState(object):
+    """
+        In-memory map of the stars and votes the accessing user has on photos. Photos are resolved in batches so a
+        page of photos costs one UserInterest query and one PhotoVote query instead of two queries per photo.
+
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.resolved = set()
+        self.starred = set()
+        self.votes = dict()
+
+    def resolve(self, photo_ids):
+        """
+            Load the user's stars and votes for any of the given photos that have not been loaded yet
+
+        :param photo_ids: iterable of Photo ids
+        :return: None
+        """
+        missing = set(photo_ids) - self.resolved
+
+        if not missing:
+            return
+
+        if self.user.is_authenticated:
+            photo_type = ContentType.objects.get_for_model(models.Photo)
+            self.starred.update(account_models.UserInterest.objects.filter(
+                interest_type="star", user=self.user, content_type__pk=photo_type.id,
+                object_id__in=missing).values_list("object_id", flat=True))
+            self.votes.update(models.PhotoVote.objects.filter(
+                user=self.user, photo_id__in=missing).values_list("photo_id", "upvote"))
+
+        self.resolved.update(missing)
+
+    def get_starred(self, photo):
+        """
+            Return whether the user has starred the photo
+
+        :param photo: Photo object
+        :return: Dict denoting whether a star has occurred
+        """
+        self.resolve([photo.id])
+
+        return {
+            "starred": photo.id in self.starred,
+        }
+
+    def get_voted(self, photo):
+        """
+            Return the type of vote the user gave the photo, if any
+
+        :param photo: Photo object
+        :return: dict of data denoting type of vote a user gave
+        """
+        self.resolve([photo.id])
+
+        if photo.id in self.votes:
+            return {
+                "voted": True,
+                "type": "upvote" if self.votes[photo.id] else "downvote"
+            }
+
+        return {
+            "voted": False,
+        }
+
+
+class PhotoRenditionField(serializers.ImageField):
+    """
+    Image field for a Photo rendition in the format the client asked for. Serves the original image until the
+    renditions have been generated.
+    """
+    def get_attribute(self, instance):
+        return instance.get_rendition(self.source, get_rendition_format(self.context.get("request")))
+
+
+class PhotoListSerializer(serializers.ListSerializer):
+    """
+        List serializer that resolves the accessing user's stars and votes for the whole page of photos up front
+
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, Manager) else data
+        iterable = list(iterable)
+        request = self.context.get("request")
+
+        if request is not None:
+            get_viewer_state(request).resolve([photo.id for photo in iterable])
+
+            if "votes_behind" in self.child.fields:
+                get_category_max_votes(request).resolve(
+                    [classification.id for photo in iterable for classification in photo.category.all()])
+
+        return super(PhotoListSerializer, self).to_representation(iterable)
+
+
 class GallerySerializer(serializers.ModelSerializer):
     """
         Serializer for GalleryModel instances
@@ -123,11 +369,13 @@ class PhotoCustomRenderSerializer(serializers.ModelSerializer):
 
     """
     image = serializers.SerializerMethodField()
+    srcset = serializers.SerializerMethodField()
 
     def get_image(self, obj):
-        render_string = determine_render(self.context)
-        render_field = getattr(obj, render_string)
-        return self.context["request"].build_absolute_uri(render_field.url)
+        return get_render_url(self.context["request"], obj, determine_render(self.context))
+
+    def get_srcset(self, obj):
+        return get_render_srcset(self.context["request"], obj)
 
     @staticmethod
     def setup_eager_loading(queryset):
@@ -135,8 +383,8 @@ class PhotoCustomRenderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.Photo
-        fields = ("id", "image")
-        read_only_fields = ("image",)
+        fields = ("id", "image", "srcset")
+        read_only_fields = ("image", "srcset")
 
 
 class PhotoRenderSerializer(serializers.ModelSerializer):
@@ -145,12 +393,12 @@ class PhotoRenderSerializer(serializers.ModelSerializer):
 
     :author: gallen
     """
-    image_blurred = serializers.ImageField(required=False)
-    image_medium = serializers.ImageField(required=False)
-    image_small = serializers.ImageField(required=False)
-    image_small_2 = serializers.ImageField(required=False)
-    image_tiny_246 = serializers.ImageField(required=False)
-    image_tiny_272 = serializers.ImageField(required=False)
+    image_blurred = PhotoRenditionField(required=False)
+    image_medium = PhotoRenditionField(required=False)
+    image_small = PhotoRenditionField(required=False)
+    image_small_2 = PhotoRenditionField(required=False)
+    image_tiny_246 = PhotoRenditionField(required=False)
+    image_tiny_272 = PhotoRenditionField(required=False)
 
     @staticmethod
     def setup_eager_loading(queryset):
@@ -158,11 +406,11 @@ class PhotoRenderSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.Photo
-        fields = ('id', 'image', 'image_blurred', 'image_medium', 'image_small', 'image_small_2', 'image_tiny_246',
-                  'image_tiny_272',)
+        fields = ('id', 'blurhash', 'image', 'image_blurred', 'image_medium', 'image_small', 'image_small_2',
+                  'image_tiny_246', 'image_tiny_272',)
         ordering_fields = ('id')
         ordering = ('-id',)
-        read_only_fields = ('image_blurred', 'image_medium', 'image_small', 'image_small_2', 'image_tiny_246',
+        read_only_fields = ('blurhash', 'image_blurred', 'image_medium', 'image_small', 'image_small_2', 'image_tiny_246',
                             'image_tiny_272')
 
 
@@ -212,7 +460,7 @@ class PhotoDetailsSerializer(serializers.ModelSerializer):
         :param obj: Photo object
         :return: Number of comments related to the photo
         """
-        return obj.photo_comment.count()
+        return obj.comment_count
 
     def get_dimensions(self, obj):
         """
@@ -221,7 +469,7 @@ class PhotoDetailsSerializer(serializers.ModelSerializer):
         :param obj: Photo object
         :return: dict containing image dimensions
         """
-        return {'width': obj.image.width, 'height': obj.image.height}
+        return obj.get_dimensions()
 
     def get_tag(self, obj):
         """
@@ -253,18 +501,7 @@ class PhotoDetailsSerializer(serializers.ModelSerializer):
         :param obj: Photo object
         :return: Dict denoting whether a star has occurred
         """
-
-        authenticate = TokenAuthentication().authenticate(self.context["request"])
-        if authenticate:
-            user = authenticate[0]
-        else:
-            user = self.context["request"].user
-        photo_type = ContentType.objects.get_for_model(obj)
-        star_interest = account_models.UserInterest.objects.filter(interest_type='star', user=user,
-                                                                   object_id=obj.id, content_type__pk=photo_type.id)
-        return {
-            "starred": star_interest.exists(),
-        }
+        return get_viewer_state(self.context["request"]).get_starred(obj)
 
     def get_user_voted(self, obj):
         """
@@ -273,41 +510,16 @@ class PhotoDetailsSerializer(serializers.ModelSerializer):
         :param obj: Photo obj
         :return: dict of data denoting type of vote a user gave
         """
-        authenticate = TokenAuthentication().authenticate(self.context["request"])
-        if authenticate:
-            user = authenticate[0]
-        else:
-            user = self.context["request"].user
-        photo_vote = models.PhotoVote.objects.filter(photo=obj, user=user)
-        if photo_vote.exists():
-            return {
-                "voted": True,
-                "type": "upvote" if photo_vote.first().upvote else "downvote"
-            }
-
-        return {
-            "voted": photo_vote.exists(),
-        }
+        return get_viewer_state(self.context["request"]).get_voted(obj)
 
     def get_votes_behind(self, obj):
         """
-            Returns the difference between
+            Returns the difference between the photo's votes and the top photo of each of its categories
 
         :param obj: Photo object
         :return: dict of the form - { "classification_name": number of votes behind top photo in category }
         """
-
-        classifications = obj.category.all()
-        votes_behind_dict = {}
-
-        for classification_id, classification_name in classifications.values_list('id', 'name'):
-            category_photos = models.Photo.objects.filter(category=classification_id)
-            max_votes = category_photos.aggregate(Max('votes'))
-            votes_behind_dict.update({
-                classification_name: max_votes["votes__max"] - obj.votes
-            })
-
-        return votes_behind_dict
+        return get_category_max_votes(self.context["request"]).get_votes_behind(obj)
 
     @staticmethod
     def setup_eager_loading(queryset):
@@ -315,7 +527,7 @@ class PhotoDetailsSerializer(serializers.ModelSerializer):
         # queryset = queryset.select_related("user")
 
         # prefetch_related for "to-many" relationships
-        queryset = queryset.prefetch_related("category", "tag", "gear", "photo_comment", "photo_vote", "photo_feed")
+        queryset = queryset.prefetch_related("category", "tag", "gear", "photo_vote", "photo_feed")
 
         return queryset
 
@@ -327,6 +539,7 @@ class PhotoDetailsSerializer(serializers.ModelSerializer):
                   "user_starred", "bts_lens", "bts_shutter", "bts_iso", "bts_aperture",
                   "bts_camera_settings", "bts_time_of_day", "bts_camera_make", "bts_camera_model",
                   "bts_photo_editor",)
+        list_serializer_class = PhotoListSerializer
         ordering_fields = ("id", "location")
         ordering = ("-id",)
         read_only_fields = ("photo_data", "user_details", "comments", "user_voted", "user_starred")
@@ -340,17 +553,18 @@ class PhotoSerializer(serializers.ModelSerializer):
     comments = serializers.SerializerMethodField()
     dimensions = serializers.SerializerMethodField()
     geo_location = serializers.CharField(max_length=64, write_only=True, required=False)
-    image_blurred = serializers.ImageField(required=False)
+    image_blurred = PhotoRenditionField(required=False)
 
     #TODO Remove the following block when optimizations are done on Frontend
-    image_medium = serializers.ImageField(required=False)
-    image_small = serializers.ImageField(required=False)
-    image_small_2 = serializers.ImageField(required=False)
-    image_tiny_246 = serializers.ImageField(required=False)
-    image_tiny_272 = serializers.ImageField(required=False)
+    image_medium = PhotoRenditionField(required=False)
+    image_small = PhotoRenditionField(required=False)
+    image_small_2 = PhotoRenditionField(required=False)
+    image_tiny_246 = PhotoRenditionField(required=False)
+    image_tiny_272 = PhotoRenditionField(required=False)
 
     rank = serializers.SerializerMethodField()
     scaled_render = serializers.SerializerMethodField()
+    scaled_srcset = serializers.SerializerMethodField()
     tag = serializers.SerializerMethodField()
     user_details = serializers.SerializerMethodField()
     user_starred = serializers.SerializerMethodField()
@@ -364,7 +578,7 @@ class PhotoSerializer(serializers.ModelSerializer):
         :param obj: Photo object
         :return: Number of comments related to the photo
         """
-        return obj.photo_comment.count()
+        return obj.comment_count
 
     def get_dimensions(self, obj):
         """
@@ -373,13 +587,23 @@ class PhotoSerializer(serializers.ModelSerializer):
         :param obj: Photo object
         :return: dict containing image dimensions
         """
-        return {'width': obj.image.width, 'height': obj.image.height}
+        return obj.get_dimensions()
 
     def get_scaled_render(self, obj):
         if "width" in self.context["request"].query_params and "height" in self.context["request"].query_params:
-            render_string = determine_render(self.context)
-            render_field = getattr(obj, render_string)
-            return self.context["request"].build_absolute_uri(render_field.url)
+            return get_render_url(self.context["request"], obj, determine_render(self.context))
+
+        return ""
+
+    def get_scaled_srcset(self, obj):
+        """
+            Get the srcset of renders when a render size is requested
+
+        :param obj: Photo object
+        :return: srcset string or empty string
+        """
+        if "width" in self.context["request"].query_params and "height" in self.context["request"].query_params:
+            return get_render_srcset(self.context["request"], obj)
 
         return ""
 
@@ -413,20 +637,7 @@ class PhotoSerializer(serializers.ModelSerializer):
         :param obj: Photo object
         :return: Dict denoting whether a star has occurred
         """
-
-        authenticate = TokenAuthentication().authenticate(self.context["request"])
-        star_interest = account_models.UserInterest.objects.none()
-        if authenticate:
-            user = authenticate[0]
-        else:
-            user = self.context["request"].user
-
-        if user.__str__() != "AnonymousUser":
-            star_interest = obj.user_interest.filter(user=user, interest_type="star")
-
-        return {
-            "starred": star_interest.exists(),
-        }
+        return get_viewer_state(self.context["request"]).get_starred(obj)
 
     def get_user_voted(self, obj):
         """
@@ -435,73 +646,32 @@ class PhotoSerializer(serializers.ModelSerializer):
         :param obj: Photo obj
         :return: dict of data denoting type of vote a user gave
         """
-        authenticate = TokenAuthentication().authenticate(self.context["request"])
-        if authenticate:
-            user = authenticate[0]
-        else:
-            user = self.context["request"].user
-
-        # Put in a check to prevent the attempts of retrieving PhotoVote objects for the AnonymousUser object.
-        if user.__str__() != "AnonymousUser":
-            photo_vote = models.PhotoVote.objects.filter(photo=obj, user=user)
-        else:
-            photo_vote = models.PhotoVote.objects.none()
-
-        if photo_vote.exists():
-            return {
-                "voted": True,
-                "type": "upvote" if photo_vote.first().upvote else "downvote"
-            }
-
-        return {
-            "voted": photo_vote.exists(),
-        }
+        return get_viewer_state(self.context["request"]).get_voted(obj)
 
     def get_votes_behind(self, obj):
         """
-            Returns the difference between
+            Returns the difference between the photo's votes and the top photo of each of its categories
 
         :param obj: Photo object
         :return: dict of the form - { "classification_name": number of votes behind top photo in category }
         """
-
-        classifications = obj.category.all()
-        votes_behind_dict = {}
-
-        for classification_id, classification_name in classifications.values_list('id', 'name'):
-            category_photos = models.Photo.objects.filter(category=classification_id)
-            max_votes = category_photos.aggregate(Max('votes'))
-            votes_behind_dict.update({
-                classification_name: max_votes["votes__max"] - obj.votes
-            })
-
-        return votes_behind_dict
+        return get_category_max_votes(self.context["request"]).get_votes_behind(obj)
     
     def get_rank(self, obj):
-        classifications = obj.category.all()
+        """
+            Returns the stored vote rank of the photo overall and within each of its categories. Photos with the same
+            number of votes share a rank, and the next photo is ranked after all of them (1, 1, 3).
+
+        :param obj: Photo object
+        :return: dict of the form - { "overall": rank, "classification_name": rank in category }
+        """
         rank_dict = dict()
-        photos = models.Photo.objects.all()
-        count = 1
-        for category_photo_id in photos.annotate(
-                max_votes=Max('votes')).order_by("-max_votes").values_list("id", flat=True):
-            if category_photo_id == obj.id:
-                rank_dict.update({
-                    "overall": count
-                })
+
+        for photo_rank in obj.photo_rank.all():
+            if photo_rank.classification_id is None:
+                rank_dict["overall"] = photo_rank.rank
             else:
-                count += 1
-
-        for classification_id, classification_name in classifications.values_list('id', 'name'):
-            category_photos = photos.filter(category=classification_id)
-            count = 1
-            for category_photo_id in category_photos.annotate(
-                    max_votes=Max('votes')).order_by("-max_votes").values_list("id", flat=True):
-                if category_photo_id == obj.id:
-                    rank_dict.update({
-                        classification_name: count
-                    })
-                else:
-                    count += 1
+                rank_dict[photo_rank.classification.name] = photo_rank.rank
 
         return rank_dict
 
@@ -511,7 +681,9 @@ class PhotoSerializer(serializers.ModelSerializer):
         queryset = queryset.select_related("user")
 
         # prefetch_related for "to-many" relationships
-        queryset = queryset.prefetch_related("category", "tag", "gear", "photo_comment", "photo_vote", "photo_feed")
+        queryset = queryset.prefetch_related(
+            "category", "tag", "gear", "photo_vote", "photo_feed",
+            Prefetch("photo_rank", queryset=models.PhotoRank.objects.select_related("classification")))
 
         return queryset
 
@@ -525,16 +697,28 @@ class PhotoSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = models.Photo
-        fields = ("id", "category", "gear", "geo_location", "tag", "user", "attribution_name", "dimensions", "image",
-                  "image_blurred", "image_medium", "image_small", "image_small_2", "image_tiny_246",
+        fields = ("id", "category", "gear", "geo_location", "tag", "user", "attribution_name", "blurhash", "dimensions",
+                  "image", "image_blurred", "image_medium", "image_small", "image_small_2", "image_tiny_246",
                   "image_tiny_272", "latitude", "location", "longitude", "photo_data", "original_image_url", "public",
                   "photo_feed", "user_details", "magazine_authorized", "caption", "votes_behind", "comments", "votes",
                   "user_voted", "user_starred", "bts_lens", "bts_shutter", "bts_iso", "bts_aperture",
                   "bts_camera_settings", "bts_time_of_day", "bts_camera_make", "bts_camera_model",
-                  "bts_photo_editor", "scaled_render", "rank")
+                  "bts_photo_editor", "scaled_render", "scaled_srcset", "rank")
         extra_kwargs = {"original_image_url":  {"write_only": True},
                         "public": {"default": True, "write_only": True}}
+        list_serializer_class = PhotoListSerializer
         ordering_fields = ("id", "location")
         ordering = ("-id",)
-        read_only_fields = ("image_blurred", "image_medium", "image_small", "image_small_2", "image_tiny_246",
-                            "image_tiny_272", "scaled_render", "rank")
\ No newline at end of file
+        read_only_fields = ("blurhash", "image_blurred", "image_medium", "image_small", "image_small_2",
+                            "image_tiny_246", "image_tiny_272", "scaled_render", "scaled_srcset", "rank")
+
+
+class PhotoUploadSerializer(serializers.ModelSerializer):
+    """
+        Status of a direct upload. "photo" is set once the upload has been processed.
+
+    """
+    class Meta:
+        model = models.PhotoUpload
+        fields = ("id", "created_at", "error", "original_name", "photo", "status")
+        read_only_fields = ("created_at", "error", "original_name", "photo", "status")
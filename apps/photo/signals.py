@@ -1,25 +1,242 @@
+from apps.account import models as account_models
 from apps.photo import models as photo_models
-from django.db.models.signals import post_save
+from apps.photo import tasks as photo_tasks
+from apps.photo.similarity import PHOTO_SIMILARITY_INDEX
+from apps.utils import models as utils_models
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
 from django.dispatch import receiver
+from kombu.exceptions import OperationalError
+import logging
+
+logger = logging.getLogger(__name__)
+
+ACTION_COUNTERS = {"photo_click": "click_count", "photo_flag": "flag_count", "photo_imp": "impression_count"}
+INTEREST_COUNTERS = {"like": "like_count", "star": "star_count"}
+
+
+def queue_photo_renditions(photo_id, image_name):
+    """
+    Hand rendition generation for a photo to Celery
+
+    :param photo_id: id of the Photo
+    :param image_name: name of the image the renditions are generated from
+    :return: None
+    """
+    try:
+        photo_tasks.generate_photo_renditions.delay(photo_id, image_name)
+    except OperationalError as e:
+        # The photo keeps serving its original image until the renditions are regenerated
+        print(e)
 
 
 @receiver(post_save, sender=photo_models.Photo)
 def save_photo_image_caches(sender, instance, **kwargs):
     """
-    This signal is basically a hack. After an image is saved, we need to generate different image sizes using Image Kit.
-    The problem is that the .generate() function throws a ValueError. So this is meant to ensure that cached images
-    are available for the app to call up.
+    Queue generation of the ImageKit renditions when a photo gets a new image, and drop its old perceptual hash from
+    the similarity index. Saves that leave the image untouched, such as vote updates and admin edits, do not regenerate
+    anything. The task is queued once the transaction commits
+    so the worker always sees the saved photo.
 
     :param sender:
     :param instance: instance of Photo that was just saved
     :param kwargs:
     :return: None
     """
-    image_sizes = ('image_blurred', 'image_medium', 'image_small', 'image_small_2', 'image_tiny_246', 'image_tiny_272',)
+    if not getattr(instance, "_image_changed", False) or not instance.image:
+        return
+
+    instance._image_changed = False
+    photo_id, image_name = instance.id, instance.image.name
+    PHOTO_SIMILARITY_INDEX.update_photo(photo_id, instance.perceptual_hash)
+    transaction.on_commit(lambda: queue_photo_renditions(photo_id, image_name))
+
+
+def queue_photo_rank_refresh():
+    """
+    Hand a refresh of the stored ranks to Celery once the transaction commits. Changes within
+    PHOTO_RANK_REFRESH_SECONDS of each other share one refresh, which runs at the end of that window.
+
+    :return: None
+    """
+    def queue():
+        if not cache.add("photo_rank_refresh_queued", True, settings.PHOTO_RANK_REFRESH_SECONDS):
+            return
 
-    for image in image_sizes:
         try:
-            img = getattr(instance, image)
-            img.generate()
-        except ValueError:
-            pass
+            photo_tasks.refresh_photo_ranks.apply_async(countdown=settings.PHOTO_RANK_REFRESH_SECONDS)
+        except OperationalError as e:
+            # The ranks are brought up to date by the next change that queues a refresh
+            cache.delete("photo_rank_refresh_queued")
+            logger.warning("Could not queue a photo rank refresh: %s", e)
+
+    transaction.on_commit(queue)
+
+
+@receiver(post_save, sender=photo_models.Photo)
+def update_photo_rank(sender, instance, **kwargs):
+    """
+    Keep the ranked votes of a photo in step with its votes
+
+    :param sender:
+    :param instance: instance of Photo that was just saved
+    :param kwargs:
+    :return: None
+    """
+    if photo_models.PhotoRank.objects.update_photo(instance.id, instance.votes):
+        queue_photo_rank_refresh()
+
+
+@receiver(post_delete, sender=photo_models.Photo)
+def remove_photo_rank(sender, instance, **kwargs):
+    """
+    Refresh the ranks once a deleted photo's entries are gone, so the photos below it move up
+
+    :param sender:
+    :param instance: instance of Photo that was deleted
+    :param kwargs:
+    :return: None
+    """
+    queue_photo_rank_refresh()
+
+
+@receiver(post_save, sender=photo_models.PhotoVote)
+@receiver(post_delete, sender=photo_models.PhotoVote)
+def update_photo_vote_rank(sender, instance, **kwargs):
+    """
+    Re-sync the ranks of a photo when one of its vote records changes. Photo.votes remains the source of truth.
+
+    :param sender:
+    :param instance: instance of PhotoVote that was saved or deleted
+    :param kwargs:
+    :return: None
+    """
+    votes = photo_models.Photo.objects.filter(id=instance.photo_id).values_list("votes", flat=True).first()
+
+    if votes is not None and photo_models.PhotoRank.objects.update_photo(instance.photo_id, votes):
+        queue_photo_rank_refresh()
+
+
+@receiver(m2m_changed, sender=photo_models.Photo.category.through)
+def update_photo_category_rank(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Add and remove category rankings as photos join and leave categories
+
+    :param sender:
+    :param instance: Photo (or PhotoClassification when reverse) whose categories changed
+    :param action: type of m2m update
+    :param reverse: True if the change was made from the PhotoClassification side
+    :param pk_set: ids of the PhotoClassification (or Photo when reverse) objects added or removed
+    :param kwargs:
+    :return: None
+    """
+    if action == "post_add":
+        if reverse:
+            for photo_id, votes in photo_models.Photo.objects.filter(id__in=pk_set).values_list("id", "votes"):
+                photo_models.PhotoRank.objects.add_photo(photo_id, instance.id, votes)
+        else:
+            for classification_id in pk_set:
+                photo_models.PhotoRank.objects.add_photo(instance.id, classification_id, instance.votes)
+
+    elif action == "post_remove":
+        if reverse:
+            photo_models.PhotoRank.objects.filter(classification=instance, photo_id__in=pk_set).delete()
+        else:
+            photo_models.PhotoRank.objects.filter(photo=instance, classification_id__in=pk_set).delete()
+
+    elif action == "post_clear":
+        if reverse:
+            photo_models.PhotoRank.objects.filter(classification=instance).delete()
+        else:
+            photo_models.PhotoRank.objects.filter(photo=instance, classification__isnull=False).delete()
+
+    if action in ("post_add", "post_remove", "post_clear"):
+        queue_photo_rank_refresh()
+
+
+def update_photo_counter(photo_id, field, delta):
+    """
+    Atomically adjust one of the interaction counters on a photo
+
+    :param photo_id: id of the Photo to update
+    :param field: name of the counter field
+    :param delta: amount to add to the counter
+    :return: None
+    """
+    photo_models.Photo.objects.filter(id=photo_id).update(**{field: F(field) + delta})
+
+
+def get_generic_counter(instance, counter_fields, type_field):
+    """
+    Return the Photo counter a generic UserAction or UserInterest record contributes to
+
+    :param instance: UserAction or UserInterest instance
+    :param counter_fields: dict of action or interest type to Photo counter field
+    :param type_field: name of the attribute holding the action or interest type
+    :return: counter field name or None if the record is not about a photo
+    """
+    if instance.content_type_id != ContentType.objects.get_for_model(photo_models.Photo).id:
+        return None
+
+    return counter_fields.get(getattr(instance, type_field))
+
+
+@receiver(post_save, sender=photo_models.PhotoComment)
+@receiver(post_delete, sender=photo_models.PhotoComment)
+def update_photo_comment_count(sender, instance, **kwargs):
+    """
+    Keep Photo.comment_count in step with comments being added and removed
+
+    :param sender:
+    :param instance: instance of PhotoComment that was saved or deleted
+    :param kwargs:
+    :return: None
+    """
+    if kwargs.get("created", True) is False:
+        return
+
+    update_photo_counter(instance.photo_id, "comment_count", 1 if "created" in kwargs else -1)
+
+
+@receiver(post_save, sender=account_models.UserInterest)
+@receiver(post_delete, sender=account_models.UserInterest)
+def update_photo_interest_count(sender, instance, **kwargs):
+    """
+    Keep Photo.like_count and Photo.star_count in step with likes and stars
+
+    :param sender:
+    :param instance: instance of UserInterest that was saved or deleted
+    :param kwargs:
+    :return: None
+    """
+    if kwargs.get("created", True) is False:
+        return
+
+    field = get_generic_counter(instance, INTEREST_COUNTERS, "interest_type")
+
+    if field:
+        update_photo_counter(instance.object_id, field, 1 if "created" in kwargs else -1)
+
+
+@receiver(post_save, sender=utils_models.UserAction)
+@receiver(post_delete, sender=utils_models.UserAction)
+def update_photo_action_count(sender, instance, **kwargs):
+    """
+    Keep the click, flag and impression counters of a photo in step with recorded user actions
+
+    :param sender:
+    :param instance: instance of UserAction that was saved or deleted
+    :param kwargs:
+    :return: None
+    """
+    if kwargs.get("created", True) is False:
+        return
+
+    field = get_generic_counter(instance, ACTION_COUNTERS, "action")
+
+    if field:
+        update_photo_counter(instance.object_id, field, 1 if "created" in kwargs else -1)
@@ -0,0 +1,197 @@
+from apps.photo import models as photo_models
+from django.conf import settings
+from django.db.models import Q
+from itertools import combinations
+import threading
+import time
+
+HASH_BITS = 64
+HASH_MASK = (1 << HASH_BITS) - 1
+
+# Hashes are split into this many chunks. Two hashes at most r bits apart have at least one chunk at most r // CHUNKS
+# bits apart, so a search only has to look up the neighbours of each chunk.
+CHUNKS = 4
+CHUNK_BITS = HASH_BITS // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+FLIP_MASKS = dict()
+
+
+def get_flip_masks(radius):
+    """
+    Return every mask of CHUNK_BITS bits with at most radius bits set
+
+    :param radius: maximum number of bits set
+    :return: list of masks
+    """
+    if radius not in FLIP_MASKS:
+        FLIP_MASKS[radius] = [sum(1 << bit for bit in bits) for count in range(radius + 1)
+                              for bits in combinations(range(CHUNK_BITS), count)]
+
+    return FLIP_MASKS[radius]
+
+
+def hamming_distance(first, second):
+    """
+    Count the bits two perceptual hashes differ in
+
+    :param first: hash as stored on Photo
+    :param second: hash as stored on Photo
+    :return: number of differing bits
+    """
+    return bin((first ^ second) & HASH_MASK).count('1')
+
+
+class HammingIndex(object):
+    """
+    Multi-index hashing of 64 bit hashes: each hash is filed under each of its chunks, so finding the hashes within a
+    Hamming distance probes a few thousand buckets rather than comparing against every hash.
+    """
+
+    def __init__(self):
+        self.buckets = [dict() for _ in range(CHUNKS)]
+        self.values = dict()
+
+    def __len__(self):
+        return len(self.values)
+
+    @staticmethod
+    def get_chunks(value):
+        return [(value >> (chunk * CHUNK_BITS)) & CHUNK_MASK for chunk in range(CHUNKS)]
+
+    def add(self, key, value):
+        """
+        Add or replace the hash of a key
+
+        :param key: id of the hashed object
+        :param value: hash as stored on Photo
+        :return: None
+        """
+        self.remove(key)
+        value &= HASH_MASK
+        self.values[key] = value
+
+        for buckets, chunk in zip(self.buckets, self.get_chunks(value)):
+            buckets.setdefault(chunk, set()).add(key)
+
+    def remove(self, key):
+        """
+        Remove a key if it is in the index
+
+        :param key: id of the hashed object
+        :return: None
+        """
+        value = self.values.pop(key, None)
+
+        if value is None:
+            return
+
+        for buckets, chunk in zip(self.buckets, self.get_chunks(value)):
+            buckets[chunk].discard(key)
+
+            if not buckets[chunk]:
+                del buckets[chunk]
+
+    def search(self, value, radius):
+        """
+        Find the keys whose hashes are at most radius bits from a hash
+
+        :param value: hash as stored on Photo
+        :param radius: maximum Hamming distance
+        :return: list of (distance, key) tuples, nearest first
+        """
+        value &= HASH_MASK
+        masks = get_flip_masks(radius // CHUNKS)
+        candidates = set()
+
+        for buckets, chunk in zip(self.buckets, self.get_chunks(value)):
+            for mask in masks:
+                candidates.update(buckets.get(chunk ^ mask, ()))
+
+        results = [(hamming_distance(value, self.values[key]), key) for key in candidates]
+
+        return sorted(result for result in results if result[0] <= radius)
+
+
+class PhotoSimilarityIndex(object):
+    """
+    Perceptual hashes of every photo held in memory. Each lookup first adds the photos created since the last one,
+    drops the photos given a new image and adds those whose hash was still being computed. The whole index is rebuilt
+    every PHOTO_SIMILARITY_REBUILD_SECONDS to drop deleted photos.
+    """
+
+    def __init__(self):
+        self.index = HammingIndex()
+        self.last_id = 0
+        self.pending = set()
+        self.built_at = None
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Bring the index up to date with the database
+
+        :return: None
+        """
+        if self.built_at is None or time.time() - self.built_at > settings.PHOTO_SIMILARITY_REBUILD_SECONDS:
+            self.index = HammingIndex()
+            self.last_id = 0
+            self.pending = set()
+            self.built_at = time.time()
+
+        # A new image resets the hash and queues the renditions, which may happen in another process
+        changed_photos = photo_models.Photo.objects.filter(
+            Q(id__gt=self.last_id) | Q(id__in=self.pending) | Q(rendition_status__in=('pending', 'processing')))
+
+        for photo_id, perceptual_hash, rendition_status in changed_photos.values_list(
+                'id', 'perceptual_hash', 'rendition_status').iterator():
+            self.last_id = max(self.last_id, photo_id)
+
+            if perceptual_hash is not None:
+                self.index.add(photo_id, perceptual_hash)
+                self.pending.discard(photo_id)
+                continue
+
+            self.index.remove(photo_id)
+
+            if rendition_status in ('pending', 'processing'):
+                self.pending.add(photo_id)
+            else:
+                self.pending.discard(photo_id)
+
+    def update_photo(self, photo_id, perceptual_hash):
+        """
+        Replace the hash of a photo that was saved in this process. Photos given a new image are left out until their
+        new hash has been computed.
+
+        :param photo_id: id of the Photo
+        :param perceptual_hash: hash as stored on Photo, or None
+        :return: None
+        """
+        with self.lock:
+            # Photos the index has not reached yet are read by the next refresh
+            if self.built_at is None or photo_id > self.last_id:
+                return
+
+            if perceptual_hash is None:
+                self.index.remove(photo_id)
+                self.pending.add(photo_id)
+            else:
+                self.index.add(photo_id, perceptual_hash)
+                self.pending.discard(photo_id)
+
+    def search(self, perceptual_hash, distance):
+        """
+        Find the photos whose perceptual hashes are at most distance bits from a hash
+
+        :param perceptual_hash: hash as stored on Photo
+        :param distance: maximum Hamming distance
+        :return: list of (distance, Photo id) tuples, nearest first
+        """
+        with self.lock:
+            self.refresh()
+
+            return self.index.search(perceptual_hash, distance)
+
+
+PHOTO_SIMILARITY_INDEX = PhotoSimilarityIndex()
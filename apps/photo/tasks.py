@@ -0,0 +1,193 @@
+from apps.common import storage as common_storage
+from apps.photo import models as photo_models
+from apps.photo import serializers as photo_serializers
+from apps.photo.photo import get_rendition_storage, ImageTooLarge, Photo, RENDITION_FORMATS
+from apps.photo.similarity import PHOTO_SIMILARITY_INDEX
+from celery import shared_task
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+
+@shared_task(name='generate_photo_renditions')
+def generate_photo_renditions(photo_id, image_name=None, force=False):
+    """
+    Generate the renditions, BlurHash placeholder and perceptual hash of a photo, record the content-hashed names of
+    the renditions in the rendition manifest and mark it ready. Until then serializers fall back to the original image.
+
+    :param photo_id: id of the Photo
+    :param image_name: name of the image the task was queued for. If the photo has since been given a new image, the
+    task queued for that image takes over and this one does nothing.
+    :param force: regenerate renditions that have already been generated, e.g. after their specs changed
+    :return: None
+    """
+    photo = photo_models.Photo.objects.filter(id=photo_id).first()
+
+    if not photo or not photo.image or (image_name and photo.image.name != image_name):
+        return
+
+    photos = photo_models.Photo.objects.filter(id=photo_id, image=photo.image.name)
+
+    # Photos that are already ready keep serving their current renditions while they are regenerated
+    if photo.rendition_status != 'ready':
+        photos.update(rendition_status='processing')
+
+    try:
+        photo.generate_renditions(force=force)
+    except Exception:
+        photos.exclude(rendition_status='ready').update(rendition_status='failed')
+        raise
+
+    if photos.update(blurhash=photo.blurhash, perceptual_hash=photo.perceptual_hash,
+                     rendition_formats=list(RENDITION_FORMATS), rendition_manifest=photo.rendition_manifest,
+                     rendition_status='ready'):
+        PHOTO_SIMILARITY_INDEX.update_photo(photo_id, photo.perceptual_hash)
+
+
+@shared_task(name='refresh_photo_ranks')
+def refresh_photo_ranks():
+    """
+    Recompute the stored rank of every photo from its votes, queued a short while after votes change
+
+    :return: number of entries whose rank changed
+    """
+    cache.delete('photo_rank_refresh_queued')
+
+    return photo_models.PhotoRank.objects.refresh_ranks()
+
+
+@shared_task(name='collect_photo_renditions')
+def collect_photo_renditions(grace_hours=None, dry_run=False, batch_size=500):
+    """
+    Delete rendition files that no photo's manifest refers to any more, left behind when a photo gets a new image or
+    is deleted. Files younger than the grace period are kept, since the task that wrote them may not have recorded
+    them yet.
+
+    :param grace_hours: minimum age of the files to delete, defaults to PHOTO_RENDITION_GC_GRACE_HOURS
+    :param dry_run: only return the files that would be deleted
+    :param batch_size: number of files to look up per query
+    :return: list of the names of the deleted files
+    """
+    if grace_hours is None:
+        grace_hours = settings.PHOTO_RENDITION_GC_GRACE_HOURS
+
+    storage = get_rendition_storage()
+    cutoff = timezone.now() - timedelta(hours=grace_hours)
+    candidates = [name for name, modified in common_storage.list_files(storage, 'renditions') if modified < cutoff]
+    deleted = list()
+
+    for start in range(0, len(candidates), batch_size):
+        batch = candidates[start:start + batch_size]
+
+        # Files are stored as renditions/<field name>/<hash>.<ext>, which lets the lookup use the manifest's index
+        query = Q()
+
+        for name in batch:
+            query |= Q(rendition_manifest__contains={name.split('/')[1]: name})
+
+        referenced = {value for manifest in photo_models.Photo.objects.filter(query)
+                      .values_list('rendition_manifest', flat=True) for value in manifest.values()}
+
+        for name in batch:
+            if name not in referenced:
+                if not dry_run:
+                    storage.delete(name)
+
+                deleted.append(name)
+
+    return deleted
+
+
+def create_uploaded_photo(upload):
+    """
+    Download a direct upload's original, compress it and create its Photo the same way PhotoViewSet.post does
+
+    :param upload: PhotoUpload instance
+    :return: the new Photo
+    """
+    payload = dict(upload.metadata)
+    payload['original_image_url'] = upload.original_image_url
+    payload['user'] = upload.user_id
+    tags = payload.pop('tags', None) or []
+
+    # Multipart finalize requests store tags as a space separated string, JSON ones can store a list
+    if isinstance(tags, str):
+        tags = tags.split()
+
+    with TemporaryUploadedFile(upload.original_name, 'application/octet-stream', 0, None) as original:
+        common_storage.download(settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'], upload.original_name, original.file)
+        original.size = original.file.tell()
+        original.seek(0)
+
+        with Photo(original) as photo:
+            original_hash = photo.get_hash()
+            duplicate = photo_models.Photo.objects.get_duplicate(original_hash)
+
+            if duplicate and settings.PHOTO_REJECT_DUPLICATE_UPLOADS and photo_models.Photo.objects.filter(
+                    original_hash=original_hash, user=upload.user_id).exists():
+                raise ValidationError('This photo has already been uploaded')
+
+            if duplicate:
+                # Reuse the compressed image and renditions of the earlier upload, the original is only validated
+                payload['image'] = original
+                image_metadata = duplicate.get_shared_image_fields()
+            else:
+                payload['image'] = photo.compress()
+                image_metadata = {
+                    'image_format': 'JPEG',
+                    'image_height': photo.pillow_image.size[1],
+                    'image_size': payload['image'].size,
+                    'image_width': photo.pillow_image.size[0]
+                }
+
+            image_metadata['original_hash'] = original_hash
+        serializer = photo_serializers.PhotoSerializer(data=payload)
+
+        # Validation reads the upload, so it happens while the downloaded original is still open
+        if not serializer.is_valid():
+            raise ValidationError(serializer.errors)
+
+    with transaction.atomic():
+        new_photo = serializer.save(**image_metadata)
+
+        if tags:
+            new_photo.tag.add(*[
+                photo_models.PhotoClassification.objects.create_or_update(name=tag.replace("#", ""),
+                                                                         classification_type="tag").id
+                for tag in tags])
+
+        photo_models.PhotoUpload.objects.filter(id=upload.id).update(photo=new_photo, status='done')
+
+    return new_photo
+
+
+@shared_task(name='process_photo_upload')
+def process_photo_upload(upload_id):
+    """
+    Turn a finalized direct upload into a Photo. Decoding, colour conversion and compression happen here instead of in
+    the API worker; renditions are queued as usual once the photo is saved.
+
+    :param upload_id: id of the PhotoUpload
+    :return: None
+    """
+    upload = photo_models.PhotoUpload.objects.filter(id=upload_id, status='processing').first()
+
+    if not upload:
+        return
+
+    try:
+        create_uploaded_photo(upload)
+    except ValidationError as e:
+        # Bad metadata will not get any better by retrying
+        photo_models.PhotoUpload.objects.filter(id=upload_id).update(status='failed', error=str(e.detail)[:255])
+    except ImageTooLarge as e:
+        # Neither will an image that is too large to decode
+        photo_models.PhotoUpload.objects.filter(id=upload_id).update(status='failed', error=str(e)[:255])
+    except Exception as e:
+        photo_models.PhotoUpload.objects.filter(id=upload_id).update(status='failed', error=str(e)[:255])
+        raise
@@ -1,10 +1,16 @@
-from apps.photo.photo import Photo, BlurResize, WidthResize
+from apps.photo import photo as photo_module
+from apps.photo.photo import (Photo, BlurResize, convert_to_srgb, encode_jpeg, get_decode_scale, get_perceptual_hash,
+                              get_ssim, get_ssim_sample, ImageTooLarge, PixelBudget, read_image_header,
+                              reduce_for_width, WidthResize)
+from apps.photo.similarity import hamming_distance
 from django.conf import settings
 from django.core.files.uploadedfile import InMemoryUploadedFile
 from django.test import override_settings, TestCase
 from os.path import getsize
-from PIL import Image, ImageCms
+from PIL import Image, ImageCms, ImageFilter
+from unittest import mock
 import io
+import threading
 
 
 class TestPhoto(TestCase):
@@ -45,6 +51,18 @@ class TestPhoto(TestCase):
         self.assertIsInstance(image, InMemoryUploadedFile)
         self.assertEquals(pil_image.size[0], 2048)
 
+    def test_photo_compress_size(self):
+        """
+        Test that the compressed image reports its size in bytes and is positioned at its start
+
+        :return: None
+        """
+        photo = Photo(open('apps/common/test/data/photos/cover.jpg', 'rb'))
+        image = photo.compress()
+
+        self.assertIsInstance(image.size, int)
+        self.assertEquals(image.size, len(image.read()))
+
     @override_settings(REMOTE_IMAGE_STORAGE=False,
                        DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
     def test_photo_save_compressed_local(self):
@@ -62,6 +80,36 @@ class TestPhoto(TestCase):
 
         self.assertLess(getsize(file), getsize('{}/{}'.format(settings.MEDIA_ROOT, saved)))
 
+    @override_settings(REMOTE_IMAGE_STORAGE=False,
+                       DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+    def test_photo_save_original_local(self):
+        """
+        Test that originals are stored byte-for-byte while the compressed copy is encoded
+
+        :return: None
+        """
+        file = 'apps/common/test/data/photos/cover.jpg'
+
+        photo = Photo(open(file, 'rb'))
+        original = photo.save_original_async('original.jpg')
+        compressed = photo.compress()
+
+        with open(file, 'rb') as f, open(original.result(), 'rb') as saved:
+            self.assertEquals(f.read(), saved.read())
+
+        self.assertEquals(Image.open(compressed).size[0], 2048)
+
+    def test_photo_save_original_bad_extension(self):
+        """
+        Test that originals with unsupported extensions are rejected before anything is uploaded
+
+        :return: None
+        """
+        photo = Photo(open('apps/common/test/data/photos/cover.jpg', 'rb'))
+
+        with self.assertRaises(TypeError):
+            photo.save_original_async('original.gif')
+
     def test_photo_save_remote_custom_bucket(self):
         """
         Test that we can save to custom remote bucket
@@ -76,6 +124,243 @@ class TestPhoto(TestCase):
         self.assertIsNotNone(saved)
 
 
+class TestJpegEncoding(TestCase):
+    @override_settings(PHOTO_JPEG_SAVINGS_SAMPLE_RATE=1)
+    def test_photo_compress_progressive(self):
+        """
+        Test that uploads are encoded as progressive JPEGs and report the bytes saved by the encoder settings
+
+        :return: None
+        """
+        compressed = Photo(open('apps/common/test/data/photos/cover.jpg', 'rb')).compress()
+
+        self.assertTrue(Image.open(compressed).info.get('progressive'))
+        self.assertEquals(compressed.compress_stats['quality'], 80)
+        self.assertGreater(compressed.compress_stats['bytes_saved'], 0)
+
+    @override_settings(PHOTO_JPEG_SAVINGS_SAMPLE_RATE=1)
+    def test_photo_compress_savings_transparent(self):
+        """
+        Test that the savings of transparent images are measured on the same flattened image that is stored
+
+        :return: None
+        """
+        content = io.BytesIO()
+        Image.new('RGBA', (64, 48), (255, 0, 0, 128)).save(content, format='PNG')
+        size = content.tell()
+        content.seek(0)
+
+        compressed = Photo(InMemoryUploadedFile(content, None, 'photo.png', 'image/png', size, None)).compress()
+
+        self.assertEquals(Image.open(compressed).mode, 'RGB')
+        self.assertEquals(compressed.compress_stats['quality'], 80)
+        self.assertIsNotNone(compressed.compress_stats['bytes_saved'])
+
+    @override_settings(PHOTO_JPEG_SAVINGS_SAMPLE_RATE=0)
+    def test_photo_compress_savings_not_sampled(self):
+        """
+        Test that uploads outside the sample are encoded once and report no savings
+
+        :return: None
+        """
+        compressed = Photo(open('apps/common/test/data/photos/cover.jpg', 'rb')).compress()
+
+        self.assertEquals(compressed.compress_stats, {'bytes_saved': None, 'quality': 80})
+
+    @override_settings(PHOTO_JPEG_MIN_QUALITY=40)
+    def test_encode_jpeg_quality_search(self):
+        """
+        Test that the quality search picks a lower quality whose result still meets the target similarity
+
+        :return: None
+        """
+        image = Image.open('apps/common/test/data/photos/cover.jpg')
+        image.load()
+        fixed, fixed_quality = encode_jpeg(image, 90)
+        searched, quality = encode_jpeg(image, 90, target_ssim=0.98)
+
+        self.assertEquals(fixed_quality, 90)
+        self.assertTrue(40 <= quality < 90)
+        self.assertLess(len(searched.getvalue()), len(fixed.getvalue()))
+        self.assertGreaterEqual(get_ssim(get_ssim_sample(image), get_ssim_sample(Image.open(searched))), 0.98)
+
+    def test_get_ssim(self):
+        """
+        Test that identical images have an SSIM of 1 and that blurring lowers it
+
+        :return: None
+        """
+        image = Image.open('apps/common/test/data/photos/photo1-min.jpg')
+        sample = get_ssim_sample(image)
+
+        self.assertAlmostEqual(get_ssim(sample, sample), 1.0)
+        self.assertLess(get_ssim(sample, get_ssim_sample(image.filter(ImageFilter.GaussianBlur(radius=3)))), 0.9)
+
+
+class TestPerceptualHash(TestCase):
+    def test_get_perceptual_hash(self):
+        """
+        Test that resized and cropped copies of a photo get hashes a few bits from the original and other photos do not
+
+        :return: None
+        """
+        image = Image.open('apps/common/test/data/photos/cover.jpg')
+        image.load()
+        perceptual_hash = get_perceptual_hash(Image.open('apps/common/test/data/photos/cover.jpg'))
+        resized = get_perceptual_hash(image.resize((image.size[0] // 3, image.size[1] // 3)))
+        cropped = get_perceptual_hash(image.crop((50, 30, image.size[0] - 50, image.size[1] - 30)))
+        other = get_perceptual_hash(Image.open('apps/common/test/data/photos/photo1-min.jpg'))
+
+        self.assertTrue(-2 ** 63 <= perceptual_hash < 2 ** 63)
+        self.assertLessEqual(hamming_distance(perceptual_hash, resized), 4)
+        self.assertLessEqual(hamming_distance(perceptual_hash, cropped), 6)
+        self.assertGreater(hamming_distance(perceptual_hash, other), 12)
+
+
+class TestDecodeLimits(TestCase):
+    @override_settings(PHOTO_DECODE_MAX_PIXELS=1000000, PHOTO_MAX_PIXELS=40000000)
+    def test_get_decode_scale(self):
+        """
+        Test that large JPEGs are decoded at a reduced scale while other formats and oversized images are refused
+
+        :return: None
+        """
+        self.assertEquals(get_decode_scale(1000, 1000, 'PNG'), 1)
+        self.assertEquals(get_decode_scale(3125, 2448, 'JPEG'), 4)
+
+        with self.assertRaises(ImageTooLarge):
+            get_decode_scale(2000, 2000, 'PNG')
+
+        with self.assertRaises(ImageTooLarge):
+            get_decode_scale(8000, 6000, 'JPEG')
+
+    @override_settings(PHOTO_DECODE_MAX_PIXELS=1000000)
+    def test_photo_decode_reduced(self):
+        """
+        Test that a JPEG over the decode limit is decoded at a reduced scale
+
+        :return: None
+        """
+        photo = Photo(open('apps/common/test/data/photos/1mb.jpg', 'rb'))
+        photo.pillow_image.load()
+
+        self.assertEquals(photo.pillow_image.size, (782, 612))
+
+    @override_settings(PHOTO_DECODE_MAX_PIXELS=1000)
+    def test_photo_decode_too_large(self):
+        """
+        Test that images over the decode limit are refused before they are decoded
+
+        :return: None
+        """
+        with mock.patch('apps.photo.photo.PillowImage.open') as pillow_open:
+            with self.assertRaises(ImageTooLarge):
+                Photo(open('apps/common/test/data/photos/avatar.png', 'rb'))
+
+        pillow_open.assert_not_called()
+
+    def test_photo_not_image(self):
+        """
+        Test that files without an image header are refused
+
+        :return: None
+        """
+        with self.assertRaises(TypeError):
+            Photo(InMemoryUploadedFile(io.BytesIO(b'not an image'), None, 'photo.jpg', 'image/jpeg', 12, None))
+
+    def test_pixel_budget_waits(self):
+        """
+        Test that a decode waits until enough of the budget has been released
+
+        :return: None
+        """
+        budget = PixelBudget(10)
+        reserved = threading.Event()
+
+        def reserve():
+            with budget.reserve(8):
+                reserved.set()
+
+        with budget.reserve(6):
+            thread = threading.Thread(target=reserve)
+            thread.start()
+
+            self.assertFalse(reserved.wait(0.1))
+
+        thread.join()
+
+        self.assertTrue(reserved.is_set())
+        self.assertEquals(budget.available, 10)
+
+    def test_photo_holds_decode_budget(self):
+        """
+        Test that a Photo only takes decode budget once it is decoded and holds it until it is closed
+
+        :return: None
+        """
+        budget = PixelBudget(10000000)
+
+        with mock.patch('apps.photo.photo.DECODE_BUDGET', budget):
+            with Photo(open('apps/common/test/data/photos/photo1-min.jpg', 'rb')) as photo:
+                self.assertEquals(budget.available, 10000000)
+
+                photo.compress()
+
+                self.assertEquals(budget.available, 10000000 - 750 * 749)
+
+        self.assertEquals(budget.available, 10000000)
+
+
+class TestReadImageHeader(TestCase):
+    def test_read_image_header_jpeg(self):
+        """
+        Test that we can read the size and format of a JPEG from its header
+
+        :return: None
+        """
+        with open('apps/common/test/data/photos/photo1-min.jpg', 'rb') as f:
+            self.assertEquals(read_image_header(f, chunk_size=1024), (750, 749, 'JPEG'))
+            self.assertEquals(f.tell(), 0)
+
+    def test_read_image_header_png(self):
+        """
+        Test that we can read the size and format of a PNG from its header
+
+        :return: None
+        """
+        with open('apps/common/test/data/photos/avatar.png', 'rb') as f:
+            width, height, image_format = read_image_header(f)
+
+        self.assertEquals((width, height), Image.open('apps/common/test/data/photos/avatar.png').size)
+        self.assertEquals(image_format, 'PNG')
+
+    def test_read_image_header_unsupported_format(self):
+        """
+        Test that images in formats other than JPEG and PNG are refused from their header, whatever their name
+
+        :return: None
+        """
+        content = io.BytesIO()
+        Image.new('RGB', (4000, 3000)).save(content, 'BMP')
+        size = content.tell()
+        content.seek(0)
+
+        self.assertIsNone(read_image_header(content))
+
+        with mock.patch('apps.photo.photo.PillowImage.Image.load') as load, self.assertRaises(TypeError):
+            Photo(InMemoryUploadedFile(content, None, 'photo.jpg', 'image/jpeg', size, None))
+
+        load.assert_not_called()
+
+    def test_read_image_header_not_image(self):
+        """
+        Test that we get None for data that is not an image
+
+        :return: None
+        """
+        self.assertIsNone(read_image_header(io.BytesIO(b'not an image')))
+
+
 class TestBlurResize(TestCase):
     """
     Test that we can resize and blur an image
@@ -156,3 +441,77 @@ class TestWidthResize(TestCase):
 
         self.assertEquals(new_img.size[0], 2048)
         self.assertEquals(new_img.size[1], 2045)
+
+
+class TestReduceForWidth(TestCase):
+    def test_reduce_for_width_jpeg_draft(self):
+        """
+        Test that a JPEG is decoded at a reduced scale that is still at least twice the target width
+
+        :return: None
+        """
+        img = Image.open('apps/common/test/data/photos/1mb.jpg')
+
+        reduced = reduce_for_width(img, 246)
+        reduced.load()
+
+        self.assertEquals(reduced.size, (782, 612))
+
+    def test_reduce_for_width_small_target_gap(self):
+        """
+        Test that images are left alone when reducing would leave too few pixels for the final resize
+
+        :return: None
+        """
+        img = Image.open('apps/common/test/data/photos/1mb.jpg')
+
+        self.assertEquals(reduce_for_width(img, 1242).size, (3125, 2448))
+
+    def test_reduce_for_width_resize_dimensions(self):
+        """
+        Test that resizing through a reduced decode gives the same dimensions as resizing the full image
+
+        :return: None
+        """
+        full = Image.open('apps/common/test/data/photos/1mb.jpg')
+        full.load()
+
+        self.assertEquals(WidthResize(246).process(Image.open('apps/common/test/data/photos/1mb.jpg')).size,
+                          WidthResize(246).process(full).size)
+
+
+class TestConvertToSrgb(TestCase):
+    def setUp(self):
+        photo_module.ICC_TRANSFORMS.clear()
+
+    def test_convert_to_srgb_not_needed(self):
+        """
+        Test that images without an Adobe RGB or ProPhoto RGB profile are left untouched
+
+        :return: None
+        """
+        img = Image.open('apps/common/test/data/photos/rpgwisdom.jpg')
+        icc_profile = img.info['icc_profile']
+
+        self.assertIs(convert_to_srgb(img), img)
+        self.assertEquals(img.info['icc_profile'], icc_profile)
+        self.assertIsNone(convert_to_srgb(Image.open('apps/common/test/data/photos/photo1-min.jpg')).info
+                          .get('icc_profile'))
+
+    def test_convert_to_srgb_cached_transform(self):
+        """
+        Test that conversion happens in place and the transform is built once per profile
+
+        :return: None
+        """
+        with mock.patch('apps.photo.photo.ImageCms.getProfileName', return_value='Adobe RGB (1998)'), \
+                mock.patch('apps.photo.photo.ImageCms.buildTransform',
+                           wraps=ImageCms.buildTransform) as build_transform:
+            first = Image.open('apps/common/test/data/photos/rpgwisdom.jpg')
+            second = Image.open('apps/common/test/data/photos/rpgwisdom.jpg')
+
+            self.assertIs(convert_to_srgb(first), first)
+            self.assertIs(convert_to_srgb(second), second)
+
+        self.assertEquals(build_transform.call_count, 1)
+        self.assertEquals(first.info['icc_profile'], photo_module.SRGB_PROFILE.tobytes())
@@ -0,0 +1,127 @@
+from apps.account import models as account_models
+from apps.common.test import helpers as test_helpers
+from apps.photo import models as photo_models
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings, TestCase
+from rest_framework.test import APIClient
+import json
+
+
+@override_settings(REMOTE_IMAGE_STORAGE=False,
+                   DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+class TestPhotoBatchViewSetPOST(TestCase):
+    """
+    Test POST api/photos/batch
+    """
+    def setUp(self):
+        self.user = account_models.User.objects.create_user(email='mrtest@mypapaya.io', password='WhoAmI',
+                                                            username='aov1')
+        self.category = photo_models.PhotoClassification.objects.create_or_update(name='Landscape',
+                                                                                  classification_type='category')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(self.user))
+
+    def tearDown(self):
+        test_helpers.clear_directory('backend/media/', '*.jpg')
+
+    def test_photo_batch_view_set_post_successful(self):
+        """
+        Test that a batch is saved with its shared and per image fields, tags and gallery
+
+        :return: None
+        """
+        gallery = photo_models.Gallery.objects.create(name='Trip', user=self.user)
+
+        with open('apps/common/test/data/photos/photo1-min.jpg', 'rb') as first, \
+                open('apps/common/test/data/photos/photo2-min.jpg', 'rb') as second:
+            request = self.client.post('/api/photos/batch', data={
+                'category': self.category.id,
+                'gallery': gallery.id,
+                'images': [first, second],
+                'metadata': json.dumps([{'caption': 'First', 'tags': '#sunset #beach'}, {'tags': 'Sunset'}]),
+            }, format='multipart')
+
+        results = request.data['results']
+        photos = photo_models.Photo.objects.order_by('id')
+
+        self.assertEquals(request.status_code, 200)
+        self.assertEquals([result['photo']['id'] for result in results], [photo.id for photo in photos])
+        self.assertEquals(results[0]['photo']['caption'], 'First')
+        self.assertEquals(results[0]['photo']['category'], [self.category.id])
+        self.assertNotEquals(photos[0].image.name, photos[1].image.name)
+        self.assertNotEquals(photos[0].original_image_url, photos[1].original_image_url)
+        self.assertEquals(photos[0].image_quality, 80)
+        self.assertEquals(len(photos[1].original_hash), 64)
+
+        # Each tag is created once and linked to every photo that has it
+        sunset = photo_models.PhotoClassification.objects.get(name__iexact='sunset', classification_type='tag')
+
+        self.assertEquals(set(sunset.tag.values_list('id', flat=True)), {photos[0].id, photos[1].id})
+        self.assertEquals(photos[0].tag.count(), 2)
+        self.assertEquals(photos[1].tag.count(), 1)
+        self.assertEquals(photo_models.PhotoRank.objects.filter(classification=self.category).count(), 2)
+        self.assertEquals(set(gallery.photos.values_list('id', flat=True)), {photos[0].id, photos[1].id})
+
+    def test_photo_batch_view_set_post_partial_failure(self):
+        """
+        Test that an image that cannot be processed fails on its own
+
+        :return: None
+        """
+        with open('apps/common/test/data/__init__.py', 'rb') as first, \
+                open('apps/common/test/data/photos/photo1-min.jpg', 'rb') as second:
+            request = self.client.post('/api/photos/batch', data={
+                'category': self.category.id,
+                'images': [first, second],
+            }, format='multipart')
+
+        results = request.data['results']
+
+        self.assertEquals(request.status_code, 200)
+        self.assertEquals(results[0]['errors'], ['Image is not of type image'])
+        self.assertNotIn('photo', results[0])
+        self.assertEquals(results[1]['photo']['id'], photo_models.Photo.objects.get().id)
+
+    def test_photo_batch_view_set_post_truncated_image(self):
+        """
+        Test that an image that is cut off after its header fails on its own
+
+        :return: None
+        """
+        with open('apps/common/test/data/photos/photo2-min.jpg', 'rb') as f:
+            content = f.read()
+
+        truncated = SimpleUploadedFile('truncated.jpg', content[:len(content) // 2], content_type='image/jpeg')
+
+        with open('apps/common/test/data/photos/photo1-min.jpg', 'rb') as second:
+            request = self.client.post('/api/photos/batch', data={
+                'category': self.category.id,
+                'images': [truncated, second],
+            }, format='multipart')
+
+        results = request.data['results']
+
+        self.assertEquals(request.status_code, 200)
+        self.assertEquals(results[0]['errors'], ['Image could not be processed'])
+        self.assertEquals(results[1]['photo']['id'], photo_models.Photo.objects.get().id)
+
+    @override_settings(PHOTO_BATCH_UPLOAD_MAX_IMAGES=1)
+    def test_photo_batch_view_set_post_bad_request(self):
+        """
+        Test that batches with too many images, malformed metadata or another user's gallery are refused
+
+        :return: None
+        """
+        other_user = account_models.User.objects.create_user(email='mr@mypapaya.io', password='WhoAmI',
+                                                             username='aov2')
+        gallery = photo_models.Gallery.objects.create(name='Trip', user=other_user)
+        statuses = list()
+
+        for count, data in ((2, {}), (1, {'metadata': '{"caption": "First"}'}), (1, {'gallery': gallery.id})):
+            with open('apps/common/test/data/photos/photo1-min.jpg', 'rb') as first, \
+                    open('apps/common/test/data/photos/photo2-min.jpg', 'rb') as second:
+                payload = dict(data, category=self.category.id, images=[first, second][:count])
+                statuses.append(self.client.post('/api/photos/batch', data=payload, format='multipart').status_code)
+
+        self.assertEquals(statuses, [400, 400, 400])
+        self.assertEquals(photo_models.Photo.objects.count(), 0)
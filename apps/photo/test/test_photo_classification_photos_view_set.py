@@ -2,7 +2,9 @@ from apps.account import models as account_models
 from apps.common.test import helpers as test_helpers
 from apps.photo import models as photo_models
 from apps.photo.photo import Photo
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient
 
 
@@ -184,6 +186,42 @@ class TestPhotoClassificationPhotosViewSetGET(TestCase):
         self.assertEquals(len(results), 2)
         self.assertEqual(results[0]["id"], photo1.id)
 
+    def test_photo_classification_photos_view_set_get_votes_behind(self):
+        """
+        Test that votes_behind is computed from the category vote ceiling without a query per photo
+
+        :return: None
+        """
+        user = account_models.User.objects.create_user(email='mrtest@mypapaya.io', password='WhoAmI', username='aov1')
+
+        classification = photo_models.PhotoClassification.objects \
+            .create_or_update(name='night', classification_type='category')
+
+        for votes in [4, 2, 1]:
+            photo = photo_models \
+                .Photo(image=Photo(open('apps/common/test/data/photos/photo1-min.jpg', 'rb')), user=user)
+            photo.save()
+            photo.category.add(classification)
+            photo.votes = votes
+            photo.save()
+
+        # Simulate auth
+        token = test_helpers.get_token_for_user(user)
+
+        # Get data from endpoint
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+        with CaptureQueriesContext(connection) as queries:
+            request = client.get(
+                '/api/photo_classifications/{}/photos?classification=category'.format(classification.id))
+
+        results = request.data['results']
+        ceiling_queries = [q for q in queries.captured_queries if '"photo_photorank"."rank" = 1' in q['sql']]
+
+        self.assertEquals([result['votes_behind']['night'] for result in results], [0, 2, 3])
+        self.assertEquals(len(ceiling_queries), 1)
+
     def test_photo_classification_photos_view_set_get_public(self):
         """
         Test that we get public photos for a classification
@@ -0,0 +1,91 @@
+from apps.account import models as account_models
+from apps.photo import models as photo_models
+from apps.photo.photo import Photo
+from apps.utils import models as utils_models
+from django.test import TestCase
+
+
+class TestPhotoCounters(TestCase):
+    """
+    Test that denormalized interaction counters on Photo follow comments, interests and actions
+    """
+    def setUp(self):
+        """
+            Create a photo and a user to interact with it
+
+        :return: None
+        """
+        self.user = account_models.User.objects.create_user(email='mrtest@mypapaya.io', password='WhoAmI',
+                                                            username='aov1')
+        self.photo = photo_models.Photo(image=Photo(open('apps/common/test/data/photos/photo1-min.jpg', 'rb')),
+                                        user=self.user)
+        self.photo.save()
+
+    def get_photo(self):
+        return photo_models.Photo.objects.get(id=self.photo.id)
+
+    def test_photo_counters_follow_interactions(self):
+        """
+        Test that counters go up and down as records are created and deleted
+
+        :return: None
+        """
+        comment = photo_models.PhotoComment.objects.create_or_update(photo=self.photo, user=self.user,
+                                                                     comment='Nice')
+        star = account_models.UserInterest.objects.create(content_object=self.photo, user=self.user,
+                                                          interest_type='star')
+        account_models.UserInterest.objects.create(content_object=self.photo, user=self.user, interest_type='like')
+        utils_models.UserAction.objects.create(content_object=self.photo, user=self.user, action='photo_click')
+        utils_models.UserAction.objects.create(content_object=self.photo, user=self.user, action='photo_click')
+        utils_models.UserAction.objects.create(content_object=self.photo, user=self.user, action='photo_imp')
+        account_models.UserInterest.objects.create(content_object=self.user, user=self.user, interest_type='star')
+
+        photo = self.get_photo()
+
+        self.assertEquals(photo.comment_count, 1)
+        self.assertEquals(photo.star_count, 1)
+        self.assertEquals(photo.like_count, 1)
+        self.assertEquals(photo.click_count, 2)
+        self.assertEquals(photo.impression_count, 1)
+        self.assertEquals(photo.flag_count, 0)
+
+        comment.save()
+        comment.delete()
+        star.delete()
+
+        photo = self.get_photo()
+
+        self.assertEquals(photo.comment_count, 0)
+        self.assertEquals(photo.star_count, 0)
+        self.assertEquals(photo_models.Photo.objects.check_counters(), {})
+
+    def test_photo_counters_survive_stale_save(self):
+        """
+        Test that saving a photo loaded before an interaction does not overwrite its counters
+
+        :return: None
+        """
+        utils_models.UserAction.objects.create(content_object=self.photo, user=self.user, action='photo_flag')
+
+        self.photo.votes = 3
+        self.photo.save()
+
+        photo = self.get_photo()
+
+        self.assertEquals(photo.flag_count, 1)
+        self.assertEquals(photo.votes, 3)
+
+    def test_photo_counters_reconcile(self):
+        """
+        Test that drifted counters are reported and corrected
+
+        :return: None
+        """
+        utils_models.UserAction.objects.create(content_object=self.photo, user=self.user, action='photo_click')
+        photo_models.Photo.objects.filter(id=self.photo.id).update(click_count=9, like_count=2)
+
+        drift = photo_models.Photo.objects.reconcile_counters()
+
+        self.assertEquals(drift, {self.photo.id: {'click_count': 1, 'like_count': 0}})
+        self.assertEquals(self.get_photo().click_count, 1)
+        self.assertEquals(photo_models.Photo.objects.check_counters(), {})
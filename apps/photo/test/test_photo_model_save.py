@@ -48,6 +48,30 @@ class TestPhotoSave(TestCase):
         self.assertEqual(len(updated_photo.photo_feed.all()), 1)
         self.assertIsNotNone(updated_photo.aov_feed_add_date)
 
+    def test_photo_save_image_metadata(self):
+        """
+        Test that width, height, byte size and format are stored when a new image is saved
+
+        :return: None
+        """
+        user = account_models.User.objects.create_user(email='mrtest@mypapaya.io', password='WhoAmI', username='aov1')
+
+        photo1 = photo_models.Photo(image=Photo(open('apps/common/test/data/photos/photo1-min.jpg', 'rb')), user=user)
+        photo1.save()
+
+        saved_photo = photo_models.Photo.objects.get(id=photo1.id)
+
+        self.assertEqual(saved_photo.image_width, 750)
+        self.assertEqual(saved_photo.image_height, 749)
+        self.assertEqual(saved_photo.image_format, 'JPEG')
+        self.assertEqual(saved_photo.image_size, saved_photo.image.size)
+        self.assertEqual(saved_photo.get_dimensions(), {'width': 750, 'height': 749})
+
+        # Rows that have not been backfilled report no dimensions rather than reading the image from storage
+        photo_models.Photo.objects.filter(id=photo1.id).update(image_width=None, image_height=None)
+
+        self.assertEqual(photo_models.Photo.objects.get(id=photo1.id).get_dimensions(), {'width': None, 'height': None})
+
     def test_photo_save_aov_date_unchanged_upon_future_save(self):
         """
             Unit test to validate that aov_feed_add_date doesn't change once set.
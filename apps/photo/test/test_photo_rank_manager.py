@@ -0,0 +1,142 @@
+from apps.account import models as account_models
+from apps.photo import models as photo_models
+from apps.photo.photo import Photo
+from django.test import TestCase
+from unittest import mock
+
+
+class TestPhotoRankManager(TestCase):
+    """
+    Test that photo ranks follow votes and category membership
+    """
+    def setUp(self):
+        """
+            Create a category with a few photos
+
+        :return: None
+        """
+        self.user = account_models.User.objects.create_user(email='mrtest@mypapaya.io', password='WhoAmI',
+                                                            username='aov1')
+        self.category = photo_models.PhotoClassification.objects.create_or_update(name='Night',
+                                                                                  classification_type='category')
+        self.photos = list()
+
+        for votes in [5, 3, 1]:
+            photo = photo_models.Photo(image=Photo(open('apps/common/test/data/photos/photo1-min.jpg', 'rb')),
+                                       user=self.user)
+            photo.save()
+            photo.category.add(self.category)
+            photo.votes = votes
+            photo.save()
+            self.photos.append(photo)
+
+        photo_models.PhotoRank.objects.refresh_ranks()
+
+    def get_rank(self, photo, classification=None):
+        # Stands in for the refresh queued after votes change
+        photo_models.PhotoRank.objects.refresh_ranks()
+
+        return photo_models.PhotoRank.objects.get_scope(classification.id if classification else None)\
+            .get(photo=photo).rank
+
+    def test_photo_rank_follows_votes(self):
+        """
+        Test that ranks change when a photo overtakes others
+
+        :return: None
+        """
+        self.assertEquals(self.get_rank(self.photos[0], self.category), 1)
+        self.assertEquals(self.get_rank(self.photos[2], self.category), 3)
+
+        self.photos[2].votes = 10
+        self.photos[2].save()
+
+        self.assertEquals(self.get_rank(self.photos[2]), 1)
+        self.assertEquals(self.get_rank(self.photos[2], self.category), 1)
+        self.assertEquals(self.get_rank(self.photos[0], self.category), 2)
+        self.assertEquals(self.get_rank(self.photos[1], self.category), 3)
+        self.assertEquals(photo_models.PhotoRank.objects.check_drift(), {"missing": [], "stale": [], "extra": []})
+
+    def test_photo_rank_stored_until_refresh(self):
+        """
+        Test that a vote only changes the votes of its photo and that the ranks follow at the next refresh, which is
+        queued once
+
+        :return: None
+        """
+        with mock.patch('apps.photo.signals.transaction.on_commit') as on_commit:
+            self.photos[2].votes = 10
+            self.photos[2].save()
+
+        on_commit.assert_called_once()
+        self.assertEquals(photo_models.PhotoRank.objects.get_scope(self.category.id).get(photo=self.photos[0]).rank, 1)
+        self.assertEquals(photo_models.PhotoRank.objects.get_scope(self.category.id).get(photo=self.photos[2]).rank, 3)
+        self.assertEquals(photo_models.PhotoRank.objects.refresh_ranks(), 6)
+        self.assertEquals(photo_models.PhotoRank.objects.get_scope(self.category.id).get(photo=self.photos[2]).rank, 1)
+
+    def test_photo_rank_ties(self):
+        """
+        Test that photos with the same number of votes share a rank and the next photo skips past them
+
+        :return: None
+        """
+        self.photos[1].votes = 5
+        self.photos[1].save()
+
+        self.assertEquals(self.get_rank(self.photos[0], self.category), 1)
+        self.assertEquals(self.get_rank(self.photos[1], self.category), 1)
+        self.assertEquals(self.get_rank(self.photos[2], self.category), 3)
+
+    def test_photo_rank_category_membership(self):
+        """
+        Test that leaving a category or being deleted moves the photos below up
+
+        :return: None
+        """
+        self.photos[0].category.remove(self.category)
+
+        self.assertFalse(photo_models.PhotoRank.objects.filter(photo=self.photos[0],
+                                                               classification=self.category).exists())
+        self.assertEquals(self.get_rank(self.photos[1], self.category), 1)
+
+        self.photos[1].delete()
+
+        self.assertEquals(self.get_rank(self.photos[2], self.category), 1)
+        self.assertEquals(self.get_rank(self.photos[2]), 2)
+        self.assertEquals(photo_models.PhotoRank.objects.check_drift(), {"missing": [], "stale": [], "extra": []})
+
+    def test_photo_rank_rebuild(self):
+        """
+        Test that drift is reported and fixed by a rebuild
+
+        :return: None
+        """
+        photo_models.PhotoRank.objects.filter(photo=self.photos[0], classification__isnull=True).update(rank=7)
+        photo_models.PhotoRank.objects.filter(photo=self.photos[1], classification=self.category).delete()
+
+        drift = photo_models.PhotoRank.objects.check_drift()
+
+        self.assertEquals(drift["stale"], [(self.photos[0].id, None)])
+        self.assertEquals(drift["missing"], [(self.photos[1].id, self.category.id)])
+
+        photo_models.PhotoRank.objects.rebuild()
+
+        self.assertEquals(photo_models.PhotoRank.objects.check_drift(), {"missing": [], "stale": [], "extra": []})
+        self.assertEquals(self.get_rank(self.photos[0]), 1)
+
+    def test_photo_rank_max_votes(self):
+        """
+        Test that the vote ceiling of a category follows its top photo
+
+        :return: None
+        """
+        self.assertEquals(photo_models.PhotoRank.objects.get_max_votes([self.category.id]), {self.category.id: 5})
+
+        self.photos[1].votes = 8
+        self.photos[1].save()
+
+        self.assertEquals(photo_models.PhotoRank.objects.get_max_votes([self.category.id]), {self.category.id: 8})
+
+        self.photos[1].category.remove(self.category)
+
+        self.assertEquals(photo_models.PhotoRank.objects.get_max_votes([self.category.id]), {self.category.id: 5})
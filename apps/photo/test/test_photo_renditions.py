@@ -0,0 +1,276 @@
+from apps.account import models as account_models
+from apps.common.test import helpers as test_helpers
+from apps.photo import models as photo_models
+from apps.photo import tasks as photo_tasks
+from apps.photo.photo import get_blurhash, get_rendition_storage, Photo, RENDITION_FORMATS
+from datetime import timedelta
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image as PillowImage
+from rest_framework.test import APIClient
+from unittest import mock
+
+
+@override_settings(REMOTE_IMAGE_STORAGE=False,
+                   DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+class TestPhotoRenditions(TestCase):
+    """
+    Test that renditions are generated in the background and only when the image changes
+    """
+    def setUp(self):
+        """
+            Create a photo
+
+        :return: None
+        """
+        self.user = account_models.User.objects.create_user(email='mrtest@mypapaya.io', password='WhoAmI',
+                                                            username='aov1')
+
+        with mock.patch('apps.photo.signals.transaction.on_commit') as on_commit:
+            self.photo = photo_models.Photo(image=Photo(open('apps/common/test/data/photos/photo1-min.jpg', 'rb')),
+                                            user=self.user)
+            self.photo.save()
+
+        self.assertEquals(on_commit.call_count, 1)
+
+    def tearDown(self):
+        """
+            Remove saved images and renditions
+
+        :return: None
+        """
+        test_helpers.clear_directory('backend/media/', '*.jpg')
+        test_helpers.clear_directory('backend/media/', 'renditions')
+
+    def test_photo_renditions_pending_fall_back_to_original(self):
+        """
+        Test that a photo without renditions serves its original image
+
+        :return: None
+        """
+        self.assertEquals(self.photo.rendition_status, 'pending')
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(self.user))
+        request = client.get('/api/photos/{}'.format(self.photo.id))
+        result = request.data
+
+        self.assertEquals(result['image_medium'], result['image'])
+        self.assertEquals(result['image_tiny_272'], result['image'])
+
+    def test_photo_renditions_generated(self):
+        """
+        Test that the task generates the renditions and marks the photo ready
+
+        :return: None
+        """
+        photo_tasks.generate_photo_renditions(self.photo.id, self.photo.image.name)
+
+        photo = photo_models.Photo.objects.get(id=self.photo.id)
+
+        self.assertEquals(photo.rendition_status, 'ready')
+        self.assertTrue(get_rendition_storage().exists(photo.rendition_manifest['image_medium']))
+        self.assertNotEquals(photo.get_rendition('image_medium').url, photo.image.url)
+
+    def test_photo_renditions_not_queued_without_image_change(self):
+        """
+        Test that saving a photo without replacing its image does not regenerate or reset its renditions
+
+        :return: None
+        """
+        photo_tasks.generate_photo_renditions(self.photo.id, self.photo.image.name)
+        photo = photo_models.Photo.objects.get(id=self.photo.id)
+
+        with mock.patch('apps.photo.signals.transaction.on_commit') as on_commit:
+            self.photo.votes = 2
+            self.photo.save()
+            photo.caption = 'Night'
+            photo.save()
+
+        self.assertEquals(on_commit.call_count, 0)
+        self.assertEquals(photo_models.Photo.objects.get(id=self.photo.id).rendition_status, 'ready')
+
+    def test_photo_renditions_skip_replaced_image(self):
+        """
+        Test that a task queued for an image that has since been replaced does nothing
+
+        :return: None
+        """
+        photo_tasks.generate_photo_renditions(self.photo.id, 'photos/replaced.jpg')
+
+        self.assertEquals(photo_models.Photo.objects.get(id=self.photo.id).rendition_status, 'pending')
+
+    def test_photo_renditions_single_decode(self):
+        """
+        Test that every rendition is written under a name derived from its content from a single decode of the image
+
+        :return: None
+        """
+        with mock.patch('apps.photo.models.PillowImage.open', wraps=PillowImage.open) as pillow_open:
+            generated = self.photo.generate_renditions()
+
+        names = [photo_models.get_rendition_field_name(name, image_format)
+                 for name in photo_models.PHOTO_RENDITION_FIELDS for image_format in RENDITION_FORMATS]
+
+        storage = get_rendition_storage()
+
+        self.assertEquals(pillow_open.call_count, 1)
+        self.assertEquals(sorted(generated), sorted(names))
+        self.assertEquals(self.photo.rendition_manifest, generated)
+
+        for name in names:
+            self.assertTrue(generated[name].startswith('renditions/{}/'.format(name)))
+            self.assertTrue(storage.exists(generated[name]))
+
+        self.assertEquals(PillowImage.open(storage.open(generated['image_tiny_272'])).size[0], 272)
+        self.assertEquals(len(self.photo.blurhash), 36)
+        self.assertEquals(self.photo.generate_renditions(), {})
+        self.assertEquals(self.photo.generate_renditions(force=True), generated)
+
+    def test_photo_renditions_format_negotiation(self):
+        """
+        Test that renditions are served in the best format the client accepts and fall back to JPEG
+
+        :return: None
+        """
+        photo_tasks.generate_photo_renditions(self.photo.id, self.photo.image.name)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(self.user))
+
+        jpeg = client.get('/api/photos/{}'.format(self.photo.id)).data
+        webp = client.get('/api/photos/{}'.format(self.photo.id), HTTP_ACCEPT='application/json, image/webp').data
+        requested = client.get('/api/photos/{}?image_format=webp'.format(self.photo.id)).data
+
+        self.assertTrue(jpeg['image_medium'].endswith('.jpg'))
+        self.assertTrue(webp['image_medium'].endswith('.webp'))
+        self.assertEquals(requested['image_medium'], webp['image_medium'])
+
+        # Photos processed before WebP renditions existed keep serving JPEG
+        photo_models.Photo.objects.filter(id=self.photo.id).update(rendition_formats=['JPEG'])
+        webp = client.get('/api/photos/{}'.format(self.photo.id), HTTP_ACCEPT='application/json, image/webp').data
+
+        self.assertEquals(webp['image_medium'], jpeg['image_medium'])
+
+    def test_photo_renditions_vary_on_accept(self):
+        """
+        Test that responses listing renditions tell caches they depend on the Accept header
+
+        :return: None
+        """
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(self.user))
+
+        single = client.get('/api/photos/{}'.format(self.photo.id), HTTP_ACCEPT='application/json, image/webp')
+        listed = client.get('/api/photos')
+
+        self.assertIn('Accept', single['Vary'])
+        self.assertIn('Accept', listed['Vary'])
+
+    def test_photo_renditions_manifest(self):
+        """
+        Test that generated rendition names are recorded and serialized without going through ImageKit
+
+        :return: None
+        """
+        photo_tasks.generate_photo_renditions(self.photo.id, self.photo.image.name)
+        photo = photo_models.Photo.objects.get(id=self.photo.id)
+
+        self.assertTrue(photo.rendition_manifest['image_medium'].startswith('renditions/image_medium/'))
+        self.assertEquals(len(photo.rendition_manifest),
+                          len(photo_models.PHOTO_RENDITION_FIELDS) * len(RENDITION_FORMATS))
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(self.user))
+
+        with mock.patch('imagekit.cachefiles.ImageCacheFile.__init__', side_effect=AssertionError) as cache_file:
+            result = client.get('/api/photos/{}'.format(self.photo.id)).data
+
+        cache_file.assert_not_called()
+        self.assertTrue(result['image_medium'].endswith(photo.rendition_manifest['image_medium']))
+
+    def test_photo_renditions_collect_unreferenced(self):
+        """
+        Test that rendition files no manifest refers to are deleted once past the grace period
+
+        :return: None
+        """
+        photo_tasks.generate_photo_renditions(self.photo.id, self.photo.image.name)
+        photo = photo_models.Photo.objects.get(id=self.photo.id)
+        storage = get_rendition_storage()
+        orphan = storage.save('renditions/image_medium/orphan.jpg', ContentFile(b'orphan'))
+
+        self.assertEquals(photo_tasks.collect_photo_renditions(), [])
+
+        with mock.patch('apps.photo.tasks.timezone.now', return_value=timezone.now() + timedelta(days=2)):
+            self.assertEquals(photo_tasks.collect_photo_renditions(dry_run=True), [orphan])
+            self.assertTrue(storage.exists(orphan))
+            self.assertEquals(photo_tasks.collect_photo_renditions(), [orphan])
+
+        self.assertFalse(storage.exists(orphan))
+
+        for name in photo.rendition_manifest.values():
+            self.assertTrue(storage.exists(name))
+
+    def test_photo_renditions_blurhash(self):
+        """
+        Test that the BlurHash placeholder is returned inline once renditions are generated, and is added to photos
+        whose renditions were generated before placeholders existed
+
+        :return: None
+        """
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(self.user))
+
+        self.assertEquals(client.get('/api/photos/{}'.format(self.photo.id)).data['blurhash'], '')
+
+        photo_tasks.generate_photo_renditions(self.photo.id, self.photo.image.name)
+        photo = photo_models.Photo.objects.get(id=self.photo.id)
+        result = client.get('/api/photos/{}'.format(self.photo.id)).data
+
+        # A square photo gets 4x4 components, encoded in the first character
+        self.assertEquals(result['blurhash'], photo.blurhash)
+        self.assertEquals(photo.blurhash[0], 'U')
+
+        photo_models.Photo.objects.filter(id=photo.id).update(blurhash='')
+        photo = photo_models.Photo.objects.get(id=photo.id)
+
+        # Without renditions to make, the image is only decoded at a fraction of its size for the placeholder
+        self.assertEquals(photo.generate_renditions(), {})
+        self.assertEquals(len(photo.blurhash), len(result['blurhash']))
+
+    def test_photo_renditions_blurhash_palette(self):
+        """
+        Test that palette images are placeheld by their colours, not by a resize of their palette indexes
+
+        :return: None
+        """
+        image = PillowImage.new('RGB', (64, 64), (255, 0, 0))
+
+        for x in range(0, 64, 2):
+            image.paste((0, 0, 255), (x, 0, x + 1, 64))
+
+        palette_image = image.convert('P', palette=PillowImage.ADAPTIVE, colors=2)
+
+        self.assertEquals(get_blurhash(palette_image), get_blurhash(palette_image.convert('RGB')))
+
+    def test_photo_renditions_force_regenerate(self):
+        """
+        Test that regenerating the renditions of a ready photo keeps serving the current ones until it is done, and
+        that a failure leaves them in place
+
+        :return: None
+        """
+        photo_tasks.generate_photo_renditions(self.photo.id, self.photo.image.name)
+        manifest = photo_models.Photo.objects.get(id=self.photo.id).rendition_manifest
+
+        with mock.patch('apps.photo.models.Photo.generate_renditions', side_effect=IOError) as generate_renditions:
+            with self.assertRaises(IOError):
+                photo_tasks.generate_photo_renditions(self.photo.id, force=True)
+
+        photo = photo_models.Photo.objects.get(id=self.photo.id)
+
+        generate_renditions.assert_called_once_with(force=True)
+        self.assertEquals(photo.rendition_status, 'ready')
+        self.assertEquals(photo.rendition_manifest, manifest)
@@ -0,0 +1,144 @@
+from apps.account import models as account_models
+from apps.common.test import helpers as test_helpers
+from apps.photo import models as photo_models
+from apps.photo import similarity
+from apps.photo.photo import Photo
+from apps.photo.similarity import HammingIndex
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from unittest import mock
+
+
+class TestHammingIndex(TestCase):
+    def test_hamming_index_search(self):
+        """
+        Test that a search finds every hash within the distance, nearest first, including negative hashes
+
+        :return: None
+        """
+        index = HammingIndex()
+        index.add(1, 0)
+        index.add(2, 0b111)
+        index.add(3, (1 << 40) | (1 << 20) | (1 << 5) | 1)
+        index.add(4, -1)
+        index.add(5, 0b1)
+
+        self.assertEquals(index.search(0, 4), [(0, 1), (1, 5), (3, 2), (4, 3)])
+        self.assertEquals(index.search(-2, 1), [(1, 4)])
+
+        index.remove(5)
+        index.add(2, -1)
+
+        self.assertEquals(len(index), 4)
+        self.assertEquals(index.search(0, 4), [(0, 1), (4, 3)])
+
+
+@override_settings(REMOTE_IMAGE_STORAGE=False,
+                   DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+class TestPhotoSimilarAdmin(TestCase):
+    """
+    Test /admin/photos/<id>/similar/
+    """
+    def setUp(self):
+        """
+            Create photos with known perceptual hashes
+
+        :return: None
+        """
+        self.user = account_models.User.objects.create_superuser(email='mrtest@mypapaya.io', password='WhoAmI')
+        self.photos = list()
+
+        with mock.patch('apps.photo.signals.transaction.on_commit'):
+            for perceptual_hash in (0b1, 0b11, 0b1111111111111, None):
+                photo = photo_models.Photo(image=Photo(open('apps/common/test/data/photos/photo1-min.jpg', 'rb')),
+                                           user=self.user)
+                photo.save()
+                photo_models.Photo.objects.filter(id=photo.id).update(
+                    perceptual_hash=perceptual_hash, rendition_status='pending' if perceptual_hash is None else 'ready')
+                self.photos.append(photo)
+
+        similarity.PHOTO_SIMILARITY_INDEX.built_at = None
+
+    def tearDown(self):
+        """
+            Remove saved images
+
+        :return: None
+        """
+        test_helpers.clear_directory('backend/media/', '*.jpg')
+
+    def test_photo_similar_admin_successful(self):
+        """
+        Test that near-duplicates are listed nearest first, and that photos hashed after the index was built are found
+
+        :return: None
+        """
+        client = APIClient()
+        client.force_login(self.user)
+
+        request = client.get('/admin/photos/{}/similar/'.format(self.photos[0].id))
+        result = request.json()
+
+        self.assertEquals(request.status_code, 200)
+        self.assertEquals([(r['id'], r['distance']) for r in result['results']], [(self.photos[1].id, 1)])
+
+        # The last photo was still waiting for its hash
+        photo_models.Photo.objects.filter(id=self.photos[3].id).update(perceptual_hash=0, rendition_status='ready')
+        result = client.get('/admin/photos/{}/similar/?distance=12'.format(self.photos[0].id)).json()
+
+        self.assertEquals([(r['id'], r['distance']) for r in result['results']],
+                          [(self.photos[1].id, 1), (self.photos[3].id, 1), (self.photos[2].id, 12)])
+
+    def test_photo_similar_admin_changed_hash(self):
+        """
+        Test that photos whose hash has moved out of the distance since they were indexed are left out, and that
+        photos given a new image are found by their new hash
+
+        :return: None
+        """
+        client = APIClient()
+        client.force_login(self.user)
+        client.get('/admin/photos/{}/similar/'.format(self.photos[0].id))
+
+        photo_models.Photo.objects.filter(id=self.photos[1].id).update(perceptual_hash=0b111111111110)
+        result = client.get('/admin/photos/{}/similar/'.format(self.photos[0].id)).json()
+
+        self.assertEquals(result['results'], [])
+
+        with mock.patch('apps.photo.signals.transaction.on_commit'):
+            self.photos[2].image = Photo(open('apps/common/test/data/photos/photo2-min.jpg', 'rb'))
+            self.photos[2].save()
+
+        # The rendition task stores the hash of the new image
+        photo_models.Photo.objects.filter(id=self.photos[2].id).update(perceptual_hash=0b11, rendition_status='ready')
+        result = client.get('/admin/photos/{}/similar/'.format(self.photos[0].id)).json()
+
+        self.assertEquals([(r['id'], r['distance']) for r in result['results']], [(self.photos[2].id, 1)])
+
+    def test_photo_similar_admin_bad_distance(self):
+        """
+        Test that distances that are not numbers or too large are rejected
+
+        :return: None
+        """
+        client = APIClient()
+        client.force_login(self.user)
+
+        self.assertEquals(client.get('/admin/photos/{}/similar/?distance=a'.format(self.photos[0].id)).status_code,
+                          400)
+        self.assertEquals(client.get('/admin/photos/{}/similar/?distance=64'.format(self.photos[0].id)).status_code,
+                          400)
+
+    def test_photo_similar_admin_not_staff(self):
+        """
+        Test that only staff can search for similar photos
+
+        :return: None
+        """
+        user = account_models.User.objects.create_user(email='mr@mypapaya.io', password='WhoAmI', username='aov1')
+        client = APIClient()
+        client.force_login(user)
+
+        request = client.get('/admin/photos/{}/similar/'.format(self.photos[0].id))
+
+        self.assertEquals(request.status_code, 302)
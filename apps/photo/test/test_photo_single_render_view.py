@@ -0,0 +1,131 @@
+from apps.account import models as account_models
+from apps.common.test import helpers as test_helpers
+from apps.photo import models as photo_models
+from apps.photo.photo import Photo
+from django.core.cache import cache
+from django.test import override_settings, TestCase
+from PIL import Image as PillowImage
+from rest_framework.test import APIClient
+from unittest import mock
+
+
+@override_settings(REMOTE_IMAGE_STORAGE=False,
+                   DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+class TestPhotoSingleRenderView(TestCase):
+    """
+    Test GET api/photos/{}/render
+    """
+    def setUp(self):
+        """
+            Create a photo
+
+        :return: None
+        """
+        self.user = account_models.User.objects.create_user(email='mrtest@mypapaya.io', password='WhoAmI',
+                                                            username='aov1')
+        self.photo = photo_models.Photo(image=Photo(open('apps/common/test/data/photos/photo1-min.jpg', 'rb')),
+                                        user=self.user)
+        self.photo.save()
+        cache.clear()
+
+    def tearDown(self):
+        """
+            Remove saved images and renders
+
+        :return: None
+        """
+        test_helpers.clear_directory('backend/media/', '*.jpg')
+        test_helpers.clear_directory('backend/media/', 'renders')
+
+    def test_photo_single_render_view_successful(self):
+        """
+        Test that a render is made at the next render width on first request and reused afterwards
+
+        :return: None
+        """
+        client = APIClient()
+
+        with mock.patch('apps.photo.models.render_image', wraps=photo_models.render_image) as render_image:
+            request = client.get('/api/photos/{}/render?width=300'.format(self.photo.id))
+            again = client.get('/api/photos/{}/render?width=310&image_format=jpeg'.format(self.photo.id))
+
+        name = self.photo.get_render_name(320, 'JPEG')
+
+        self.assertEquals(request.status_code, 302)
+        self.assertEquals(request['Location'], again['Location'])
+        self.assertTrue(request['Location'].endswith(name))
+        self.assertEquals(render_image.call_count, 1)
+        self.assertEquals(PillowImage.open(self.photo.image.storage.open(name)).size[0], 320)
+
+    def test_photo_single_render_view_no_upscale(self):
+        """
+        Test that widths beyond the image are rendered at the image's own width
+
+        :return: None
+        """
+        request = APIClient().get('/api/photos/{}/render?width=5000&image_format=webp'.format(self.photo.id))
+        name = self.photo.get_render_name(2048, 'WEBP')
+
+        self.assertEquals(request.status_code, 302)
+        self.assertEquals(PillowImage.open(self.photo.image.storage.open(name)).size[0], 750)
+
+    def test_photo_single_render_view_not_public(self):
+        """
+        Test that photos that are not public can only be rendered by their owner
+
+        :return: None
+        """
+        photo_models.Photo.objects.filter(id=self.photo.id).update(public=False)
+        client = APIClient()
+
+        self.assertEquals(client.get('/api/photos/{}/render?width=300'.format(self.photo.id)).status_code, 404)
+
+        client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(self.user))
+        request = client.get('/api/photos/{}/render?width=300'.format(self.photo.id))
+
+        self.assertEquals(request.status_code, 302)
+        self.assertIn('private', request['Cache-Control'])
+
+    def test_photo_single_render_view_throttled(self):
+        """
+        Test that making renders is rate limited while renders that already exist are not
+
+        :return: None
+        """
+        client = APIClient()
+
+        with mock.patch('apps.photo.views.PhotoRenderThrottle.rate', '1/hour', create=True):
+            made = client.get('/api/photos/{}/render?width=300'.format(self.photo.id))
+            existing = client.get('/api/photos/{}/render?width=300'.format(self.photo.id))
+            throttled = client.get('/api/photos/{}/render?width=600'.format(self.photo.id))
+
+        self.assertEquals([made.status_code, existing.status_code, throttled.status_code], [302, 302, 429])
+
+    def test_photo_single_render_view_bad_request(self):
+        """
+        Test that unknown formats and widths that are not numbers are refused
+
+        :return: None
+        """
+        client = APIClient()
+
+        self.assertEquals(client.get('/api/photos/{}/render?width=300&image_format=gif'.format(self.photo.id))
+                          .status_code, 400)
+        self.assertEquals(client.get('/api/photos/{}/render?width=wide'.format(self.photo.id)).status_code, 400)
+
+    def test_photo_single_render_srcset(self):
+        """
+        Test that serialized photos link to renders for the requested size and list them in a srcset
+
+        :return: None
+        """
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(self.user))
+
+        result = client.get('/api/photos/{}?width=300&height=0'.format(self.photo.id)).data
+        srcset = result['scaled_srcset'].split(', ')
+
+        self.assertTrue(result['scaled_render'].endswith('/api/photos/{}/render?width=320&image_format=jpeg'
+                                                         .format(self.photo.id)))
+        self.assertTrue(srcset[0].endswith('width=160&image_format=jpeg 160w'))
+        self.assertTrue(srcset[-1].endswith('width=750&image_format=jpeg 750w'))
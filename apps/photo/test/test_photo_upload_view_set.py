@@ -0,0 +1,234 @@
+from apps.account import models as account_models
+from apps.common.test import helpers as test_helpers
+from apps.photo import models as photo_models
+from apps.photo import tasks as photo_tasks
+from django.conf import settings
+from django.test import override_settings, TestCase
+from moto import mock_s3
+from rest_framework.test import APIClient
+from unittest import mock
+import boto3
+import os
+
+
+def download_original(bucket, name, file):
+    """
+    Stand-in for the storage download that writes a test photo
+
+    :param bucket: name of the bucket
+    :param name: name of the stored file
+    :param file: writable binary file object
+    :return: None
+    """
+    with open('apps/common/test/data/photos/photo1-min.jpg', 'rb') as f:
+        file.write(f.read())
+
+
+@mock_s3
+@mock.patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': 'testing', 'AWS_SECRET_ACCESS_KEY': 'testing'})
+@override_settings(REMOTE_IMAGE_STORAGE=True)
+class TestPhotoUploadViewSet(TestCase):
+    """
+    Test POST api/photos/uploads and POST api/photos/uploads/{}/finalize against a mocked S3
+    """
+    def setUp(self):
+        """
+            Create a user and the originals bucket
+
+        :return: None
+        """
+        self.user = account_models.User.objects.create_user(email='mrtest@mypapaya.io', password='WhoAmI',
+                                                            username='aov1')
+        self.bucket = settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME']
+        self.s3 = boto3.client('s3', region_name='us-east-1')
+        self.s3.create_bucket(Bucket=self.bucket)
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(self.user))
+
+    def test_photo_upload_view_set_post_successful(self):
+        """
+        Test that starting an upload returns a pre-signed POST for the original
+
+        :return: None
+        """
+        request = self.client.post('/api/photos/uploads', data={'filename': 'my photo.jpg'}, format='json')
+        result = request.data
+        upload = photo_models.PhotoUpload.objects.get(id=result['id'])
+
+        self.assertEquals(request.status_code, 201)
+        self.assertEquals(result['status'], 'pending')
+        self.assertTrue(upload.original_name.startswith('u{}_'.format(self.user.id)))
+        self.assertTrue(upload.original_name.endswith('_my_photo.jpg'))
+        self.assertEquals(result['upload']['fields']['key'], upload.original_name)
+        self.assertIn(self.bucket, result['upload']['url'])
+
+    def test_photo_upload_view_set_post_bad_extension(self):
+        """
+        Test that uploads of unsupported files are refused
+
+        :return: None
+        """
+        request = self.client.post('/api/photos/uploads', data={'filename': 'animation.gif'}, format='json')
+
+        self.assertEquals(request.status_code, 400)
+        self.assertEquals(photo_models.PhotoUpload.objects.count(), 0)
+
+    def test_photo_upload_view_set_finalize_not_uploaded(self):
+        """
+        Test that an upload cannot be finalized before the original is in storage
+
+        :return: None
+        """
+        upload = photo_models.PhotoUpload.objects.create(original_name='u1_missing.jpg', user=self.user)
+
+        request = self.client.post('/api/photos/uploads/{}/finalize'.format(upload.id), format='json')
+
+        self.assertEquals(request.status_code, 400)
+        self.assertEquals(photo_models.PhotoUpload.objects.get(id=upload.id).status, 'pending')
+
+    def test_photo_upload_view_set_finalize_successful(self):
+        """
+        Test that finalizing an upload stores the photo fields and queues processing once
+
+        :return: None
+        """
+        category = photo_models.PhotoClassification.objects.create_or_update(name='Night',
+                                                                             classification_type='category')
+        upload = photo_models.PhotoUpload.objects.create(original_name='u1_photo.jpg', user=self.user)
+
+        with open('apps/common/test/data/photos/photo1-min.jpg', 'rb') as f:
+            self.s3.put_object(Bucket=self.bucket, Key=upload.original_name, Body=f.read())
+
+        payload = {
+            'category': category.id,
+            'geo_location': 'POINT ({} {})'.format(-116.2023436, 43.6169233),
+            'tags': '#night #sky'
+        }
+
+        with mock.patch('apps.photo.views.transaction.on_commit') as on_commit:
+            request = self.client.post('/api/photos/uploads/{}/finalize'.format(upload.id), data=payload,
+                                       format='multipart')
+            second = self.client.post('/api/photos/uploads/{}/finalize'.format(upload.id), data=payload,
+                                      format='multipart')
+
+        upload.refresh_from_db()
+
+        self.assertEquals(request.status_code, 200)
+        self.assertEquals(request.data['status'], 'processing')
+        self.assertEquals(second.status_code, 400)
+        self.assertEquals(on_commit.call_count, 1)
+        self.assertEquals(upload.metadata['category'], [str(category.id)])
+        self.assertEquals(upload.metadata['tags'], '#night #sky')
+
+    def test_photo_upload_view_set_get_other_user(self):
+        """
+        Test that users can only see their own uploads
+
+        :return: None
+        """
+        other = account_models.User.objects.create_user(email='mrstest@mypapaya.io', password='WhoAmI',
+                                                        username='aov2')
+        upload = photo_models.PhotoUpload.objects.create(original_name='u2_photo.jpg', user=other)
+
+        request = self.client.get('/api/photos/uploads/{}'.format(upload.id))
+
+        self.assertEquals(request.status_code, 404)
+
+
+@override_settings(REMOTE_IMAGE_STORAGE=False,
+                   DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+@mock.patch('apps.photo.tasks.common_storage.download', side_effect=download_original)
+class TestProcessPhotoUpload(TestCase):
+    """
+    Test that finalized uploads are turned into photos in the background
+    """
+    def setUp(self):
+        """
+            Create a user
+
+        :return: None
+        """
+        self.user = account_models.User.objects.create_user(email='mrtest@mypapaya.io', password='WhoAmI',
+                                                            username='aov1')
+
+    def tearDown(self):
+        """
+            Remove saved images
+
+        :return: None
+        """
+        test_helpers.clear_directory('backend/media/', '*.jpg')
+
+    def test_process_photo_upload_successful(self, download):
+        """
+        Test that the photo is created from the original with the stored fields and tags
+
+        :return: None
+        """
+        category = photo_models.PhotoClassification.objects.create_or_update(name='Night',
+                                                                             classification_type='category')
+        upload = photo_models.PhotoUpload.objects.create(
+            metadata={'category': [category.id], 'tags': '#night #sky'}, original_name='u1_photo.jpg',
+            status='processing', user=self.user)
+
+        photo_tasks.process_photo_upload(upload.id)
+
+        upload.refresh_from_db()
+        photo = upload.photo
+
+        self.assertEquals(upload.status, 'done')
+        self.assertEquals(photo.user, self.user)
+        self.assertEquals(photo.original_image_url, upload.original_image_url)
+        self.assertEquals(photo.image_width, 750)
+        self.assertEquals(list(photo.category.all()), [category])
+        self.assertEquals(sorted(photo.tag.values_list('name', flat=True)), ['night', 'sky'])
+
+    def test_process_photo_upload_tag_list(self, download):
+        """
+        Test that tags stored as a list by a JSON finalize request are added
+
+        :return: None
+        """
+        category = photo_models.PhotoClassification.objects.create_or_update(name='Night',
+                                                                             classification_type='category')
+        upload = photo_models.PhotoUpload.objects.create(
+            metadata={'category': [category.id], 'tags': ['#night', 'sky']}, original_name='u1_photo.jpg',
+            status='processing', user=self.user)
+
+        photo_tasks.process_photo_upload(upload.id)
+
+        upload.refresh_from_db()
+
+        self.assertEquals(upload.status, 'done')
+        self.assertEquals(sorted(upload.photo.tag.values_list('name', flat=True)), ['night', 'sky'])
+
+    def test_process_photo_upload_bad_metadata(self, download):
+        """
+        Test that an upload with invalid fields is marked failed without creating a photo
+
+        :return: None
+        """
+        upload = photo_models.PhotoUpload.objects.create(
+            metadata={'geo_location': 'nowhere'}, original_name='u1_photo.jpg', status='processing', user=self.user)
+
+        photo_tasks.process_photo_upload(upload.id)
+
+        upload.refresh_from_db()
+
+        self.assertEquals(upload.status, 'failed')
+        self.assertIn('geo_location', upload.error)
+        self.assertEquals(photo_models.Photo.objects.count(), 0)
+
+    def test_process_photo_upload_not_finalized(self, download):
+        """
+        Test that uploads which have not been finalized are left alone
+
+        :return: None
+        """
+        upload = photo_models.PhotoUpload.objects.create(original_name='u1_photo.jpg', user=self.user)
+
+        photo_tasks.process_photo_upload(upload.id)
+
+        self.assertEquals(photo_models.PhotoUpload.objects.get(id=upload.id).status, 'pending')
+        download.assert_not_called()
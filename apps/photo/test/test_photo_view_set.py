@@ -10,6 +10,7 @@ from factory import DjangoModelFactory
 from os.path import getsize
 from rest_framework.test import APIClient
 from rest_framework_tracking.models import APIRequestLog
+from unittest import mock
 import re
 import time
 
@@ -429,7 +430,8 @@ class TestPhotoViewSetPOST(TestCase):
         test_helpers.clear_directory('backend/media/', '*.jpg')
 
     @override_settings(REMOTE_IMAGE_STORAGE=False,
-                       DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+                       DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+                       PHOTO_JPEG_SAVINGS_SAMPLE_RATE=1)
     def test_photo_view_set_post_successful(self):
         """
         Test that we can save a photo.
@@ -478,6 +480,8 @@ class TestPhotoViewSetPOST(TestCase):
         self.assertEquals(len(photos), 1)
         self.assertTrue(photos[0].public)
         self.assertIsNotNone(photos[0].original_image_url)
+        self.assertEquals(photos[0].image_quality, 80)
+        self.assertGreater(photos[0].image_bytes_saved, 0)
 
         # Test that original uploaded image is saved (before resized and compressed)
         matched_images = test_helpers.find_file_by_pattern(settings.MEDIA_ROOT, '*_md-portrait.jpg')
@@ -678,6 +682,68 @@ class TestPhotoViewSetPOST(TestCase):
 
         self.assertEquals(request.status_code, 400)
 
+    @override_settings(REMOTE_IMAGE_STORAGE=False,
+                       DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+    def test_photo_view_set_post_bad_request_original_deleted(self):
+        """
+        Test that the original uploaded alongside an invalid photo is deleted
+
+        :return: None
+        """
+        # Test data
+        user = account_models.User.objects.get(email='mrtest@mypapaya.io', username='aov1')
+
+        # Simulate auth
+        token = test_helpers.get_token_for_user(user)
+
+        # Get data from endpoint
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+        with open('apps/common/test/data/photos/photo1-min.jpg', 'rb') as image:
+            payload = {
+                'image': image
+            }
+
+            request = client.post('/api/photos', data=payload, format='multipart')
+
+        self.assertEquals(request.status_code, 400)
+        self.assertIsNone(test_helpers.find_file_by_pattern(settings.MEDIA_ROOT, '*_photo1-min.jpg'))
+
+    @override_settings(REMOTE_IMAGE_STORAGE=False,
+                       DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+    def test_photo_view_set_post_storage_error(self):
+        """
+        Test that we get 500 and no photo is kept if the original could not be stored
+
+        :return: None
+        """
+        # Test data
+        user = account_models.User.objects.get(email='mrtest@mypapaya.io', username='aov1')
+        category = photo_models.PhotoClassification.objects.get(name='Landscape', classification_type='category')
+
+        # Simulate auth
+        token = test_helpers.get_token_for_user(user)
+
+        # Get data from endpoint
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + token)
+
+        with open('apps/common/test/data/photos/photo1-min.jpg', 'rb') as image:
+            payload = {
+                'category': category.id,
+                'image': image
+            }
+
+            with mock.patch('apps.photo.photo.Photo.save_original', side_effect=OSError('No space left')), \
+                    mock.patch('apps.photo.views.delete_stored_image') as delete_stored_image:
+                request = client.post('/api/photos', data=payload, format='multipart')
+
+        self.assertEquals(request.status_code, 500)
+        self.assertEquals(request.data['message'], 'Image could not be stored')
+        self.assertEquals(photo_models.Photo.objects.count(), 0)
+        delete_stored_image.assert_called_once()
+
     @override_settings(REMOTE_IMAGE_STORAGE=False,
                        DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
     def test_photo_view_set_post_bad_request_image_missing(self):
@@ -1038,3 +1104,62 @@ class TestPhotoViewSetPOST(TestCase):
         self.assertTrue(photos[0].public)
         self.assertIsNotNone(photos[0].original_image_url)
 
+    @override_settings(REMOTE_IMAGE_STORAGE=False,
+                       DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage')
+    def test_photo_view_set_post_duplicate(self):
+        """
+        Test that uploading an original a second time reuses the stored images and renditions of the first upload
+
+        :return: None
+        """
+        user = account_models.User.objects.get(email='mrtest@mypapaya.io', username='aov1')
+        category = photo_models.PhotoClassification.objects.get(name='Landscape', classification_type='category')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(user))
+
+        def upload():
+            with open('apps/common/test/data/photos/photo1-min.jpg', 'rb') as i:
+                return client.post('/api/photos', data={'category': category.id, 'image': i}, format='multipart')
+
+        self.assertEquals(upload().status_code, 200)
+
+        first = photo_models.Photo.objects.get()
+        photo_models.Photo.objects.filter(id=first.id).update(rendition_manifest={'image_medium': 'renditions/a.jpg'},
+                                                              rendition_status='ready')
+
+        with mock.patch('apps.photo.views.Photo.compress') as compress:
+            request = upload()
+
+        second = photo_models.Photo.objects.get(id=request.data['id'])
+
+        compress.assert_not_called()
+        self.assertEquals(request.status_code, 200)
+        self.assertEquals(len(first.original_hash), 64)
+        self.assertEquals(second.original_hash, first.original_hash)
+        self.assertEquals(second.image.name, first.image.name)
+        self.assertEquals(second.original_image_url, first.original_image_url)
+        self.assertEquals(second.rendition_status, 'ready')
+        self.assertEquals(second.rendition_manifest, {'image_medium': 'renditions/a.jpg'})
+
+    @override_settings(REMOTE_IMAGE_STORAGE=False,
+                       DEFAULT_FILE_STORAGE='django.core.files.storage.FileSystemStorage',
+                       PHOTO_REJECT_DUPLICATE_UPLOADS=True)
+    def test_photo_view_set_post_duplicate_rejected(self):
+        """
+        Test that users can be kept from uploading the same original twice
+
+        :return: None
+        """
+        user = account_models.User.objects.get(email='mrtest@mypapaya.io', username='aov1')
+        category = photo_models.PhotoClassification.objects.get(name='Landscape', classification_type='category')
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(user))
+        statuses = list()
+
+        for _ in range(2):
+            with open('apps/common/test/data/photos/photo1-min.jpg', 'rb') as i:
+                statuses.append(client.post('/api/photos', data={'category': category.id, 'image': i},
+                                            format='multipart').status_code)
+
+        self.assertEquals(statuses, [200, 400])
+        self.assertEquals(photo_models.Photo.objects.count(), 1)
@@ -0,0 +1,95 @@
+from apps.account import models as account_models
+from apps.common.test import helpers as test_helpers
+from apps.photo import models as photo_models
+from apps.photo.photo import Photo
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+
+class TestPhotoViewerState(TestCase):
+    """
+    Test that the accessing user's stars and votes are resolved once per page of photos
+    """
+    def setUp(self):
+        """
+            Create a feed of photos, some starred and voted on by the accessing user
+
+        :return: None
+        """
+        user = account_models.User.objects \
+            .create_user(email='mrtest@mypapaya.io', password='WhoWantsToBeAMillionaire?', username='aov1')
+        self.access_user = account_models.User.objects \
+            .create_user(email='mr@mypapaya.io', password='WhoWantsToBeAMillionaire?', username='aov2')
+        self.feed = photo_models.PhotoFeed.objects.create_or_update(name='Landscape')
+        category = photo_models.PhotoClassification.objects \
+            .create_or_update(name='Test', classification_type='category')
+
+        self.photos = list()
+
+        for votes in range(4):
+            photo = photo_models \
+                .Photo(image=Photo(open('apps/common/test/data/photos/photo1-min.jpg', 'rb')), user=user)
+            photo.save()
+            photo.votes = votes
+            photo.category.set([category])
+            photo.photo_feed.set([self.feed])
+            photo.save()
+            self.photos.append(photo)
+
+        account_models.UserInterest.objects.create(content_object=self.photos[0], user=self.access_user,
+                                                   interest_type='star')
+        photo_models.PhotoVote.objects.create_or_update(photo=self.photos[1], user=self.access_user, upvote=True)
+        photo_models.PhotoVote.objects.create_or_update(photo=self.photos[2], user=self.access_user, upvote=False)
+
+    def test_photo_viewer_state_values(self):
+        """
+        Test that each photo reports the accessing user's star and vote
+
+        :return: None
+        """
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(self.access_user))
+
+        request = client.get('/api/photo_feeds/{}/photos'.format(self.feed.id))
+        results = {result['id']: result for result in request.data['results']}
+
+        self.assertTrue(results[self.photos[0].id]['user_starred']['starred'])
+        self.assertFalse(results[self.photos[1].id]['user_starred']['starred'])
+        self.assertEquals(results[self.photos[1].id]['user_voted'], {'voted': True, 'type': 'upvote'})
+        self.assertEquals(results[self.photos[2].id]['user_voted'], {'voted': True, 'type': 'downvote'})
+        self.assertEquals(results[self.photos[3].id]['user_voted'], {'voted': False})
+
+    def test_photo_viewer_state_single_query_per_page(self):
+        """
+        Test that stars and votes are loaded with one query each for the whole page
+
+        :return: None
+        """
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token ' + test_helpers.get_token_for_user(self.access_user))
+
+        with CaptureQueriesContext(connection) as queries:
+            request = client.get('/api/photo_feeds/{}/photos'.format(self.feed.id))
+
+        star_queries = [q for q in queries.captured_queries if '"account_userinterest"."user_id"' in q['sql']]
+        vote_queries = [q for q in queries.captured_queries if '"photo_photovote"."user_id"' in q['sql']]
+
+        self.assertEquals(len(request.data['results']), 4)
+        self.assertEquals(len(star_queries), 1)
+        self.assertEquals(len(vote_queries), 1)
+
+    def test_photo_viewer_state_anonymous(self):
+        """
+        Test that anonymous users get empty viewer state without querying for it
+
+        :return: None
+        """
+        client = APIClient()
+
+        request = client.get('/api/photo_feeds/{}/photos'.format(self.feed.id))
+
+        for result in request.data['results']:
+            self.assertFalse(result['user_starred']['starred'])
+            self.assertFalse(result['user_voted']['voted'])
@@ -1,16 +1,24 @@
 from apps.account import models as account_models
 from apps.account import serializers as account_serializers
 from apps.common import models as common_models
-from apps.common.serializers import setup_eager_loading
+from apps.common import storage as common_storage
+from apps.common.serializers import determine_render, setup_eager_loading
 from apps.common.views import (DefaultResultsSetPagination, get_default_response, handle_jquery_empty_array,
-                               MediumResultsSetPagination, remove_pks_from_payload, query_dict_to_dict)
+                               MediumResultsSetPagination, remove_pks_from_payload, query_dict_to_dict,
+                               VaryOnAcceptMixin)
 from apps.communication.models import PushNotificationRecord
 from apps.communication import tasks as communication_tasks
 from apps.photo import models as photo_models
 from apps.photo import serializers as photo_serializers
-from apps.photo.photo import Photo
+from apps.photo import tasks as photo_tasks
+from apps.photo.photo import (get_decode_scale, get_file_hash, ImageTooLarge, Photo, read_stored_image_header,
+                              RENDITION_FORMATS)
+from apps.photo.similarity import hamming_distance, PHOTO_SIMILARITY_INDEX
 from apps.utils.models import UserAction
 from apps.utils.serializers import UserActionSerializer
+from boto3.exceptions import Boto3Error
+from botocore.exceptions import BotoCoreError, ClientError
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
@@ -18,16 +26,34 @@ from django.contrib.contenttypes.models import ContentType
 from django.contrib.gis.geos import Polygon
 from django.core.exceptions import ObjectDoesNotExist
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Count, Q
-from django.shortcuts import render
+from django.db import transaction
+from django.db.models import Count, F, Q
+from django.http import Http404, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from fcm_django.models import FCMDevice
 from fcm_django.fcm import FCMError
+from kombu.exceptions import OperationalError
 from push_notifications.models import APNSDevice
 from rest_framework import generics, permissions
 from rest_framework.authentication import SessionAuthentication, TokenAuthentication
 from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.relations import ManyRelatedField
+from rest_framework.throttling import UserRateThrottle
 from rest_framework_tracking.mixins import LoggingMixin
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Errors raised by the storage while images are being stored or deleted
+STORAGE_ERRORS = (Boto3Error, BotoCoreError, ClientError, OSError)
+
+# Images of batch uploads are compressed and stored here, a few at a time no matter how many batches come in
+BATCH_UPLOADS = ThreadPoolExecutor(max_workers=settings.PHOTO_BATCH_UPLOAD_WORKERS)
 
 
 @staff_member_required
@@ -201,6 +227,64 @@ def photo_map_admin(request):
     return render(request, 'photo_map.html', context)
 
 
+@staff_member_required
+def photo_similar_admin(request, pk):
+    """
+    View for /admin/photos/<id>/similar/, listing photos whose perceptual hashes are close to the photo's, such as
+    resized, recompressed or re-cropped copies of it
+
+    :param request: Request object
+    :param pk: id of the Photo
+    :return: JsonResponse
+    """
+    started = time.time()
+    photo = get_object_or_404(photo_models.Photo, id=pk)
+
+    try:
+        distance = int(request.GET.get('distance', settings.PHOTO_SIMILARITY_DISTANCE))
+    except ValueError:
+        distance = -1
+
+    if not 0 <= distance <= settings.PHOTO_SIMILARITY_MAX_DISTANCE:
+        return JsonResponse({'error': 'distance must be a number from 0 to {}'.format(
+            settings.PHOTO_SIMILARITY_MAX_DISTANCE)}, status=400)
+
+    if photo.perceptual_hash is None:
+        raise Http404('Photo {} has no perceptual hash yet'.format(pk))
+
+    matches = [match for match in PHOTO_SIMILARITY_INDEX.search(photo.perceptual_hash, distance)
+               if match[1] != photo.id]
+    photos = photo_models.Photo.objects.filter(id__in=[photo_id for _, photo_id in matches])\
+        .exclude(perceptual_hash=None).select_related('user').in_bulk()
+    results = list()
+
+    for _, photo_id in matches:
+        similar = photos.get(photo_id)
+
+        # The index is only rebuilt now and then, so photos deleted or given a new image since are checked here
+        if not similar:
+            continue
+
+        similar_distance = hamming_distance(photo.perceptual_hash, similar.perceptual_hash)
+
+        if similar_distance <= distance:
+            results.append({
+                'id': similar.id,
+                'distance': similar_distance,
+                'url_small': similar.url_small,
+                'user': similar.user.username if similar.user else None,
+            })
+
+    results.sort(key=lambda result: (result['distance'], result['id']))
+
+    return JsonResponse({
+        'id': photo.id,
+        'distance': distance,
+        'results': results,
+        'took_ms': round((time.time() - started) * 1000, 1),
+    })
+
+
 class GalleryRetrieveViewSet(generics.ListAPIView):
     """
         View set to handle creation and  updating of a Gallery
@@ -308,7 +392,7 @@ class GalleryRetrieveViewSet(generics.ListAPIView):
         return response
 
 
-class GalleryPhotoViewSet(generics.ListAPIView):
+class GalleryPhotoViewSet(VaryOnAcceptMixin, generics.ListAPIView):
     """
         API view to return the photos for a specific Gallery
 
@@ -337,7 +421,7 @@ class GalleryPhotoViewSet(generics.ListAPIView):
         return photo_models.Photo.objects.none()
 
 
-class PhotoViewSet(generics.ListCreateAPIView):
+class PhotoViewSet(VaryOnAcceptMixin, generics.ListCreateAPIView):
     authentication_classes = (SessionAuthentication, TokenAuthentication,)
     pagination_class = DefaultResultsSetPagination
     permission_classes = (permissions.IsAuthenticated,)
@@ -432,22 +516,51 @@ class PhotoViewSet(generics.ListCreateAPIView):
         payload['user'] = authenticated_user.id
         # tags = payload.getlist("tags")
         tags = payload.get("tags")
+        image_metadata = dict()
+        original = None
 
         # Image compression
         # Save original first
         if 'image' in payload:
             # Save original photo to media
             try:
-                photo = Photo(payload['image'])
-                remote_key = photo.save('u{}_{}_{}'
-                                        .format(authenticated_user.id, common_models.get_date_stamp_str(), photo.name),
-                                        custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
-
-                # Original image url
-                payload['original_image_url'] = '{}{}'.format(settings.ORIGINAL_MEDIA_URL, remote_key)
-
-                # Process image to save
-                payload['image'] = photo.compress()
+                with Photo(payload['image']) as photo:
+                    original_hash = photo.get_hash()
+                    duplicate = photo_models.Photo.objects.get_duplicate(original_hash)
+
+                    if duplicate and settings.PHOTO_REJECT_DUPLICATE_UPLOADS and photo_models.Photo.objects.filter(
+                            original_hash=original_hash, user=authenticated_user).exists():
+                        raise ValidationError('This photo has already been uploaded')
+
+                    if duplicate:
+                        # The same original was uploaded before. Its stored original, compressed image and renditions
+                        # are reused, the upload itself is only kept for validation.
+                        payload['original_image_url'] = duplicate.original_image_url
+                        image_metadata = duplicate.get_shared_image_fields()
+                    else:
+                        original_name = 'u{}_{}_{}'.format(authenticated_user.id, common_models.get_date_stamp_str(),
+                                                           photo.name)
+                        original = photo.save_original_async(
+                            original_name, custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
+
+                        # Process image to save while the original uploads
+                        payload['image'] = photo.compress()
+
+                        # Original image url. Originals are stored under the name they are given, so it is known up
+                        # front.
+                        payload['original_image_url'] = '{}{}'.format(settings.ORIGINAL_MEDIA_URL, original_name)
+
+                        # The compressed image is what gets stored, so record its metadata while it is still decoded
+                        image_metadata = {
+                            'image_format': 'JPEG',
+                            'image_height': photo.pillow_image.size[1],
+                            'image_size': payload['image'].size,
+                            'image_width': photo.pillow_image.size[0]
+                        }
+
+                    image_metadata['original_hash'] = original_hash
+            except ImageTooLarge as e:
+                raise ValidationError(str(e))
             except TypeError:
                 raise ValidationError('Image is not of type image')
 
@@ -457,7 +570,27 @@ class PhotoViewSet(generics.ListCreateAPIView):
         serializer = photo_serializers.PhotoSerializer(data=payload, context={"request": request})
 
         if serializer.is_valid():
-            serializer.save()
+            # save() uploads the compressed image while the original is still uploading. The photo is only kept if
+            # both uploads succeed.
+            try:
+                with transaction.atomic():
+                    serializer.save(**image_metadata)
+
+                    if original:
+                        original.result()
+            except STORAGE_ERRORS as e:
+                logger.warning('Could not store the images of an upload: %s', e)
+
+                if serializer.instance:
+                    delete_stored_image(serializer.instance.image)
+
+                if original:
+                    discard_original(original)
+
+                response = get_default_response('500')
+                response.data['message'] = 'Image could not be stored'
+
+                return response
 
             if tags:
                 tags = tags.split(" ")
@@ -476,6 +609,9 @@ class PhotoViewSet(generics.ListCreateAPIView):
             response = get_default_response('200')
             response.data = serializer.data
         else:
+            if original:
+                discard_original(original)
+
             raise ValidationError(serializer.errors)
 
         return response
@@ -490,7 +626,410 @@ class LoggedPhotoViewSet(LoggingMixin, PhotoViewSet):
         return response.status_code == 200
 
 
-class PhotoAppTopPhotosViewSet(generics.ListAPIView):
+def get_upload_metadata(data):
+    """
+    Copy the photo fields of a request payload into a dict that can be stored as JSON. Many-to-many fields are always
+    lists, no matter how many values a form sent.
+
+    :param data: request.data
+    :return: dict of photo fields
+    """
+    many_fields = [name for name, field in photo_serializers.PhotoSerializer().fields.items()
+                   if isinstance(field, ManyRelatedField)]
+    metadata = dict()
+
+    for key in data:
+        if key in ('image', 'original_image_url', 'user'):
+            continue
+
+        if key in many_fields and hasattr(data, 'getlist'):
+            metadata[key] = data.getlist(key)
+        else:
+            metadata[key] = data.get(key)
+
+    return metadata
+
+
+def queue_photo_upload(upload_id):
+    """
+    Hand processing of a finalized upload to Celery
+
+    :param upload_id: id of the PhotoUpload
+    :return: None
+    """
+    try:
+        photo_tasks.process_photo_upload.delay(upload_id)
+    except OperationalError as e:
+        # Nothing was processed, so the client can finalize again
+        photo_models.PhotoUpload.objects.filter(id=upload_id).update(status='pending')
+        logger.warning('Could not queue processing of upload %s: %s', upload_id, e)
+
+
+class PhotoUploadViewSet(generics.CreateAPIView):
+    """
+    /api/photos/uploads
+    """
+    authentication_classes = (SessionAuthentication, TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = photo_serializers.PhotoUploadSerializer
+
+    def post(self, request, *args, **kwargs):
+        """
+        Start a direct upload. The response includes the pre-signed POST the client sends the original to, after which
+        it calls /api/photos/uploads/{}/finalize.
+
+        :param request: Request object
+        :param args:
+        :param kwargs:
+        :return: Response object
+        """
+        authentication = TokenAuthentication().authenticate(request)
+        authenticated_user = authentication[0] if authentication else request.user
+        filename = request.data.get('filename')
+
+        if not settings.REMOTE_IMAGE_STORAGE:
+            raise ValidationError('Direct uploads need remote image storage')
+
+        if not filename:
+            raise ValidationError('Missing filename')
+
+        filename = os.path.basename(filename).replace(' ', '_')
+
+        try:
+            Photo.get_format(filename)
+        except TypeError:
+            raise ValidationError('Image is not of type image')
+
+        upload = photo_models.PhotoUpload.objects.create(
+            original_name='u{}_{}_{}'.format(authenticated_user.id, common_models.get_date_stamp_str(), filename),
+            user=authenticated_user)
+
+        response = get_default_response('201')
+        response.data = photo_serializers.PhotoUploadSerializer(upload).data
+        response.data['upload'] = common_storage.get_presigned_post(settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'],
+                                                                    upload.original_name,
+                                                                    settings.PHOTO_UPLOAD_MAX_SIZE,
+                                                                    settings.PHOTO_UPLOAD_EXPIRES)
+
+        return response
+
+
+class PhotoUploadSingleViewSet(generics.RetrieveAPIView):
+    """
+    /api/photos/uploads/{}
+    """
+    authentication_classes = (SessionAuthentication, TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = photo_serializers.PhotoUploadSerializer
+
+    def get_queryset(self):
+        return photo_models.PhotoUpload.objects.filter(user=self.request.user)
+
+
+class PhotoUploadFinalizeViewSet(VaryOnAcceptMixin, generics.CreateAPIView):
+    """
+    /api/photos/uploads/{}/finalize
+    """
+    authentication_classes = (SessionAuthentication, TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = photo_serializers.PhotoUploadSerializer
+
+    def post(self, request, **kwargs):
+        """
+        Finalize a direct upload once the original is in storage. The payload takes the same photo fields as
+        POST /api/photos, without the image. The photo is created by a background job; poll
+        /api/photos/uploads/{} for it.
+
+        :param request: Request object
+        :param kwargs:
+        :return: Response object
+        """
+        authentication = TokenAuthentication().authenticate(request)
+        authenticated_user = authentication[0] if authentication else request.user
+        upload = photo_models.PhotoUpload.objects.filter(id=kwargs.get('pk'), user=authenticated_user).first()
+
+        if not upload:
+            raise NotFound('Upload does not exist')
+
+        if upload.status != 'pending':
+            raise ValidationError('Upload has already been finalized')
+
+        storage = common_storage.get_storage(settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
+
+        if not storage.exists(upload.original_name):
+            raise ValidationError('Original has not been uploaded')
+
+        # Refuse images that cannot be decoded from the few KB of their header, before a worker downloads them
+        header = read_stored_image_header(storage, upload.original_name)
+
+        if header is None:
+            raise ValidationError('Image is not of type image')
+
+        try:
+            get_decode_scale(*header[:3])
+        except ImageTooLarge as e:
+            raise ValidationError(str(e))
+
+        metadata = get_upload_metadata(request.data)
+        serializer = photo_serializers.PhotoSerializer(data=metadata, partial=True, context={"request": request})
+
+        if not serializer.is_valid():
+            raise ValidationError(serializer.errors)
+
+        # Only one finalize request gets to queue the job
+        if photo_models.PhotoUpload.objects.filter(id=upload.id, status='pending')\
+                .update(metadata=metadata, status='processing'):
+            transaction.on_commit(lambda: queue_photo_upload(upload.id))
+
+        upload.refresh_from_db()
+
+        response = get_default_response('200')
+        response.data = photo_serializers.PhotoUploadSerializer(upload).data
+
+        return response
+
+
+def delete_stored_image(image):
+    """
+    Delete an image stored for a photo that was not saved. Failures are only logged, the upload has already failed.
+
+    :param image: ImageFieldFile of the unsaved Photo
+    :return: None
+    """
+    try:
+        image.delete(save=False)
+    except STORAGE_ERRORS as e:
+        logger.warning('Could not delete %s: %s', image.name, e)
+
+
+def discard_original(original):
+    """
+    Wait for the upload of an original whose photo was not saved and delete what it stored
+
+    :param original: Future returned by Photo.save_original_async()
+    :return: None
+    """
+    try:
+        Photo.delete_original(original.result(), settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
+    except STORAGE_ERRORS as e:
+        logger.warning('Could not discard an original: %s', e)
+
+
+def store_batch_image(image, original_name, image_name):
+    """
+    Compress an image of a batch upload and store it along with its original. Runs in BATCH_UPLOADS, so it must not
+    use the database.
+
+    :param image: uploaded file
+    :param original_name: name to store the original under
+    :param image_name: name to store the compressed image under
+    :return: dict of the image fields to save the Photo with
+    """
+    with Photo(image) as photo:
+        original = photo.save_original_async(original_name,
+                                             custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
+        compressed = photo.compress()
+        width, height = photo.pillow_image.size
+
+    image_name = photo_models.Photo._meta.get_field('image').storage.save(image_name, compressed)
+
+    # The photo is only kept if both uploads succeed
+    original.result()
+
+    return {
+        'image': image_name,
+        'image_bytes_saved': compressed.compress_stats['bytes_saved'],
+        'image_format': 'JPEG',
+        'image_height': height,
+        'image_quality': compressed.compress_stats['quality'],
+        'image_size': compressed.size,
+        'image_width': width
+    }
+
+
+class PhotoBatchViewSet(VaryOnAcceptMixin, generics.CreateAPIView):
+    """
+    /api/photos/batch
+    """
+    authentication_classes = (SessionAuthentication, TokenAuthentication,)
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = photo_serializers.PhotoSerializer
+
+    def post(self, request, *args, **kwargs):
+        """
+        Save up to PHOTO_BATCH_UPLOAD_MAX_IMAGES photos in one request. The payload takes the fields of POST
+        /api/photos, which apply to every image, along with:
+
+        images: the image files
+        metadata: optional JSON list of objects, one per image in order, whose fields override the shared ones
+        gallery: optional id of a gallery of the user to add the photos to
+
+        Images are compressed and stored in parallel. Every image gets its own result, so a bad one does not keep the
+        others from being saved.
+
+        :param request: Request object
+        :param args:
+        :param kwargs:
+        :return: Response object
+        """
+        authentication = TokenAuthentication().authenticate(request)
+        authenticated_user = authentication[0] if authentication else request.user
+        images = request.data.getlist('images') if hasattr(request.data, 'getlist') else []
+        gallery = None
+
+        if not images:
+            raise ValidationError('Missing images')
+
+        if len(images) > settings.PHOTO_BATCH_UPLOAD_MAX_IMAGES:
+            raise ValidationError('At most {} images can be uploaded at once'.format(
+                settings.PHOTO_BATCH_UPLOAD_MAX_IMAGES))
+
+        try:
+            image_metadata = json.loads(request.data.get('metadata') or '[]')
+        except ValueError:
+            image_metadata = None
+
+        if not isinstance(image_metadata, list) or len(image_metadata) > len(images) \
+                or not all(isinstance(metadata, dict) for metadata in image_metadata):
+            raise ValidationError('Expecting metadata to be a JSON list with an object per image')
+
+        if request.data.get('gallery'):
+            if str(request.data.get('gallery')).isdigit():
+                gallery = photo_models.Gallery.objects.filter(id=request.data.get('gallery'),
+                                                              user=authenticated_user).first()
+
+            if not gallery:
+                raise ValidationError('Gallery does not exist')
+
+        shared_metadata = get_upload_metadata(request.data)
+
+        for key in ('gallery', 'images', 'metadata'):
+            shared_metadata.pop(key, None)
+
+        context = {'request': request}
+        results = [{'index': index, 'name': image.name} for index, image in enumerate(images)]
+        items = list()
+
+        # Fields are checked before any image is processed, so bad metadata costs no decoding or storage
+        for index, image in enumerate(images):
+            metadata = dict(shared_metadata, **(image_metadata[index] if index < len(image_metadata) else {}))
+            tags = metadata.pop('tags', None) or []
+            serializer = photo_serializers.PhotoSerializer(data=metadata, partial=True, context=context)
+
+            if serializer.is_valid():
+                # Tags are a space separated string, as for POST /api/photos, or a list in the metadata JSON
+                items.append({'hash': get_file_hash(image), 'image': image, 'index': index, 'metadata': metadata,
+                              'tags': tags.split() if isinstance(tags, str) else list(tags)})
+            else:
+                results[index]['errors'] = serializer.errors
+
+        hashes = [item['hash'] for item in items]
+        duplicates = photo_models.Photo.objects.get_duplicates(hashes)
+        uploaded = set()
+        seen = set()
+        stored = dict()
+        date_stamp = common_models.get_date_stamp_str()
+
+        if settings.PHOTO_REJECT_DUPLICATE_UPLOADS:
+            uploaded = set(photo_models.Photo.objects.filter(original_hash__in=hashes, user=authenticated_user)
+                           .values_list('original_hash', flat=True))
+
+        for item in items:
+            duplicate = duplicates.get(item['hash'])
+
+            if settings.PHOTO_REJECT_DUPLICATE_UPLOADS and (item['hash'] in uploaded or item['hash'] in seen):
+                item['errors'] = ['This photo has already been uploaded']
+            elif duplicate:
+                # Reuse the stored original, compressed image and renditions of the earlier upload
+                item['fields'] = duplicate.get_shared_image_fields()
+                item['original_image_url'] = duplicate.original_image_url
+            elif item['hash'] in stored:
+                # The same original twice in one batch is only processed once
+                item['future'], item['original_image_url'] = stored[item['hash']]
+            else:
+                # Every image of the batch is stored under its own name, even if several were uploaded as image.jpg
+                original_name = 'u{}_{}_{}_{}'.format(authenticated_user.id, date_stamp, item['index'],
+                                                      item['image'].name.replace(' ', '_'))
+                image_name = common_models.build_file_name(
+                    date_stamp, 'u{}_{}.jpg'.format(authenticated_user.id, item['index']))
+                item['future'] = BATCH_UPLOADS.submit(store_batch_image, item['image'], original_name, image_name)
+                item['original_image_url'] = '{}{}'.format(settings.ORIGINAL_MEDIA_URL, original_name)
+                stored[item['hash']] = item['future'], item['original_image_url']
+
+            seen.add(item['hash'])
+
+        for item in items:
+            try:
+                if 'future' in item:
+                    item['fields'] = dict(item['future'].result())
+            except ImageTooLarge as e:
+                item['errors'] = [str(e)]
+            except TypeError:
+                item['errors'] = ['Image is not of type image']
+            # Exception handling to capture images that are truncated or corrupt past their header
+            except (OSError, ValueError):
+                item['errors'] = ['Image could not be processed']
+            except (Boto3Error, BotoCoreError, ClientError):
+                item['errors'] = ['Image could not be stored']
+
+        many_fields = [name for name, field in photo_serializers.PhotoSerializer().fields.items()
+                       if isinstance(field, ManyRelatedField)]
+        indexes = dict()
+        links = dict()
+        tags = dict()
+        photos = list()
+
+        with transaction.atomic():
+            for item in items:
+                if 'errors' in item:
+                    results[item['index']]['errors'] = item['errors']
+                    continue
+
+                # The upload is only validated; the photo is saved with the image stored for it
+                item['image'].seek(0)
+                payload = dict(item['metadata'], image=item['image'], original_image_url=item['original_image_url'],
+                               user=authenticated_user.id)
+                serializer = photo_serializers.PhotoSerializer(data=payload, context=context)
+
+                if not serializer.is_valid():
+                    results[item['index']]['errors'] = serializer.errors
+                    continue
+
+                # Many-to-many links are added below, with a query per linked object rather than per photo
+                photo_links = {name: serializer.validated_data.pop(name, []) for name in many_fields}
+                photo = serializer.save(original_hash=item['hash'], **item['fields'])
+                photos.append(photo)
+                indexes[photo.id] = item['index']
+
+                for name, targets in photo_links.items():
+                    for target in targets:
+                        links.setdefault((name, target), list()).append(photo.id)
+
+                for tag in item['tags']:
+                    tags.setdefault(tag.replace('#', '').lower(), (tag.replace('#', ''), list()))[1].append(photo.id)
+
+            # Adding from the other side of each relation still sends m2m_changed, which keeps category ranks current
+            for (name, target), photo_ids in links.items():
+                accessor = photo_models.Photo._meta.get_field(name).remote_field.get_accessor_name()
+                getattr(target, accessor).add(*photo_ids)
+
+            for name, photo_ids in tags.values():
+                photo_models.PhotoClassification.objects.create_or_update(name=name, classification_type='tag')\
+                    .tag.add(*photo_ids)
+
+            if gallery and photos:
+                gallery.photos.add(*photos)
+
+        for photo in photo_serializers.PhotoSerializer(photos, many=True, context=context).data:
+            results[indexes[photo['id']]]['photo'] = photo
+
+        response = get_default_response('200')
+        response.data = {'results': results}
+
+        return response
+
+
+class PhotoAppTopPhotosViewSet(VaryOnAcceptMixin, generics.ListAPIView):
     pagination_class = DefaultResultsSetPagination
     permission_classes = (permissions.AllowAny,)
     photo_feed = None
@@ -532,7 +1071,7 @@ class PhotoAppTopPhotosViewSet(generics.ListAPIView):
 
         if page == "all" and "aov-web" in url_path:
             aov_web_images = photo_models.Photo.objects.filter(public=True, category__isnull=False).distinct().annotate(
-                images_order=(Count("user_action") + (Count("photo_comment", distinct=True) * 5))
+                images_order=(photo_models.ACTION_COUNT + (F("comment_count") * 5))
             ).order_by("-images_order")
             return aov_web_images
 
@@ -540,7 +1079,7 @@ class PhotoAppTopPhotosViewSet(generics.ListAPIView):
             cutoff = timezone.now() - timedelta(days=7)
             aov_web_images = photo_models.Photo.objects.filter(public=True, category__isnull=False,
                                                                created_at__gte=cutoff).distinct().annotate(
-                images_order=(Count("user_action") + (Count("photo_comment", distinct=True) * 5))
+                images_order=(photo_models.ACTION_COUNT + (F("comment_count") * 5))
             ).order_by("-images_order")
             return aov_web_images
 
@@ -555,7 +1094,7 @@ class PhotoAppTopPhotosViewSet(generics.ListAPIView):
             cutoff = timezone.now() - timedelta(days=7)
             popular_photos = photo_models.Photo.objects.filter(
                 created_at__gte=cutoff, public=True, category__isnull=False).distinct().annotate(
-                actions=Count("user_action")).order_by("-actions")
+                actions=photo_models.ACTION_COUNT).order_by("-actions")
             return popular_photos
 
         top_photos = photo_models.Photo.objects.filter(
@@ -648,12 +1187,12 @@ class PhotoClassificationViewSet(generics.ListCreateAPIView):
             raise ValidationError(serializer.errors)
 
 
-class PhotoClassificationPhotosViewSet(generics.ListAPIView):
+class PhotoClassificationPhotosViewSet(VaryOnAcceptMixin, generics.ListAPIView):
     pagination_class = DefaultResultsSetPagination
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
     serializer_class = photo_serializers.PhotoSerializer
 
-    # @setup_eager_loading
+    @setup_eager_loading
     def get_queryset(self):
         """
         Return photos for a classification
@@ -721,7 +1260,7 @@ class PhotoFeedViewSet(generics.ListAPIView):
     serializer_class = photo_serializers.PhotoFeedSerializer
 
 
-class PhotoFeedPhotosViewSet(generics.ListAPIView):
+class PhotoFeedPhotosViewSet(VaryOnAcceptMixin, generics.ListAPIView):
     pagination_class = DefaultResultsSetPagination
     permission_classes = (permissions.AllowAny,)
     photo_feed = None
@@ -744,7 +1283,7 @@ class PhotoFeedPhotosViewSet(generics.ListAPIView):
             raise NotFound
 
 
-class PhotoSingleViewSet(generics.RetrieveDestroyAPIView, generics.UpdateAPIView):
+class PhotoSingleViewSet(VaryOnAcceptMixin, generics.RetrieveDestroyAPIView, generics.UpdateAPIView):
     permission_classes = (permissions.AllowAny,)
     serializer_class = photo_serializers.PhotoSerializer
 
@@ -864,7 +1403,7 @@ class LoggedPhotoSingleViewSet(LoggingMixin, PhotoSingleViewSet):
         return response.status_code == 200
 
 
-class PhotoSingleCaptionViewSet(generics.UpdateAPIView):
+class PhotoSingleCaptionViewSet(VaryOnAcceptMixin, generics.UpdateAPIView):
     authentication_classes = (SessionAuthentication, TokenAuthentication)
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = photo_serializers.PhotoSerializer
@@ -1352,7 +1891,7 @@ class PhotoSingleInterestsViewSet(generics.DestroyAPIView, generics.CreateAPIVie
         return response
 
 
-class PhotoSingleVotesViewSet(generics.UpdateAPIView):
+class PhotoSingleVotesViewSet(VaryOnAcceptMixin, generics.UpdateAPIView):
     authentication_classes = (SessionAuthentication, TokenAuthentication)
     permission_classes = (permissions.IsAuthenticated,)
     queryset = photo_models.Photo.objects.all()
@@ -1447,7 +1986,70 @@ class PhotoSingleVotesViewSet(generics.UpdateAPIView):
             raise NotFound('Photo does not exist')
 
 
-class PhotoSingleMediaView(generics.ListAPIView):
+class PhotoRenderThrottle(UserRateThrottle):
+    """
+    Limits how many renders a user or, when anonymous, an IP address can have made. Renders that already exist are
+    not counted.
+    """
+    scope = 'photo_render'
+
+
+class PhotoSingleRenderView(generics.RetrieveAPIView):
+    """
+    /api/photos/<id>/render?width=<width>&image_format=<jpeg|webp|avif>
+
+    Redirects to the photo resized for the requested width. The render is made during the first request for it and
+    kept in storage. Only public photos, and the user's own photos, can be rendered.
+    """
+    authentication_classes = (SessionAuthentication, TokenAuthentication,)
+    permission_classes = (permissions.AllowAny,)
+
+    def get_queryset(self):
+        """
+        Return the photos the requesting user may render
+
+        :return: QuerySet of Photo
+        """
+        if self.request.user.is_authenticated:
+            return photo_models.Photo.objects.filter(Q(public=True) | Q(user=self.request.user))
+
+        return photo_models.Photo.objects.filter(public=True)
+
+    def get(self, request, *args, **kwargs):
+        """
+        Redirect to a render
+
+        :param request: Request object
+        :param args:
+        :param kwargs:
+        :return: Redirect response
+        """
+        photo = self.get_object()
+        image_format = request.query_params.get("image_format", "jpeg").upper()
+
+        if image_format not in RENDITION_FORMATS:
+            raise ValidationError('Image format must be one of {}'.format(', '.join(RENDITION_FORMATS).lower()))
+
+        width = determine_render({"request": request})
+
+        # Making a render decodes the image in the request, so only that is rate limited
+        if not photo.has_render(width, image_format):
+            throttle = PhotoRenderThrottle()
+
+            if not throttle.allow_request(request, self):
+                self.throttled(request, throttle.wait())
+
+        response = redirect(photo.render(width, image_format))
+
+        # Which render a URL leads to only changes if the photo gets a new image. The render URL is not signed, so it
+        # can be cached for longer than a presigned URL would last.
+        patch_cache_control(response, max_age=settings.PHOTO_RENDER_REDIRECT_MAX_AGE,
+                            **{'public' if photo.public else 'private': True})
+
+        return response
+
+
+class PhotoSingleMediaView(VaryOnAcceptMixin, generics.ListAPIView):
     """
     /api/photos/<id>/media
 
@@ -1482,7 +2084,7 @@ class PhotoSingleMediaView(generics.ListAPIView):
             return photo_models.Photo.objects.none()
 
 
-class PhotoSingleDetailsView(generics.ListAPIView):
+class PhotoSingleDetailsView(VaryOnAcceptMixin, generics.ListAPIView):
     """
     /api/photos/<id>/details
 
@@ -1533,7 +2135,7 @@ class TagSearchViewSet(generics.ListAPIView):
         return qs.order_by("name")
 
 
-class UserFollowingPhotoViewSet(generics.ListAPIView):
+class UserFollowingPhotoViewSet(VaryOnAcceptMixin, generics.ListAPIView):
     """
         View to retrieve all photos for the users being followed by the requesting user
 
@@ -1,7 +1,7 @@
+from apps.common.storage import get_storage, upload_async
 from django.conf import settings
 from django.core.files import File
 from django.core.files.uploadedfile import InMemoryUploadedFile, TemporaryUploadedFile
-from storages.backends.s3boto3 import S3Boto3Storage
 import io
 
 
@@ -38,13 +38,19 @@ class Audio(File):
         :return: either the remote_key
         """
         if settings.REMOTE_AUDIO_STORAGE:
-            if custom_bucket:
-                storage = S3Boto3Storage(bucket=custom_bucket)
-            else:
-                storage = S3Boto3Storage()
-
-            return storage.save(filename, self.obj)
+            return get_storage(custom_bucket or None).save(filename, self.obj)
         else:
             full_filename = '{}/{}'.format(settings.MEDIA_ROOT, filename)
 
             return full_filename
+
+    def save_async(self, filename, custom_bucket=False):
+        """
+        Start save() in the background so the audio uploads alongside the other files of the request
+
+        :param filename: name to give to the audio file
+        :param custom_bucket: If using remote storage, storage will use this bucket instead of the one set in
+        settings.py
+        :return: Future resolving to what save() returns
+        """
+        return upload_async(self.save, filename, custom_bucket)
@@ -74,28 +74,36 @@ class GetFeaturedRequestView(generics.GenericAPIView):
             email=requester_email, full_name=requester_full_name, location=requester_location,
             instagram_handle=requester_instagram_handle)
 
+        original = None
         if 'image' in request.data:
             # Save original photo to media
             try:
-                photo = Photo(request.data['image'])
-                photo.save('GET_FEATURED_{}_{}'.format(common_models.get_date_stamp_str(), photo.name),
-                           custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
+                with Photo(request.data['image']) as photo:
+                    original = photo.save_original_async(
+                        'GET_FEATURED_{}_{}'.format(common_models.get_date_stamp_str(), photo.name),
+                        custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
 
-                # Process image to save
-                request.data["image"] = photo.compress()
+                    # Process image to save while the original uploads
+                    request.data["image"] = photo.compress()
             except TypeError:
                 raise ValidationError('Image is not of type image')
 
-        audio_url = None
+        # Only start the audio upload once the image is known to be valid, so a rejected request leaves no audio behind
+        audio_upload = None
         if 'audio_sample' in request.data:
             try:
                 audio = Audio(request.data.get("audio_sample"))
-                audio_url = audio.save('GET_FEATURED_AUDIO_{}_{}_{}'
-                                        .format(requester.id, common_models.get_date_stamp_str(), audio.name),
-                                        custom_bucket=settings.STORAGE['AUDIO_BUCKET_NAME'])
+                audio_upload = audio.save_async('GET_FEATURED_AUDIO_{}_{}_{}'
+                                                .format(requester.id, common_models.get_date_stamp_str(), audio.name),
+                                                custom_bucket=settings.STORAGE['AUDIO_BUCKET_NAME'])
             except TypeError as exc:
                 print(exc.__repr__())
 
+        if original:
+            original.result()
+
+        audio_url = audio_upload.result() if audio_upload else None
+
         get_featured_request = podcast_models.GetFeaturedRequest.objects.create(
             requester_fk=requester, image=request.data.get("image", None), story=request.data.get("story", None),
             audio=audio_url)
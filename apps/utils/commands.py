@@ -1,3 +1,6 @@
+import os
+
+
 class TermColor:
     """
     Colors for terminal output. Example usage:
@@ -18,3 +21,29 @@ class TermColor:
         self.WARNING = ''
         self.FAIL = ''
         self.ENDC = ''
+
+
+def read_checkpoint(checkpoint_file):
+    """
+    Return the id of the last object processed by a previous run
+
+    :param checkpoint_file: path to the checkpoint file
+    :return: id or 0 if there is no checkpoint
+    """
+    if os.path.isfile(checkpoint_file):
+        with open(checkpoint_file, 'r') as f:
+            return int(f.read().strip() or 0)
+
+    return 0
+
+
+def write_checkpoint(checkpoint_file, object_id):
+    """
+    Record the id of the last object processed so a later run can resume after it
+
+    :param checkpoint_file: path to the checkpoint file
+    :param object_id: id of the last processed object
+    :return: None
+    """
+    with open(checkpoint_file, 'w') as f:
+        f.write(str(object_id))
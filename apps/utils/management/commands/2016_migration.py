@@ -108,9 +108,16 @@ def import_images():
 
                 # Now that know file exists and we have the image user and category, import image
                 photo = Photo(open(image_file, 'rb'))
-                remote_key = photo.save('u{}_{}_{}'
-                                        .format(user.id, common_models.get_date_stamp_str(), photo.name),
-                                        custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
+                original_hash = photo.get_hash()
+
+                # Files that were imported already, possibly under another name, are not imported again
+                if photo_models.Photo.objects.get_duplicate(original_hash):
+                    print('Skipping {}, already imported'.format(image_file))
+                    continue
+
+                remote_key = photo.save_original('u{}_{}_{}'
+                                                 .format(user.id, common_models.get_date_stamp_str(), photo.name),
+                                                 custom_bucket=settings.STORAGE['IMAGES_ORIGINAL_BUCKET_NAME'])
 
                 # Original image url
                 original_image = '{}{}'.format(settings.ORIGINAL_MEDIA_URL, remote_key)
@@ -120,7 +127,8 @@ def import_images():
 
                 # Save image
                 pic = photo_models.Photo.objects\
-                    .create(user=user, image=image, location=row[7], original_image_url=original_image)
+                    .create(user=user, image=image, location=row[7], original_hash=original_hash,
+                            original_image_url=original_image)
                 pic.save()
                 pic.category = [category]
                 pic.save()
@@ -281,11 +281,18 @@ CELERY_ACCEPT_CONTENT = ['json']
 
 CELERY_RESULT_BACKEND = CELERY_RESULT_BACKEND
 
+# Worker processes are replaced once their resident memory passes this many KB, e.g. after decoding large uploads
+CELERYD_MAX_MEMORY_PER_CHILD = 512 * 1024
+
 CELERYBEAT_SCHEDULE = {
     'send-push-messages': {
         'task': 'send_scheduled_push_notifications',
         'schedule': crontab()  # Executes every minute
     },
+    'collect-photo-renditions': {
+        'task': 'collect_photo_renditions',
+        'schedule': crontab(hour=4, minute=0)  # Executes daily
+    },
 }
 
 # Communication
@@ -358,6 +365,9 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.DjangoModelPermissionsOrAnonReadOnly'
     ],
+    'DEFAULT_THROTTLE_RATES': {
+        'photo_render': '120/hour'
+    },
     'PAGE_SIZE': 12,
     'TEST_REQUEST_DEFAULT_FORMAT': 'json'
 }
@@ -405,6 +415,65 @@ else:
 
     ORIGINAL_MEDIA_URL = MEDIA_URL
 
+# Uploads to S3. Files below the multipart threshold go up in a single request.
+AWS_S3_MAX_CONCURRENCY = 4
+AWS_S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+AWS_S3_MULTIPART_THRESHOLD = 16 * 1024 * 1024
+STORAGE_UPLOAD_THREADS = 8
+
+# Direct uploads of originals through pre-signed POSTs
+PHOTO_UPLOAD_EXPIRES = 60 * 60
+PHOTO_UPLOAD_MAX_SIZE = 50 * 1024 * 1024
+
+# Batch uploads through /api/photos/batch. Their images are compressed and stored by a pool of
+# PHOTO_BATCH_UPLOAD_WORKERS threads shared by every request of a process.
+PHOTO_BATCH_UPLOAD_MAX_IMAGES = 20
+PHOTO_BATCH_UPLOAD_WORKERS = 4
+
+# Image decoding. Images over PHOTO_MAX_PIXELS are refused from their header alone. JPEGs over PHOTO_DECODE_MAX_PIXELS
+# are decoded at a reduced scale, other formats over it are refused. PHOTO_DECODE_PIXEL_BUDGET caps the pixels a process
+# decodes at once (about 4 bytes each).
+PHOTO_DECODE_MAX_PIXELS = 40 * 1000 * 1000
+PHOTO_DECODE_PIXEL_BUDGET = 80 * 1000 * 1000
+PHOTO_MAX_PIXELS = 120 * 1000 * 1000
+
+# Photo ranks are stored and recomputed together this many seconds after the first vote or category change, so
+# reading a rank is a lookup while ranks lag votes by up to this long
+PHOTO_RANK_REFRESH_SECONDS = 30
+
+# Widths rendered by api/photos/{}/render. Requested widths are rounded up to the next one.
+PHOTO_RENDER_WIDTHS = (160, 246, 272, 320, 480, 640, 750, 960, 1242, 1600, 2048)
+PHOTO_RENDER_REDIRECT_MAX_AGE = 24 * 60 * 60
+
+# Renditions are stored under names derived from their content, so they never change and can be cached for good.
+# Rendition files that no photo refers to are deleted once they are older than the grace period.
+PHOTO_RENDITION_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+PHOTO_RENDITION_GC_GRACE_HOURS = 24
+
+# BlurHash placeholders sent inline with photos, with this many components along the longer side of the image
+PHOTO_BLURHASH_COMPONENTS = 4
+
+# JPEG encoding. With a target SSIM, uploads and renditions are encoded at the lowest quality down to
+# PHOTO_JPEG_MIN_QUALITY that keeps them that similar to the image, compared at PHOTO_JPEG_SSIM_WIDTH. None encodes at
+# the fixed quality of each use.
+PHOTO_JPEG_MIN_QUALITY = 60
+PHOTO_JPEG_SSIM_WIDTH = 1024
+PHOTO_JPEG_TARGET_SSIM = None
+
+# Share of uploads also encoded with Pillow's default settings, to record the bytes the encoder settings save
+PHOTO_JPEG_SAVINGS_SAMPLE_RATE = 0.01
+
+# Uploads are fingerprinted by the SHA-256 of their original. A repeated original reuses the stored images and
+# renditions of the first upload; with this set, users uploading the same original again get a validation error.
+PHOTO_REJECT_DUPLICATE_UPLOADS = False
+
+# Near-duplicate search in /admin/photos/<id>/similar/ compares perceptual hashes, matching photos at most
+# PHOTO_SIMILARITY_DISTANCE bits apart unless a distance up to PHOTO_SIMILARITY_MAX_DISTANCE is asked for. The index
+# is kept in memory, picks up new photos on each search and is rebuilt every PHOTO_SIMILARITY_REBUILD_SECONDS.
+PHOTO_SIMILARITY_DISTANCE = 10
+PHOTO_SIMILARITY_MAX_DISTANCE = 12
+PHOTO_SIMILARITY_REBUILD_SECONDS = 60 * 60
+
 # Misc
 
 AUTH_USER_MODEL = 'account.User'
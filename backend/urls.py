@@ -89,9 +89,14 @@ urlpatterns = [
     url(r'api/photos/(?P<pk>[0-9^/]+)/details$', photo_views.PhotoSingleDetailsView.as_view()),
     url(r'api/photos/(?P<pk>[0-9^/]+)/flags$', photo_views.PhotoSingleFlagsViewSet.as_view()),
     url(r'api/photos/(?P<pk>[0-9^/]+)/media$', photo_views.PhotoSingleMediaView.as_view()),
+    url(r'api/photos/(?P<pk>[0-9^/]+)/render$', photo_views.PhotoSingleRenderView.as_view()),
     url(r'api/photos/(?P<pk>[0-9^/]+)/(?P<user_interest>stars|likes)$',
         photo_views.PhotoSingleInterestsViewSet.as_view()),
     url(r'api/photos/top$', photo_views.PhotoAppTopPhotosViewSet.as_view()),
+    url(r'api/photos/batch$', photo_views.PhotoBatchViewSet.as_view()),
+    url(r'api/photos/uploads$', photo_views.PhotoUploadViewSet.as_view()),
+    url(r'api/photos/uploads/(?P<pk>[0-9^/]+)$', photo_views.PhotoUploadSingleViewSet.as_view()),
+    url(r'api/photos/uploads/(?P<pk>[0-9^/]+)/finalize$', photo_views.PhotoUploadFinalizeViewSet.as_view()),
     url(r'api/photos/(?P<pk>[0-9^/]+)/votes', photo_views.PhotoSingleVotesViewSet.as_view()),
 
     # sample
@@ -125,6 +130,7 @@ urlpatterns = [
     url(r'^admin/', admin.site.urls),
     url(r'^admin/photos/$', photo_views.photo_admin),
     url(r'^admin/photos/map/$', photo_views.photo_map_admin),
+    url(r'^admin/photos/(?P<pk>[0-9]+)/similar/$', photo_views.photo_similar_admin),
     url(r'^admin/power_users/$', account_views.power_users_admin),
     url(r'^admin/push/$', communication_views.push_notification_manager),
     url(r'^admin/statistics/$', analytic_views.statistics_admin),